@@ -1,9 +1,15 @@
 #!/usr/bin/python3
 
 import sys
+import heapq
 from args import Args
 from gnuplot import Gnuplot
-from chunks import KWReplayWithCommands, Command
+from chunks import KWReplayWithCommands, Command, ProductionRecord, count_actions
+
+try :
+	import numpy
+except ImportError :
+	numpy = None
 
 
 
@@ -148,13 +154,91 @@ EVT_POWERDOWN = Command.POWERDOWN
 
 
 
+###
+### Priority queue of the FactorySim events, by time_code.
+### Events of the same time_code come out in the order they went in,
+### like they did from the sorted list we used to insert into.
+###
+### Removed events stay in the heap as tombstones (entry[2] = None)
+### and are skipped when they come up.
+### Events that have a factory (queue, hold, construction complete) are also
+### kept by factory, so we don't look through all events to find them.
+###
+class EventQueue() :
+	def __init__( self ) :
+		self.heap = [] # [ time_code, seq, evt ], seq keeps equal time_codes FIFO.
+		self.seq = 0
+		self.live = 0 # events in heap that are not tombstones.
+		self.by_factory = {} # factory -> { seq : entry }
+		self.completions = {} # factory -> entry of its EVT_CONS_COMPLETE
+
+	def __len__( self ) :
+		return self.live
+
+	def push( self, evt ) :
+		entry = [ evt.time_code, self.seq, evt ]
+		self.seq += 1
+		heapq.heappush( self.heap, entry )
+		self.live += 1
+
+		# not hasattr( evt, "factory" ), sell and powerdown.
+		factory = getattr( evt, "factory", None )
+		if factory != None :
+			self.by_factory.setdefault( factory, {} )[ entry[1] ] = entry
+			if evt.cmd_ty == EVT_CONS_COMPLETE :
+				# we only build one at a time in a factory.
+				assert not factory in self.completions
+				self.completions[ factory ] = entry
+
+	# The next event, None if there's none.
+	def pop( self ) :
+		while self.heap :
+			entry = heapq.heappop( self.heap )
+			evt = entry[2]
+			if evt != None :
+				self.forget( entry )
+				return evt
+		return None
+
+	# Take entry out of the indices and make it a tombstone.
+	def forget( self, entry ) :
+		evt = entry[2]
+		factory = getattr( evt, "factory", None )
+		if factory != None :
+			del self.by_factory[ factory ][ entry[1] ]
+			if self.completions.get( factory ) is entry :
+				del self.completions[ factory ]
+		entry[2] = None
+		self.live -= 1
+
+	# All events of the factory.
+	def remove_factory( self, factory ) :
+		entries = self.by_factory.get( factory )
+		if entries :
+			for entry in list( entries.values() ) :
+				self.forget( entry )
+
+	# EVT_CONS_COMPLETE of the factory, None if it isn't building anything.
+	def completion( self, factory ) :
+		entry = self.completions.get( factory )
+		if entry == None :
+			return None
+		return entry[2]
+
+	def remove_completion( self, factory ) :
+		entry = self.completions.get( factory )
+		if entry != None :
+			self.forget( entry )
+
+
+
 # event driven simulator?! w00t
 class FactorySim() :
 	verbose = False
 
 	def __init__( self ) :
 		self.factories = {}
-		self.events = [] # priority queue of events. time in time_code.
+		self.events = EventQueue() # priority queue of events. time in time_code.
 		self.t = 0 # current time (in time code)
 		self.end_time = 0 # game end time (in time code)
 		self.cost = {} # unit cost map
@@ -204,12 +288,7 @@ class FactorySim() :
 
 
 	def remove_evt_with_factory( self, factory ) :
-		for i in reversed( range( len( self.events ) ) ) :
-			evt = self.events[ i ]
-			if not hasattr( evt, "factory" ) :
-				continue
-			if evt.factory == factory :
-				del self.events[ i ]
+		self.events.remove_factory( factory )
 	
 
 
@@ -228,16 +307,14 @@ class FactorySim() :
 		# if something is already in construction...
 		# perhaps we need to defer building it.
 		# (but not hold or cancel.)
-		index = self.find_evt_cons_complete( fa.factory_id )
-		if index >= 0 :
-			under_const = self.events[ index ]
-
+		under_const = self.find_evt_cons_complete( fa.factory_id )
+		if under_const != None :
 			# unheld + in progress. doesn't matter.
 			# don't have to do anything.
 			if unit_ty == under_const.unit_ty :
 				return
 
-			self.events.pop( index ) # remove this.
+			self.events.remove_completion( fa.factory_id ) # remove this.
 			remaining_time = under_const.time_code - self.t
 			fa.countdown[ unit_ty ] # save it to remaining time.
 
@@ -263,6 +340,7 @@ class FactorySim() :
 				assert 0
 
 		evt = Command()
+		evt.rec = ProductionRecord()
 		evt.cmd_ty = EVT_CONS_COMPLETE
 		evt.time_code = self.t + build_time
 		evt.player_id = fa.player_id
@@ -285,18 +363,7 @@ class FactorySim() :
 				print( "unit production past end of game. not inserting." )
 			return
 
-		# find insertion point
-		index = -1
-		for i in range( len( self.events ) ) :
-			e = self.events[ i ]
-			if e.time_code > cmd.time_code :
-				index = i
-				break
-
-		if index == -1 :
-			self.events.append( cmd )
-		else :
-			self.events.insert( index, cmd )
+		self.events.push( cmd )
 
 
 
@@ -351,8 +418,7 @@ class FactorySim() :
 		factory = self.factories[ evt.factory ]
 
 		# shouldn't find anything, as we only queue one at a time.
-		index = self.find_evt_cons_complete( evt.factory )
-		assert index == -1
+		assert self.find_evt_cons_complete( evt.factory ) == None
 
 		# construction done, without being held or canceled.
 		# it is now safe to pop.
@@ -373,41 +439,19 @@ class FactorySim() :
 	
 
 
+	# EVT_CONS_COMPLETE from this factory, None if there's none.
+	# There's at most one, EventQueue.push makes sure of that.
 	def find_evt_cons_complete( self, factory ) :
-		# find EVT_CONS_COMPLETE from this factory.
-		cnt = 0
-		index = -1
-		for i in range( len( self.events ) ) :
-			e = self.events[ i ]
-
-			if not hasattr( e, "factory" ) :
-				continue
-
-			if e.factory != factory :
-				continue
-
-			if e.cmd_ty != EVT_CONS_COMPLETE :
-				continue
-
-			index = i
-			cnt += 1
-
+		evt = self.events.completion( factory )
 		if FactorySim.verbose :
-			print( "find_evt_cons_complete:", cnt )
-		assert 0 <= cnt and cnt <= 1
-
-		return index
+			print( "find_evt_cons_complete:", 0 if evt == None else 1 )
+		return evt
 
 
 
 	def process_evt_sell( self, evt ) :
 		# Kill all events associated with this factory.
-		for i in reversed( range( len( self.events ) ) ) :
-			e = self.events[ i ]
-			if not hasattr( e, "factory" ) :
-				continue
-			if e.factory == evt.target :
-				self.events.pop( i )
+		self.events.remove_factory( evt.target )
 
 	def process_evt_powerdown( self, evt ) :
 		fa = self.factories[ evt.target ]
@@ -416,9 +460,7 @@ class FactorySim() :
 		fa.is_powered_down = not fa.is_powered_down
 
 		if fa.is_powered_down :
-			index = self.find_evt_cons_complete( fa.factory_id )
-			if index >= 0 :
-				self.events.pop( index )
+			self.events.remove_completion( fa.factory_id )
 		else :
 			self.pop_factory( fa )
 
@@ -437,13 +479,13 @@ class FactorySim() :
 		# I get evt_hold!!!!!
 		# It means that I can't assert too much about index.
 
-		index = self.find_evt_cons_complete( fa.factory_id )
+		compl = self.find_evt_cons_complete( fa.factory_id )
 
 		if evt.unit_ty in fa.held :
-			# wrong... assert index == -1
+			# wrong... assert compl == None
 			# I could be canceling units XX while YY is being built.
-			if index != -1 :
-				assert self.events[ index ].unit_ty != evt.unit_ty
+			if compl != None :
+				assert compl.unit_ty != evt.unit_ty
 
 			# already on hold!
 			if evt.cancel_all :
@@ -456,15 +498,14 @@ class FactorySim() :
 				if FactorySim.verbose :
 					print( "\tAlready on hold. Cancel one of this." )
 				fa.cancel_one( evt.unit_ty )
-		elif index != -1 :
+		elif compl != None :
 			# can just right click on the side bar with nothing being built;;
 
-			compl = self.events[ index ]
 			if compl.unit_ty == evt.unit_ty :
 				# if unit type same, remove hold event.
 				# CAN be held, without even starting build.
 				# in that case we may have unequal case too.
-				self.events.pop( index )
+				self.events.remove_completion( fa.factory_id )
 				remaining_time = compl.time_code - evt.time_code
 				fa.countdown[ evt.unit_ty ] = remaining_time
 
@@ -486,7 +527,7 @@ class FactorySim() :
 		if len( self.events ) == 0 :
 			return None
 
-		evt = self.events.pop( 0 )
+		evt = self.events.pop()
 		self.t = evt.time_code # make time go.
 
 		if evt.cmd_ty == EVT_QUEUE :
@@ -513,7 +554,9 @@ class ResourceAnalyzer() :
 
 		self.spents = [ [] for i in range( self.nplayers ) ] # remember who spent what.
 		self.units = [ {} for i in range( self.nplayers ) ] # remember who built what how many.
+		self.builds = [ [] for i in range( self.nplayers ) ] # and when.
 		# spents[ pid ] = [ (t1, cost1), (t2, cost2), ... ]
+		# builds[ pid ] = [ (t1, unit1), ... ], buildings, upgrades and units, in no order.
 	
 
 
@@ -540,9 +583,9 @@ class ResourceAnalyzer() :
 			self.sim.end_time = chunk.time_code
 
 		# step 1. just collect how much is spent at time t, as a list.
+		self.kwr.decode_all()
 		for chunk in self.kwr.replay_body.chunks :
 			for cmd in chunk.commands :
-				chunk.decode_cmd( cmd )
 				self.feed( cmd )
 
 		# step 2. Run build queue simulation.
@@ -552,6 +595,7 @@ class ResourceAnalyzer() :
 				pid, time_code, cost, unit = spent
 				t = int( time_code / 15 )
 				self.spents[ pid ].append( (t, cost) )
+				self.builds[ pid ].append( (t, unit) )
 				self.count_unit( pid, unit )
 
 				# some dirty job...
@@ -675,6 +719,7 @@ class ResourceAnalyzer() :
 		t = int( cmd.time_code / 15 ) # in seconds
 		if cmd.is_placedown() :
 			self.collect( cmd.player_id, t, cmd.cost )
+			self.builds[ cmd.player_id ].append( (t, cmd.building_type) )
 			if cmd.free_unit :
 				# keep track of free harvesters.
 				self.count_unit( cmd.player_id, cmd.free_unit )
@@ -686,6 +731,7 @@ class ResourceAnalyzer() :
 			# But... being only an approximation, I just add 'em immediately,
 			# without queue or anything.
 			self.collect( cmd.player_id, t, cmd.cost )
+			self.builds[ cmd.player_id ].append( (t, cmd.upgrade) )
 		elif cmd.is_queue() :
 			# production Q simulation thingy
 			self.sim.insert_build_evt( cmd )
@@ -714,6 +760,8 @@ class ResourceAnalyzer() :
 			# RA3 cost-buildtime pair.
 			if type( cost ) == tuple :
 				cost, buildtime = cost
+			if cost == None :
+				cost = 0 # placedown of a building we don't know the price of.
 
 			if len( ts ) == 0 :
 				# initial element
@@ -788,6 +836,51 @@ class ResourceAnalyzer() :
 
 
 
+###
+### Sliding window sums for the APM graph, from a prefix sum.
+### per_second[ t ][ pid ] = actions at second t.
+### Returns counts[ t ][ pid ] = per_second[ t ][ pid ] + ... + per_second[ t+interval ][ pid ],
+### the window cut at the end of the game.
+### That's what count_player_actions counted, adding each second to the
+### windows before it, one by one.
+###
+def window_sums( per_second, interval ) :
+	game_len = len( per_second )
+	if game_len == 0 :
+		return []
+	interval = max( interval, -1 ) # -1: empty windows.
+
+	if numpy != None :
+		a = numpy.array( per_second, dtype=numpy.int64 ).reshape( game_len, -1 )
+		cum = numpy.zeros( ( game_len+1, a.shape[1] ), dtype=numpy.int64 )
+		numpy.cumsum( a, axis=0, out=cum[ 1: ] )
+		lo = numpy.arange( game_len )
+		hi = numpy.minimum( lo + interval + 1, game_len )
+		return ( cum[ hi ] - cum[ lo ] ).tolist()
+
+	# cum[ t ] = sum of per_second[ :t ]
+	nplayers = len( per_second[0] )
+	cum = [ [0]*nplayers ]
+	for counts in per_second :
+		cum.append( [ a+b for a, b in zip( cum[-1], counts ) ] )
+	result = []
+	for t in range( game_len ) :
+		hi = cum[ min( t + interval + 1, game_len ) ]
+		result.append( [ a-b for a, b in zip( hi, cum[ t ] ) ] )
+	return result
+
+
+
+###
+### Average APM of each player, straight from the file. See chunks.count_actions.
+### Same as APMAnalyzer.calc_avg_apm, without loading the commands.
+###
+def quick_avg_apm( fname ) :
+	kwr, counts, game_len = count_actions( fname )
+	return [ cnt / (game_len/60) for cnt in counts ]
+
+
+
 class APMAnalyzer() :
 	def __init__( self, kwr_chunks ) :
 		self.kwr = kwr_chunks
@@ -823,29 +916,40 @@ class APMAnalyzer() :
 
 	
 
+	# per_second[ t ][ pid ] = actions of pid at second t.
+	# This is the only walk over the commands. The windows, averages and peaks
+	# are all made from this.
+	def count_per_second( self, cmds_at_second ) :
+		per_second = [ [0]*self.nplayers for i in range( len( cmds_at_second ) ) ]
+		for t in range( len( cmds_at_second ) ) :
+			counts = per_second[ t ]
+			for cmd in cmds_at_second[ t ] :
+				pid = cmd.player_id
+				if pid < self.nplayers :
+					# interesting, why do we get this?
+					counts[ pid ] += 1
+		return per_second
+
+
+
 	# returns:
-	# counts_at_secont[ t ] = commands in [t-interval, t].
+	# counts_at_second[ t ] = commands in [t, t+interval], cut at the end of the game.
+	# (each second is counted in the windows of the interval seconds before it.)
 	def count_player_actions( self, interval, cmds_at_second ) :
-		counts_at_second = [ [0]*self.nplayers for i in range( len( cmds_at_second ) ) ]
-		# counts_at_second[ sec ][ pid ] = action counts at sec for that player.
+		return window_sums( self.count_per_second( cmds_at_second ), interval )
 
-		for sec in range( len( cmds_at_second ) ) :
-			left = max( 0, sec - interval )
 
-			# count commands!
-			for t in range( left, sec+1 ) : # range [left, sec+1)
-				for cmd in cmds_at_second[ sec ] :
-					#if cmd.cmd_id == 0x61 : # 30s heart beat
-					#	continue
-					# Come on, just one command!
 
-					pid = cmd.player_id
-					if pid < self.nplayers :
-						# interesting, why do we get this?
-						counts_at_second[ t ][ pid ] += 1
+	# counts_at_second, apmss, avg_apms and peaks, all from one walk over the commands.
+	def calc_apm_stats( self, interval ) :
+		cmds_at_second = self.group_commands_by_time()
+		per_second = self.count_per_second( cmds_at_second )
+		counts_at_second = window_sums( per_second, interval )
+		apmss = self.make_apmss( interval, counts_at_second )
+		avg_apms = self.calc_avg_apm( cmds_at_second, per_second=per_second )
+		peaks = self.calc_peak_apm( apmss )
+		return counts_at_second, apmss, avg_apms, peaks
 
-		return counts_at_second
-	
 
 
 	def emit_apm_csv( self, interval, file=None ) :
@@ -856,7 +960,6 @@ class APMAnalyzer() :
 		counts_at_second = self.count_player_actions( interval, cmds_at_second )
 		# actions counted for that second...
 
-		ts = [ t for t in range( len( counts_at_second ) ) ]
 		apmss = self.make_apmss( interval, counts_at_second )
 		#apmss[pid][t] = apm at time t, of player pid.
 
@@ -868,45 +971,28 @@ class APMAnalyzer() :
 			print( '"' + sanitize_name( player  ) + '"', end=",", file=file )
 		print( file=file )
 
+		pids = [ i for i in range( self.nplayers ) if self.kwr.players[i].is_player() ]
 		for t in range( len( counts_at_second ) ) :
-			counts = counts_at_second[ t ]
-			print( t, end=",", file=file )
-			for i in range( self.nplayers ) :
-				player = self.kwr.players[i]
-				if not player.is_player() :
-					continue
-				apm = counts[ i ]
-				apm *= 60/interval
-				print( apm, end=",", file=file )
-			print( file=file )
-	
+			line = [ str( t ) ] + [ str( apmss[ i ][ t ] ) for i in pids ]
+			print( ",".join( line ), end=",\n", file=file )
 
 
-	def calc_avg_apm( self, cmds_at_second ) :
-		avg_apms = [ 0 ] * self.nplayers
-		game_len = len( cmds_at_second )
 
-		# counts_at_second[t][pid] = count
+	# per_second: count_per_second of cmds_at_second, if you have it already.
+	def calc_avg_apm( self, cmds_at_second, per_second=None ) :
+		game_len = len( cmds_at_second )
+		if per_second == None :
+			per_second = self.count_per_second( cmds_at_second )
 
 		# count commands for the whole game.
-		for t in range( game_len ) :
-			commands = cmds_at_second[ t ]
-			for cmd in commands :
-				pid = cmd.player_id
-				avg_apms[ pid ] += 1
+		avg_apms = [ sum( counts ) for counts in zip( *per_second ) ]
+		if not avg_apms :
+			avg_apms = [ 0 ] * self.nplayers
 
 		# now, get avg.
 		for pid in range( self.nplayers ) :
 			avg_apms[ pid ] /= (game_len/60)
 
-		# lets print
-		#for pid in range( self.nplayers ) :
-		#	player = self.kwr.players[i]
-		#	if not player.is_player() :
-		#		continue
-		#	name = sanitize_name( player, xor=True )
-		#	# print( name, avg_apms[ pid ] )
-
 		return avg_apms
 
 
@@ -962,10 +1048,10 @@ class APMAnalyzer() :
 			peak_time = 0
 			peak_apm = 0
 
-			for t, apm in enumerate( apms ) :
-				if apm > peak_apm :
-					peak_apm = apm
-					peak_time = t
+			# the first time it got that high.
+			if apms and max( apms ) > peak_apm :
+				peak_apm = max( apms )
+				peak_time = apms.index( peak_apm )
 
 			peaks.append( (peak_time, peak_apm) )
 
@@ -973,9 +1059,7 @@ class APMAnalyzer() :
 
 
 
-	def draw_peak_labels( self, plt, apmss ) :
-		peak_apms = self.calc_peak_apm( apmss )
-
+	def draw_peak_labels( self, plt, peak_apms ) :
 		max_apm = 0
 		for pid in range( self.nplayers ) :
 			player = self.kwr.players[pid]
@@ -1011,13 +1095,11 @@ class APMAnalyzer() :
 		plt = Gnuplot()
 		plt.open()
 
-		cmds_at_second = self.group_commands_by_time()
-		counts_at_second = self.count_player_actions( interval, cmds_at_second )
+		counts_at_second, apmss, avg_apms, peaks = self.calc_apm_stats( interval )
 		# actions counted for that second...
+		#apmss[pid][t] = apm at time t, of player pid.
 
 		ts = [ t for t in range( len( counts_at_second ) ) ]
-		apmss = self.make_apmss( interval, counts_at_second )
-		#apmss[pid][t] = apm at time t, of player pid.
 
 		plt.xlabel( "Time (s)" )
 		plt.ylabel( "APM" )
@@ -1038,11 +1120,10 @@ class APMAnalyzer() :
 		# draw legend
 		plt.legend( labels )
 
-		avg_apms = self.calc_avg_apm( cmds_at_second )
 		avg_apm_texts = self.avg_apm2txts( avg_apms )
 
 		# draw peak arrow.
-		self.draw_peak_labels( plt, apmss )
+		self.draw_peak_labels( plt, peaks )
 
 		# now the plot begins.
 		plt.write( 'plot \\\n' ) # begin the plot command.
@@ -1064,21 +1145,20 @@ class APMAnalyzer() :
 
 
 	def make_apmss( self, interval, counts_at_second ) :
+		#apmss[pid][t] = apm at time t, of player pid. 0 for non-players.
+		if counts_at_second :
+			countss = list( zip( *counts_at_second ) ) # countss[pid][t]
+		else :
+			countss = [ () ] * self.nplayers
+
 		apmss = []
 		for i in range( self.nplayers ) :
-			apmss.append( [0] * len( counts_at_second ) )
-
-		#apmss[pid][t] = apm at time t, of player pid.
-
-		for t in range( len( counts_at_second ) ) :
-			counts = counts_at_second[ t ]
-			for i in range( self.nplayers ) :
-				player = self.kwr.players[i]
-				if not player.is_player() :
-					continue
-				apm = counts[ i ]
-				apm *= 60/interval
-				apmss[ i ][ t ] = apm
+			player = self.kwr.players[i]
+			if not player.is_player() :
+				apmss.append( [0] * len( counts_at_second ) )
+			else :
+				scale = 60/interval
+				apmss.append( [ count * scale for count in countss[ i ] ] )
 
 		return apmss
 
@@ -1105,9 +1185,9 @@ class PositionDumper() :
 		commandss = [ [] for i in range( self.nplayers ) ]
 
 		# except for heart beat, all are commands.
+		self.kwr.decode_all()
 		for chunk in self.kwr.replay_body.chunks :
 			for cmd in chunk.commands :
-				chunk.decode_cmd( cmd )
 				if cmd.has_pos() :
 					commands = commandss[ cmd.player_id ]
 					commands.append( cmd )
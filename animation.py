@@ -283,10 +283,10 @@ class TimelineAnalyzer() :
 			eventss = [ [] for i in range( self.length ) ]
 			eventsss[ i ] = eventss
 
+		self.kwr.decode_all()
 		for chunk in self.kwr.replay_body.chunks :
 			time = int( chunk.time_code/15 )
 			for cmd in chunk.commands :
-				chunk.decode_cmd( cmd )
 				if cmd.cmd_ty :
 					if cmd.is_eog() :
 						cmd.player_id = cmd.target # override owner!
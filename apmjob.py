@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+# coding: utf8
+
+###
+### APMs of a whole folder, in the background.
+### The replay viewer used to calculate them one replay at a time, when the
+### replay was clicked. This does the folder in a process pool, from a
+### thread of its own, and puts them in the index (keyed by content hash).
+### The viewer then only looks them up.
+###
+### Replays whose hash is known (same size and mtime as last time) and
+### that have APMs already are skipped without reading them.
+###
+### cancel() is seen within POLL seconds. The ones being calculated are
+### let go, their results are thrown away.
+###
+
+import os
+import sys
+import time
+import threading
+import concurrent.futures
+import analyzer
+from scanner import list_replays
+from replayindex import ReplayIndex
+from utils import hash_file
+
+
+
+# Runs in the workers, like scanner.parse_header.
+# Returns ( sha1, apms, None ) or ( None, None, "Type: msg" ).
+def calc_apm( fname ) :
+	try :
+		sha1 = hash_file( fname )
+		apms = [ int( val ) for val in analyzer.quick_avg_apm( fname ) ]
+		return sha1, apms, None
+	except Exception as e :
+		return None, None, "%s: %s" % ( type( e ).__name__, e )
+
+
+
+class APMJob :
+	POLL = 0.2 # seconds between looks at the stop event, while calculating.
+
+	# index_fname: the ReplayIndex db. The job opens its own connection,
+	#     sqlite connections can't be shared between threads.
+	# workers: pool size, None for one less than the CPUs, the UI needs one too.
+	#     1 calculates in the job thread.
+	# progress: called as progress( done, total ) from the job thread,
+	#     after each replay and once at the end, when finished is True.
+	#     wx.CallAfter it for the UI.
+	def __init__( self, path, index_fname="cache.db", workers=None, progress=None ) :
+		self.path = path
+		self.index_fname = index_fname
+		self.workers = workers
+		if self.workers == None :
+			self.workers = max( 1, ( os.cpu_count() or 1 ) - 1 )
+		self.progress = progress
+
+		self.stop_event = threading.Event()
+		self.thread = None
+
+		self.total = 0 # replays in the folder
+		self.done = 0 # of them, calculated or cached
+		self.calculated = 0 # calculated by us
+		self.errors = [] # ( full name, message )
+		self.finished = False # True for the last progress call.
+
+	def start( self ) :
+		self.thread = threading.Thread( target=self.run, name="apm-job", daemon=True )
+		self.thread.start()
+
+	def cancel( self ) :
+		self.stop_event.set()
+
+	def cancelled( self ) :
+		return self.stop_event.is_set()
+
+	def join( self, timeout=None ) :
+		if self.thread :
+			self.thread.join( timeout )
+
+	def is_alive( self ) :
+		return self.thread != None and self.thread.is_alive()
+
+	def report( self ) :
+		if self.progress :
+			self.progress( self.done, self.total )
+
+
+
+	def run( self ) :
+		index = ReplayIndex( self.index_fname )
+		try :
+			todo = self.find_todo( index )
+			self.report()
+			if todo and not self.cancelled() :
+				self.calc_all( index, todo )
+		finally :
+			index.close()
+			self.finished = True
+			self.report()
+
+	# ( full name, stat ) of the replays without APMs.
+	def find_todo( self, index ) :
+		fnames = list_replays( self.path )
+		self.total = len( fnames )
+		todo = []
+		for f in fnames :
+			full_name = os.path.join( self.path, f )
+			try :
+				st = os.stat( full_name )
+			except OSError as e :
+				self.errors.append( ( full_name, str( e ) ) )
+				continue
+			sha1 = index.lookup_hash( full_name, st )
+			if sha1 == None :
+				# The hash is kept with the header, make sure there is one.
+				# The viewer has them all, this is for folders it hasn't seen.
+				try :
+					index.load_header( full_name )
+				except Exception :
+					pass # calc_apm will tell what's wrong with it.
+			elif index.lookup_apm( sha1 ) != None :
+				self.done += 1
+				continue
+			todo.append( ( full_name, st ) )
+		index.commit() # the headers we parsed, if any.
+		return todo
+
+	def calc_all( self, index, todo ) :
+		if self.workers <= 1 :
+			for full_name, st in todo :
+				if self.cancelled() :
+					break
+				self.store( index, full_name, st, calc_apm( full_name ) )
+			return
+
+		executor = concurrent.futures.ProcessPoolExecutor( max_workers=self.workers )
+		futures = {}
+		try :
+			for full_name, st in todo :
+				futures[ executor.submit( calc_apm, full_name ) ] = ( full_name, st )
+			# Waits a little at a time, a long replay doesn't hold up the cancel.
+			pending = set( futures )
+			while pending and not self.cancelled() :
+				done, pending = concurrent.futures.wait( pending, timeout=self.POLL,
+					return_when=concurrent.futures.FIRST_COMPLETED )
+				for future in done :
+					if self.cancelled() :
+						break
+					full_name, st = futures[ future ]
+					self.store( index, full_name, st, future.result() )
+		finally :
+			# On cancel, drop the ones that haven't started and
+			# don't wait for the ones that are being calculated.
+			# (shutdown's cancel_futures is 3.9+, we do it ourselves.)
+			for future in futures :
+				future.cancel()
+			executor.shutdown( wait=not self.cancelled() )
+
+	# result of calc_apm
+	# Committed one by one, so the viewer never waits for the db behind us.
+	def store( self, index, full_name, st, result ) :
+		sha1, apms, err = result
+		self.done += 1
+		if sha1 == None :
+			self.errors.append( ( full_name, err ) )
+		else :
+			# st is from before hashing, if it changed since, the hash is not kept.
+			index.store_hash( full_name, st, sha1 )
+			index.save_apm( sha1, apms ) # commits
+			self.calculated += 1
+		self.report()
+
+
+
+###
+### Calculate a folder and see how long it takes.
+###
+###   python3 apmjob.py [path] [workers]
+###
+def main() :
+	path = "."
+	workers = None
+	if len( sys.argv ) >= 2 :
+		path = sys.argv[1]
+	if len( sys.argv ) >= 3 :
+		workers = int( sys.argv[2] )
+
+	def progress( done, total ) :
+		print( "\r%d/%d" % ( done, total ), end="", flush=True )
+
+	job = APMJob( path, workers=workers, progress=progress )
+	t = time.perf_counter()
+	job.start()
+	try :
+		while job.is_alive() :
+			job.join( 0.5 )
+	except KeyboardInterrupt :
+		job.cancel()
+		job.join()
+	t = time.perf_counter() - t
+	print()
+	for fname, err in job.errors :
+		print( fname, err )
+	print( "%d replays: %d calculated, %d failed, %.2f s" % ( job.total,
+		job.calculated, len( job.errors ), t ) )
+
+if __name__ == "__main__" :
+	main()
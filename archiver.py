@@ -0,0 +1,325 @@
+#!/usr/bin/python3
+# coding: utf8
+
+###
+### Bulk replay ingester, no GUI.
+### For the dumps of thousands of tournament replays that the viewer can't cope with.
+###
+### Walks a directory tree, parses the headers and hashes the contents in a
+### process pool, names each replay with Watcher.calc_name (same options as
+### config.ini) and puts it in a dated archive:
+###
+###   archive/KW/2014/12/[2014-12-06T1132] A vs B.KWReplay
+###
+### Replays with the same content are only archived once, whether they are
+### twice in the dump or already in the archive. Only the archive files with
+### the size of a new replay are hashed, not the whole archive.
+### Two different replays with the same name get " (2)", " (3)"...
+###
+###   python3 archiver.py dump archive [copy|move|link|dry] [workers] [config]
+###
+### dump is a folder or a .zip, the replays in a zip are read from it directly.
+### copy is the default. link makes hardlinks (copies across drives).
+### move leaves the duplicates where they are, they are listed at the end.
+### Replays in a zip are always copied, the zip is left as it is.
+### dry only prints the plan.
+###
+
+import io
+import os
+import sys
+import time
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import concurrent.futures
+from kwreplay import KWReplay
+from scanner import Scanner, walk_replays, REPLAY_EXTS
+from args import Args
+from watcher import Watcher
+from utils import clone_file, hash_file
+
+
+
+def is_zip( path ) :
+	return os.path.isfile( path ) and zipfile.is_zipfile( path )
+
+# The replays of a dump, as sources:
+# ( file name, None ) for the files of a folder, ( zip name, member ) for a zip.
+def list_sources( path ) :
+	if not is_zip( path ) :
+		return [ ( fname, None ) for fname in walk_replays( path ) ]
+	zf = zipfile.ZipFile( path )
+	try :
+		members = [ member for member in zf.namelist()
+			if os.path.splitext( member )[1].lower() in REPLAY_EXTS ]
+	finally :
+		zf.close()
+	return [ ( path, member ) for member in sorted( members ) ]
+
+# For the reports.
+def source_name( source ) :
+	fname, member = source
+	if member == None :
+		return fname
+	return os.path.join( fname, member )
+
+# Open zips of this process, reading the directory of a big zip for every
+# member would be slow. By pid, the forked workers must not share the file.
+zips = {}
+
+def open_zip( fname ) :
+	key = ( os.getpid(), fname )
+	if not key in zips :
+		zips[ key ] = zipfile.ZipFile( fname )
+	return zips[ key ]
+
+
+
+# Runs in the workers, like scanner.parse_header.
+# A zip member is read once, the hash and the header are from the same bytes.
+# Returns ( KWReplay, sha1, size, None ) or ( None, None, None, "Type: msg" ).
+def examine( source ) :
+	fname, member = source
+	try :
+		if member == None :
+			kwr = KWReplay( fname=fname )
+			return kwr, hash_file( fname ), os.path.getsize( fname ), None
+
+		data = open_zip( fname ).read( member )
+		kwr = KWReplay()
+		kwr.fname = member
+		kwr.guess_game( member )
+		kwr.loadFromStream( io.BytesIO( data ) )
+		return kwr, hashlib.sha1( data ).hexdigest(), len( data ), None
+	except Exception as e :
+		return None, None, None, "%s: %s" % ( type( e ).__name__, e )
+
+
+
+class Archiver :
+	MODES = [ "copy", "move", "link", "dry" ]
+
+	# args: Args, for the naming options and the akas.
+	# workers: pool size, None for one per CPU. 1 works without a pool.
+	def __init__( self, root, args, mode="copy", workers=None ) :
+		assert mode in Archiver.MODES
+		self.root = root
+		self.args = args
+		self.mode = mode
+		self.workers = workers
+		self.min_parallel = Scanner.MIN_PARALLEL
+
+		self.sizes = None # size -> full names in the archive, made on the first need.
+		self.hashes = {} # sha1 -> archived full name, hashed or archived by us.
+		self.hashed = set() # archive files we've hashed already.
+
+		# By source_name.
+		self.archived = [] # ( source, destination )
+		self.duplicates = [] # ( source, the one in the archive )
+		self.errors = [] # ( source, message )
+
+	# Where kwr goes in the archive, without the " (2)".
+	def target( self, kwr, fname ) :
+		args = self.args
+		ext = os.path.splitext( fname )[1]
+		name = Watcher.calc_name( kwr, add_username=args.add_username,
+				add_faction=args.add_faction, add_vs_info=args.add_vs_info,
+				custom_date_format=args.custom_date_format, ext=ext )
+		folder = kwr.decode_timestamp( kwr.timestamp, date_format="%Y" + os.sep + "%m" )
+		return os.path.join( self.root, kwr.game, folder, name )
+
+
+
+	###
+	### Duplicates
+	###
+	def scan_sizes( self ) :
+		self.sizes = {}
+		if not os.path.isdir( self.root ) :
+			return
+		for fname in walk_replays( self.root ) :
+			try :
+				size = os.path.getsize( fname )
+			except OSError :
+				continue
+			self.sizes.setdefault( size, [] ).append( fname )
+
+	# The archived replay with this content, or None.
+	def find_same( self, sha1, size ) :
+		if self.sizes == None :
+			self.scan_sizes()
+		# Hash the archive files of the same size, once.
+		for fname in self.sizes.get( size, [] ) :
+			if fname in self.hashed :
+				continue
+			self.hashed.add( fname )
+			try :
+				self.hashes.setdefault( hash_file( fname ), fname )
+			except OSError :
+				pass
+		return self.hashes.get( sha1 )
+
+	def remember( self, fname, sha1, size ) :
+		self.hashes[ sha1 ] = fname
+		self.hashed.add( fname )
+		self.sizes.setdefault( size, [] ).append( fname )
+
+	# dest, or dest with " (2)"... if dest is taken.
+	def free_name( self, dest, taken ) :
+		prefix, ext = os.path.splitext( dest )
+		i = 1
+		while dest in taken or os.path.exists( dest ) :
+			i += 1
+			dest = "%s (%d)%s" % ( prefix, i, ext )
+		return dest
+
+
+
+	###
+	### Archiving
+	###
+	def put( self, source, dest ) :
+		if self.mode == "dry" :
+			return
+		src, member = source
+		os.makedirs( os.path.dirname( dest ), exist_ok=True )
+		if member == None and self.mode == "move" :
+			shutil.move( src, dest )
+			return
+		if member == None and self.mode == "link" :
+			try :
+				os.link( src, dest )
+				return
+			except OSError :
+				pass # other drive or no hardlinks there, copy it.
+
+		# Into a tmp file first, a half copied replay never has the real name.
+		fd, tmpf = tempfile.mkstemp( prefix="tmp", suffix=os.path.splitext( dest )[1],
+				dir=os.path.dirname( dest ) )
+		try :
+			if member == None :
+				clone_file( src, fd )
+			else :
+				self.extract( src, member, fd )
+		except :
+			os.close( fd )
+			os.remove( tmpf )
+			raise
+		os.close( fd )
+		if member == None :
+			shutil.copystat( src, tmpf )
+		else :
+			# zips keep local time, in 2 second steps.
+			t = time.mktime( open_zip( src ).getinfo( member ).date_time + ( 0, 0, -1 ) )
+			os.utime( tmpf, ( t, t ) )
+		os.replace( tmpf, dest )
+
+	def extract( self, src, member, fd ) :
+		sf = open_zip( src ).open( member )
+		df = open( fd, "wb", closefd=False )
+		try :
+			shutil.copyfileobj( sf, df )
+		finally :
+			df.close()
+			sf.close()
+
+	# Parse results of the pool, in order.
+	def examine_all( self, sources ) :
+		workers = self.workers
+		if workers == None :
+			workers = os.cpu_count() or 1
+		if workers <= 1 or len( sources ) < self.min_parallel :
+			for result in map( examine, sources ) :
+				yield result
+			return
+
+		with concurrent.futures.ProcessPoolExecutor( max_workers=workers ) as executor :
+			chunksize = max( 1, min( Scanner.BATCH, len( sources ) // ( workers*4 ) ) )
+			for result in executor.map( examine, sources, chunksize=chunksize ) :
+				yield result
+
+	# path: a folder or a zip.
+	def ingest( self, path ) :
+		sources = list_sources( path )
+		taken = set() # destinations given out in this run, for dry runs.
+		for source, ( kwr, sha1, size, err ) in zip( sources, self.examine_all( sources ) ) :
+			name = source_name( source )
+			if kwr == None :
+				self.errors.append( ( name, err ) )
+				continue
+
+			same = self.find_same( sha1, size )
+			if same :
+				self.duplicates.append( ( name, same ) )
+				continue
+
+			dest = self.free_name( self.target( kwr, name ), taken )
+			try :
+				self.put( source, dest )
+			except OSError as e :
+				self.errors.append( ( name, "%s: %s" % ( type( e ).__name__, e ) ) )
+				continue
+			taken.add( dest )
+			self.remember( dest, sha1, size )
+			self.archived.append( ( name, dest ) )
+		return len( sources )
+
+	def report( self, limit=20 ) :
+		lines = []
+		if self.errors :
+			lines.append( "%d invalid replay(s):" % len( self.errors ) )
+			for fname, err in self.errors[ :limit ] :
+				lines.append( "%s (%s)" % ( fname, err ) )
+			if len( self.errors ) > limit :
+				lines.append( "... and %d more." % ( len( self.errors ) - limit ) )
+		# Moving, the dump is supposed to end up empty. It doesn't.
+		if self.mode == "move" and self.duplicates :
+			lines.append( "%d duplicate(s) left in the dump:" % len( self.duplicates ) )
+			for fname, same in self.duplicates[ :limit ] :
+				lines.append( "%s (same as %s)" % ( fname, same ) )
+			if len( self.duplicates ) > limit :
+				lines.append( "... and %d more." % ( len( self.duplicates ) - limit ) )
+		return "\n".join( lines )
+
+
+
+def main() :
+	if len( sys.argv ) < 3 :
+		print( "Usage: python3 archiver.py dump archive [copy|move|link|dry] [workers] [config]" )
+		print( "dump: a folder or a .zip of replays." )
+		sys.exit( 1 )
+	src = sys.argv[1]
+	root = sys.argv[2]
+	mode = "copy"
+	workers = None
+	configf = "config.ini"
+	if len( sys.argv ) >= 4 :
+		mode = sys.argv[3]
+	if len( sys.argv ) >= 5 :
+		workers = int( sys.argv[4] )
+	if len( sys.argv ) >= 6 :
+		configf = sys.argv[5]
+	if not mode in Archiver.MODES :
+		print( "Unknown mode", mode, "- one of", ", ".join( Archiver.MODES ) )
+		sys.exit( 1 )
+
+	args = Args( configf, ask=False )
+	archiver = Archiver( root, args, mode=mode, workers=workers )
+	t = time.perf_counter()
+	cnt = archiver.ingest( src )
+	t = time.perf_counter() - t
+
+	if mode == "dry" :
+		for fname, dest in archiver.archived :
+			print( fname, "->", dest )
+	print( archiver.report() )
+	if mode == "move" and is_zip( src ) :
+		print( "The replays in the zip were copied, it is left as it is." )
+	print( "%d replays: %d archived, %d duplicates, %d invalid" % ( cnt,
+		len( archiver.archived ), len( archiver.duplicates ), len( archiver.errors ) ) )
+	print( "%.2f s, %.0f files/s" % ( t, cnt / t if t > 0 else 0 ) )
+
+if __name__ == "__main__" :
+	main()
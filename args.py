@@ -2,8 +2,9 @@
 # -*- coding: utf8 -*-
 import os, time, shutil
 import configparser
-import wx
 import io
+# wx is imported where the dialogs are, so that the headless watcher service
+# (watchservice.py) can use the configuration without wx.
 
 
 ###
@@ -17,7 +18,9 @@ import io
 class Args :
 	args = None
 
-	def __init__( self, fname, game='kw' ) :
+	# ask: ask the user for the last replay (with a dialog) if it isn't set.
+	#     The watcher service has no last replay option and no GUI, it passes False.
+	def __init__( self, fname, game='kw', ask=True ) :
 		# Yeah global variable!
 		# Cos one program can have only one configuration duh...
 		# I'm tired of copying args to everywhere.
@@ -35,6 +38,7 @@ class Args :
 		self.add_faction = False
 		self.custom_date_format = None
 		self.mcmap = dict() # map crc to 1.02+R dict.
+		self.ask = ask
 
 		self.cfg = self.load_from_file( fname )
 
@@ -129,6 +133,12 @@ class Args :
 	
 	def set_aka( self, uid, aka ) :
 		return self.set_var( uid, aka, section='akas' )
+
+	# uid -> aka, all of them.
+	def get_akas( self ) :
+		if not self.cfg.has_section( 'akas' ) :
+			return {}
+		return dict( self.cfg[ 'akas' ] )
 	
 	def akaed_name( self, p ) :
 		name = p.name
@@ -150,6 +160,7 @@ class Args :
 	# Make user to choose the last replay file.
 	def set_last_replay( self ) :
 		# Well, I'll turn to wxPython for dialogs.
+		import wx
 		# It is asserted that some kind of wx.App() instance is initialized by
 		# the user of this class.
 		diag = wx.FileDialog( None, "Open the last replay file", "", "",
@@ -204,7 +215,8 @@ class Args :
 			self.cfg.read( fname )
 
 		self.last_replay = self.get_var( 'last_replay' )
-		if not self.last_replay :
+		if not self.last_replay and self.ask :
+			import wx
 			wx.MessageBox( "Please select the last replay file!" )
 			self.set_last_replay() # ask the user for it. it is a critical var!
 
@@ -252,6 +264,7 @@ class Args :
 
 
 def main() :
+	import wx
 	# Open config
 	app = wx.App( None ) # needed for event processing for the MsgBox.
 	args = Args( "config.ini" )
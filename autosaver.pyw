@@ -2,10 +2,16 @@
 # -*- coding: utf8 -*-
 import sys
 import os
+import multiprocessing
 
-# we need to redirect some pipes BEFORE importing wx.
-sys.stdout = open(os.devnull, 'w')
-sys.stderr = open(os.devnull, 'w')
+# The replay scanner uses a process pool. The workers import this file too,
+# (Windows has no fork) so everything goes under __main__.
+if __name__ == "__main__" :
+	# we need to redirect some pipes BEFORE importing wx.
+	sys.stdout = open(os.devnull, 'w')
+	sys.stderr = open(os.devnull, 'w')
 
-import autosaverapp
-autosaverapp.main( 'kw', 'config.ini' )
+	multiprocessing.freeze_support()
+
+	import autosaverapp
+	autosaverapp.main( 'kw', 'config.ini' )
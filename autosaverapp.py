@@ -20,6 +20,7 @@ import wx.adv
 from args import Args
 from watcher import Watcher
 from replayviewer import ReplayViewer
+from replayindex import ReplayIndex
 from dateformatcustomizer import DateFormatCustomizer
 
 
@@ -29,9 +30,12 @@ class AutoSaverAppIcon( wx.adv.TaskBarIcon ) :
 		super().__init__()
 
 		self.args = Args.args
-		self.POLL_INTERVAL = 2000 # in msec
 		self.frame = frame
-		self.watcher = Watcher( self.args.last_replay )
+		# One index for the watcher and the viewer.
+		self.index = ReplayIndex( 'cache.db' )
+		self.watcher = Watcher( self.args.last_replay, index=self.index )
+		# in msec. inotify tells us when the replay changes, we can check often.
+		self.POLL_INTERVAL = self.watcher.backend.INTERVAL
 
 		#
 		# now wx stuff
@@ -138,7 +142,7 @@ class AutoSaverAppIcon( wx.adv.TaskBarIcon ) :
 	
 	def open_replay_viewer( self ) :
 		# parent pointer looks wonky but it works!
-		replay_viewer = ReplayViewer( wx.GetApp().TopWindow )
+		replay_viewer = ReplayViewer( wx.GetApp().TopWindow, index=self.index )
 		replay_viewer.Show( True )
 		replay_viewer.Raise()
 
@@ -150,13 +154,16 @@ class AutoSaverAppIcon( wx.adv.TaskBarIcon ) :
 
 		self.timer.Stop()
 		self.watcher.last_replay = self.args.last_replay # and pass the information to watcher.
-		self.watcher = Watcher( self.args.last_replay ) # re-init watcher to prevent bug.
+		self.watcher.close()
+		self.watcher = Watcher( self.args.last_replay, index=self.index ) # re-init watcher to prevent bug.
 			# If you switch games or change last repaly, the watcher thinks the
 			# replay has changed! In a sense, it is correct but it's not the time to sample the replay.
 		self.timer.Start()
 
 	def on_exit(self, event):
 		self.args.save()
+		self.watcher.close()
+		self.index.close()
 		self.Destroy() # self kill
 		self.frame.Destroy() # parent kill
 		# These two kills will kill all frames of the app, exiting the app!
@@ -0,0 +1,883 @@
+#!/usr/bin/python3
+# coding: utf8
+
+###
+### Benchmarks for the replay decoding stuff.
+### Run it in the top directory, where cornercases/, tw/ and ra3/ are.
+###
+###   python3 benchmark.py          runs everything
+###   python3 benchmark.py header   runs just one of them
+###
+
+import sys
+import os
+import io
+import time
+import pickle
+import tarfile
+import contextlib
+import subprocess
+from kwreplay import KWReplay
+
+
+
+REPLAY_DIRS = [ "cornercases", "tw", "ra3" ]
+REPLAY_EXTS = [ ".kwreplay", ".kwr", ".cnc3replay", ".ra3replay" ]
+
+
+
+def replay_files( dirs=REPLAY_DIRS ) :
+	fnames = []
+	for d in dirs :
+		if not os.path.isdir( d ) :
+			continue
+		for f in sorted( os.listdir( d ) ) :
+			ext = os.path.splitext( f )[1].lower()
+			if ext in REPLAY_EXTS :
+				fnames.append( os.path.join( d, f ) )
+	return fnames
+
+
+
+# run func repeat times, return the best time in seconds.
+def best_of( func, repeat ) :
+	best = None
+	for i in range( repeat ) :
+		t = time.perf_counter()
+		func()
+		t = time.perf_counter() - t
+		if best == None or t < best :
+			best = t
+	return best
+
+
+
+def report( name, t, cnt, unit ) :
+	print( "%-28s %8.2f ms  %10.0f %s/s" % ( name, t*1000, cnt/t, unit ) )
+
+
+
+###
+### Header parsing: field by field (legacy) vs one bulk read.
+###
+def header_fields( kwr ) :
+	fields = dict( vars( kwr ) )
+	fields[ "players" ] = [ vars( p ) for p in kwr.players ]
+	return fields
+
+def load_header( fname, legacy ) :
+	kwr = KWReplay()
+	kwr.guess_game( fname )
+	f = open( fname, 'rb' )
+	if legacy :
+		kwr.loadFromStreamLegacy( f )
+	else :
+		kwr.loadFromStream( f )
+	pos = f.tell()
+	f.close()
+	return kwr, pos
+
+def bench_header( fnames, repeat=5 ) :
+	print( "-- header parsing,", len( fnames ), "replays" )
+
+	for fname in fnames :
+		old, old_pos = load_header( fname, True )
+		new, new_pos = load_header( fname, False )
+		assert header_fields( old ) == header_fields( new ), fname
+		assert old_pos == new_pos, fname
+	print( "Legacy and fast parsers agree on all replays." )
+
+	def run( legacy ) :
+		for fname in fnames :
+			load_header( fname, legacy )
+
+	t_old = best_of( lambda : run( True ), repeat )
+	t_new = best_of( lambda : run( False ), repeat )
+	report( "legacy (read per field)", t_old, len( fnames ), "files" )
+	report( "bulk read", t_new, len( fnames ), "files" )
+	print( "speedup: %.1fx" % ( t_old/t_new ) )
+	print()
+
+
+
+###
+### Loading the whole replay, with commands.
+###
+BIG_REPLAY = os.path.join( "cornercases", "0x13 command.KWReplay" )
+
+def load_quietly( fname ) :
+	# mismatch warnings go to stderr, we don't want to see them here.
+	from chunks import KWReplayWithCommands
+	with contextlib.redirect_stderr( io.StringIO() ) :
+		return KWReplayWithCommands( fname=fname )
+
+# commands are split on first access, touch them all.
+# The baseline's split while loading, this does nothing for it.
+def split_all( body ) :
+	with contextlib.redirect_stderr( io.StringIO() ) :
+		for chunk in body.chunks :
+			chunk.commands
+	return body
+
+# The baseline's chunks and commands have bytes where we have views.
+def chunk_fields( chunk ) :
+	return ( chunk.time_code, chunk.ty, chunk.size, bytes( chunk.data ),
+		[ command_fields( cmd ) for cmd in chunk.commands ] )
+
+def peak_memory( func ) :
+	import tracemalloc
+	tracemalloc.start()
+	result = func()
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return peak, current
+
+# Runs in a process of its own, with tree first in sys.path (see run_bodies),
+# so whichever chunks.py is there is the one loading.
+# Pickles to stdout ( { fname : ( best time, chunk fields ) }, peak memory of
+# BIG_REPLAY ). The broken ones are left out. The header is read untimed.
+def body_worker( fnames, repeat ) :
+	from chunks import ReplayBody
+
+	def load( fname ) :
+		kwr = KWReplay()
+		kwr.guess_game( fname )
+		f = open( fname, 'rb' )
+		kwr.loadFromStream( f )
+		t = time.perf_counter()
+		body = split_all( ReplayBody( f, game=kwr.game ) )
+		t = time.perf_counter() - t
+		f.close()
+		return body, t
+
+	results = {}
+	for fname in fnames :
+		try :
+			body, t = load( fname )
+		except Exception :
+			continue # broken ones.
+		for i in range( repeat-1 ) :
+			t = min( t, load( fname )[1] )
+		results[ fname ] = ( t, [ chunk_fields( c ) for c in body.chunks ] )
+
+	peak = None
+	if os.path.isfile( BIG_REPLAY ) :
+		peak, current = peak_memory( lambda : load( BIG_REPLAY ) )
+	pickle.dump( ( results, peak ), sys.stdout.buffer )
+
+def run_bodies( tree, fnames, repeat ) :
+	code = "import sys; sys.path.insert( 0, sys.argv[1] ); import benchmark; " + \
+		"benchmark.body_worker( sys.argv[3:], int( sys.argv[2] ) )"
+	proc = subprocess.Popen( [ sys.executable, "-c", code, tree, str( repeat ) ] + fnames,
+		stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+	out, err = proc.communicate()
+	if proc.returncode != 0 :
+		raise RuntimeError( err.decode( errors="replace" ) )
+	return pickle.loads( out )
+
+# The tree of the first commit, or BASELINE=dir for a checkout of anything else.
+# Returns ( dir, name ).
+def baseline_tree( tmp ) :
+	if os.environ.get( "BASELINE" ) :
+		return os.environ[ "BASELINE" ], os.environ[ "BASELINE" ]
+	rev = subprocess.check_output( [ "git", "rev-list", "--max-parents=0", "HEAD" ] ).split()[0]
+	rev = rev.decode()
+	tar = subprocess.check_output( [ "git", "archive", rev ] )
+	tarfile.open( fileobj=io.BytesIO( tar ) ).extractall( tmp )
+	return tmp, rev[ :7 ]
+
+# Ours against the baseline's own reader, with its own splitting, each
+# in a fresh process. Not a reconstruction of it in today's code.
+def bench_body( fnames, repeat=3 ) :
+	import tempfile
+	tmp = tempfile.TemporaryDirectory()
+	try :
+		tree, name = baseline_tree( tmp.name )
+	except ( OSError, subprocess.CalledProcessError ) as e :
+		print( "-- replay body loading: no baseline (%s)" % e )
+		print()
+		tmp.cleanup()
+		return
+
+	print( "-- replay body loading,", len( fnames ), "replays, against", name )
+	try :
+		old, old_peak = run_bodies( tree, fnames, repeat )
+		new, new_peak = run_bodies( ".", fnames, repeat )
+	finally :
+		tmp.cleanup()
+
+	loadable = [ fname for fname in fnames if fname in old and fname in new ]
+	for fname in loadable :
+		assert old[ fname ][1] == new[ fname ][1], fname
+	print( "Baseline and ours agree on %d replays." % len( loadable ) )
+
+	t_old = sum( old[ fname ][0] for fname in loadable )
+	t_new = sum( new[ fname ][0] for fname in loadable )
+	report( "baseline (load and split)", t_old, len( loadable ), "files" )
+	report( "ours (load, split all)", t_new, len( loadable ), "files" )
+	print( "speedup: %.2fx" % ( t_old/t_new ) )
+
+	if BIG_REPLAY in loadable :
+		size = os.path.getsize( BIG_REPLAY )
+		print( os.path.basename( BIG_REPLAY ), "%d KB" % ( size/1024 ) )
+		report( "  baseline", old[ BIG_REPLAY ][0], size/1024, "KB" )
+		report( "  ours", new[ BIG_REPLAY ][0], size/1024, "KB" )
+		print( "  peak memory: baseline %.1f MB, ours %.1f MB" % ( old_peak/2**20, new_peak/2**20 ) )
+	print()
+
+
+
+###
+### Command splitting: byte by byte FSM (legacy) vs find() on the buffer.
+###
+def split_chunk( chunk, legacy ) :
+	chunk.commands = []
+	if legacy :
+		chunk.split_commands_legacy( chunk.ncmd, chunk.payload, chunk.game )
+	else :
+		chunk.split_commands( chunk.ncmd, chunk.payload, chunk.game )
+	return chunk.commands
+
+def command_fields( cmd ) :
+	payload = cmd.payload
+	if payload != None :
+		payload = bytes( payload )
+	return ( cmd.cmd_id, cmd.player_id, payload )
+
+def bench_split( fnames, repeat=3 ) :
+	print( "-- command splitting,", len( fnames ), "replays" )
+
+	# chunks with ncmd/payload ready, not split yet.
+	cmd_chunks = []
+	for fname in fnames :
+		kwr = load_quietly( fname )
+		for chunk in kwr.replay_body.chunks :
+			if chunk.ty == 1 and chunk.data[ -1 ] == 0xFF :
+				with contextlib.redirect_stderr( io.StringIO() ) :
+					chunk.commands # for ncmd and payload.
+				cmd_chunks.append( ( fname, chunk ) )
+
+	ncmd = 0
+	for fname, chunk in cmd_chunks :
+		old = [ command_fields( cmd ) for cmd in split_chunk( chunk, True ) ]
+		new = [ command_fields( cmd ) for cmd in split_chunk( chunk, False ) ]
+		assert old == new, ( fname, chunk.time_code )
+		ncmd += len( new )
+	print( "Legacy and fast splitters agree on %d chunks, %d commands." % ( len( cmd_chunks ), ncmd ) )
+
+	def run( legacy ) :
+		for fname, chunk in cmd_chunks :
+			split_chunk( chunk, legacy )
+
+	t_old = best_of( lambda : run( True ), repeat )
+	t_new = best_of( lambda : run( False ), repeat )
+	report( "legacy (byte FSM)", t_old, ncmd, "cmds" )
+	report( "find()", t_new, ncmd, "cmds" )
+	print( "speedup: %.1fx" % ( t_old/t_new ) )
+	print()
+
+
+
+###
+### Memory per command, split and decoded.
+###
+def bench_cmdmem( fnames ) :
+	import tracemalloc
+
+	if not os.path.isfile( BIG_REPLAY ) :
+		return
+	print( "-- memory per command,", os.path.basename( BIG_REPLAY ) )
+
+	tracemalloc.start()
+	kwr = load_quietly( BIG_REPLAY )
+	base = tracemalloc.get_traced_memory()[0]
+
+	ncmd = 0
+	with contextlib.redirect_stderr( io.StringIO() ) :
+		for chunk in kwr.replay_body.chunks :
+			ncmd += len( chunk.commands )
+	split = tracemalloc.get_traced_memory()[0]
+
+	with contextlib.redirect_stderr( io.StringIO() ), contextlib.redirect_stdout( io.StringIO() ) :
+		kwr.decode_all()
+	decoded = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+
+	print( "%d commands" % ncmd )
+	print( "split:   %6.0f bytes/command" % ( ( split-base )/ncmd ) )
+	print( "decoded: %6.0f bytes/command" % ( ( decoded-base )/ncmd ) )
+	print()
+
+
+
+###
+### Columnar command table: build time and one whole-replay statistic
+### (spent money per player), with objects vs with the columns.
+###
+def bench_table( fnames, repeat=3 ) :
+	import cmdtable
+
+	print( "-- command table,", len( fnames ), "replays" )
+	if cmdtable.numpy == None :
+		print( "numpy not found, columns are array.array." )
+	kwrs = [ load_quietly( fname ) for fname in fnames ]
+	ncmd = 0
+	with contextlib.redirect_stderr( io.StringIO() ), contextlib.redirect_stdout( io.StringIO() ) :
+		for kwr in kwrs :
+			kwr.decode_all()
+			for chunk in kwr.replay_body.chunks :
+				ncmd += len( chunk.commands )
+
+	def build() :
+		with contextlib.redirect_stdout( io.StringIO() ) :
+			return [ cmdtable.CommandTable.from_replay( kwr ) for kwr in kwrs ]
+	t = best_of( build, repeat )
+	report( "build tables", t, ncmd, "cmds" )
+	tables = build()
+
+	def spent_objects() :
+		result = []
+		for kwr in kwrs :
+			spent = {}
+			for chunk in kwr.replay_body.chunks :
+				for cmd in chunk.commands :
+					cost = getattr( cmd.rec, "cost", None )
+					if type( cost ) == tuple :
+						cost = cost[0]
+					if cost != None and cost > 0 :
+						spent[ cmd.player_id ] = spent.get( cmd.player_id, 0 ) + cost
+			result.append( spent )
+		return result
+
+	def spent_columns() :
+		result = []
+		for table in tables :
+			spent = {}
+			if cmdtable.numpy != None :
+				mask = table.cost > 0
+				pids = table.player_id[ mask ]
+				costs = table.cost[ mask ]
+				for pid in cmdtable.numpy.unique( pids ) :
+					spent[ int( pid ) ] = int( costs[ pids == pid ].sum() )
+			else :
+				for pid, cost in zip( table.player_id, table.cost ) :
+					if cost > 0 :
+						spent[ pid ] = spent.get( pid, 0 ) + cost
+			result.append( spent )
+		return result
+
+	assert spent_objects() == spent_columns()
+	report( "spent, over objects", best_of( spent_objects, repeat ), ncmd, "cmds" )
+	report( "spent, over columns", best_of( spent_columns, repeat ), ncmd, "cmds" )
+	print()
+
+
+
+###
+### ReplayItems lookups on a made up collection of 50k replays:
+### linear scans (legacy) vs the id/name dicts.
+### The legacy sort is SortItems with two find(id) per comparison,
+### that is hopeless at 50k so it gets a smaller collection.
+###
+def synthetic_items( n ) :
+	import random
+	from replayitems import ReplayItem, ReplayItems
+	rnd = random.Random( 42 )
+	items = ReplayItems()
+	for i in range( n ) :
+		kwr = KWReplay()
+		kwr.map_name = "Map %d" % rnd.randrange( 100 )
+		kwr.desc = "desc %d" % rnd.randrange( 1000 )
+		kwr.timestamp = 1400000000 + rnd.randrange( 10**8 )
+		it = ReplayItem()
+		it.fname = "%08d.KWReplay" % rnd.randrange( 10**8 ) + str( i )
+		it.kwr = kwr
+		items.append( it )
+	return items
+
+def legacy_find_id( items, id ) :
+	for it in items.items :
+		if it.id == id :
+			return it
+	raise KeyError
+
+def legacy_find_fname( items, fname ) :
+	for it in items.items :
+		if it.fname == fname :
+			return it
+	raise KeyError
+
+def bench_items( fnames, repeat=3 ) :
+	import random
+	import functools
+
+	n = 50000
+	print( "-- ReplayItems,", n, "made up replays" )
+	items = synthetic_items( n )
+	rnd = random.Random( 1 )
+	its = rnd.sample( list( items.items ), 1000 )
+	ids = [ it.id for it in its ]
+	names = [ it.fname for it in its ]
+	few = 50 # the linear ones only get this many, they're slow.
+
+	def find_legacy() :
+		for id, fname in zip( ids[ :few ], names[ :few ] ) :
+			assert legacy_find_id( items, id ) is items.find( id=id )
+			assert legacy_find_fname( items, fname ) is items.find( fname=fname )
+	def find_dict() :
+		for id, fname in zip( ids, names ) :
+			items.find( id=id )
+			items.find( fname=fname )
+	report( "find, linear", best_of( find_legacy, 1 ), 2*few, "finds" )
+	report( "find, dict", best_of( find_dict, repeat ), 2*len( ids ), "finds" )
+
+	# rename back and forth, like the viewer does: find, then set the name.
+	def rename_legacy() :
+		for it in its[ :few ] :
+			legacy_find_fname( items, it.fname ).fname = it.fname
+	def rename_dict() :
+		for fname in names :
+			items.rename( fname, fname + ".tmp" )
+		for fname in names :
+			items.rename( fname + ".tmp", fname )
+	report( "rename, linear", best_of( rename_legacy, 1 ), few, "renames" )
+	report( "rename, dict (x2)", best_of( rename_dict, repeat ), 2*len( its ), "renames" )
+	assert len( items.by_fname ) == n
+
+	# sort by map name, the way SortItems did, on a small collection.
+	small = synthetic_items( 1000 )
+	def cmp( id1, id2 ) :
+		a = legacy_find_id( small, id1 ).kwr.map_name
+		b = legacy_find_id( small, id2 ).kwr.map_name
+		return ( a > b ) - ( a < b )
+	def sort_legacy() :
+		return sorted( small.by_id.keys(), key=functools.cmp_to_key( cmp ) )
+	report( "sort 1k, cmp + find(id)", best_of( sort_legacy, 1 ), len( small ), "items" )
+
+	rows = list( items.items )
+	def sort_keys() :
+		rows.sort( key=lambda it : it.kwr.map_name )
+	report( "sort 50k, list.sort key", best_of( sort_keys, repeat ), n, "items" )
+	print()
+
+
+
+###
+### Filtering 10k replays: the old postfix interpreter on props built per
+### filtering, vs compiled queries on props made once per replay.
+### Made of the test replays' headers, over and over.
+###
+FILTER_QUERIES = [
+	"rocktagon",
+	"kyky noonal",
+	"gdi and not nod",
+	"not (gdi or nod)",
+	"(tiberium or \"the rocktagon\") and 1",
+	"zzzz",
+]
+
+SCOPED_QUERIES = [
+	"map:rocktagon",
+	"player:kyky or desc:kyky",
+	"map:\"the rocktagon\" and not player:zzzz",
+]
+
+def bench_filter( fnames, repeat=3 ) :
+	from filterquery import FilterQuery
+	from replayitems import calc_search_props
+
+	headers = []
+	for fname in fnames :
+		try :
+			headers.append( ( os.path.basename( fname ), KWReplay( fname=fname ) ) )
+		except Exception :
+			pass
+	n = 10000
+	reps = [ ( "%d_%s" % ( i, headers[ i % len( headers ) ][0] ), headers[ i % len( headers ) ][1] )
+		for i in range( n ) ]
+	print( "-- filtering,", n, "replays" )
+
+	def make_props() :
+		return [ calc_search_props( kwr, fname ) for fname, kwr in reps ]
+	with contextlib.redirect_stdout( io.StringIO() ) :
+		t = best_of( make_props, 1 )
+		props = make_props()
+	report( "props, once per replay", t, n, "replays" )
+
+	for q in FILTER_QUERIES :
+		fq = FilterQuery( q )
+		old = [ fq.match_legacy( p.props ) for p in props ]
+		new = [ fq.match( p ) for p in props ]
+		assert old == new, q
+	print( "Legacy and compiled queries agree on %d queries." % len( FILTER_QUERIES ) )
+
+	# The legacy viewer made the props every time it filtered.
+	def run_legacy( q ) :
+		fq = FilterQuery( q )
+		hits = 0
+		with contextlib.redirect_stdout( io.StringIO() ) :
+			for fname, kwr in reps :
+				if fq.match_legacy( calc_search_props( kwr, fname ).props ) :
+					hits += 1
+		return hits
+
+	def run( q ) :
+		fq = FilterQuery( q )
+		hits = 0
+		for p in props :
+			if fq.match( p ) :
+				hits += 1
+		return hits
+
+	for q in FILTER_QUERIES + SCOPED_QUERIES :
+		hits = run( q )
+		if q in FILTER_QUERIES :
+			t = best_of( lambda : run_legacy( q ), 1 )
+			report( "legacy  " + q[ :20 ], t, n, "replays" )
+		t = best_of( lambda : run( q ), repeat )
+		report( "compiled " + q[ :19 ], t, n, "replays" )
+		print( "%28s %d hits" % ( "", hits ) )
+	print()
+
+
+
+###
+### Filtering 10k replays with the trigram index of ReplayIndex,
+### vs checking all of them. The replays are made up, of the test replays'
+### headers, in a throw away index.
+### cold: the search props of the replays aren't made yet (first filtering).
+###
+def bench_trigram( fnames, repeat=3 ) :
+	import tempfile
+	from filterquery import FilterQuery
+	from replayindex import ReplayIndex
+	from replayitems import ReplayItem, ReplayItems
+
+	headers = []
+	for fname in fnames :
+		try :
+			headers.append( ( fname, os.stat( fname ), KWReplay( fname=fname ) ) )
+		except Exception :
+			pass
+
+	n = 10000
+	print( "-- trigram index,", n, "replays" )
+	tmp = tempfile.mkdtemp()
+	index = ReplayIndex( os.path.join( tmp, "bench.db" ) )
+	items = ReplayItems( index=index )
+	items.path = os.path.join( tmp, "replays" )
+
+	t = time.perf_counter()
+	with contextlib.redirect_stdout( io.StringIO() ) :
+		for i in range( n ) :
+			fname, st, kwr = headers[ i % len( headers ) ]
+			it = ReplayItem()
+			it.fname = "%d_%s" % ( i, os.path.basename( fname ) )
+			it.kwr = kwr
+			index.store_header( os.path.join( items.path, it.fname ), st, kwr )
+			items.append( it )
+		index.commit()
+	report( "store headers", time.perf_counter() - t, n, "replays" )
+	t = time.perf_counter()
+	index.index_dir( items.path, { it.fname: it.kwr for it in items.items } )
+	report( "index grams (GramJob)", time.perf_counter() - t, n, "replays" )
+	ngram = index.db.execute( "SELECT COUNT(*) FROM grams" ).fetchone()[0]
+	index.close()
+	print( "%d grams, %.1f MB db" % ( ngram, os.path.getsize( os.path.join( tmp, "bench.db" ) )/2**20 ) )
+	index = ReplayIndex( os.path.join( tmp, "bench.db" ) )
+	items.index = index
+
+	def run( q, use_index, cold=False ) :
+		items.index = index if use_index else None
+		if cold :
+			items.clear_props()
+		with contextlib.redirect_stdout( io.StringIO() ) :
+			return sorted( it.id for it in items.filter( FilterQuery( q ) ) )
+
+	for q in FILTER_QUERIES + SCOPED_QUERIES :
+		hits = run( q, False )
+		assert hits == run( q, True ), q
+		t_all = best_of( lambda : run( q, False ), repeat )
+		t_idx = best_of( lambda : run( q, True ), repeat )
+		t_all_cold = best_of( lambda : run( q, False, True ), 1 )
+		t_idx_cold = best_of( lambda : run( q, True, True ), 1 )
+		print( "%-24s all %7.2f ms, index %7.2f ms; cold: all %7.2f ms, index %7.2f ms; %d hits" % (
+			q[ :24 ], t_all*1000, t_idx*1000, t_all_cold*1000, t_idx_cold*1000, len( hits ) ) )
+
+	index.close()
+	os.remove( os.path.join( tmp, "bench.db" ) )
+	os.rmdir( tmp )
+	print()
+
+
+
+###
+### Saving the last replay, the way Watcher.do_renaming does it:
+### copy to tmp then parse the copy (legacy), vs parse the last replay
+### then utils.clone_file. Replays are made big by padding a real one.
+###
+def bench_save( fnames, repeat=3 ) :
+	import shutil
+	import tempfile
+	import utils
+
+	if not os.path.isfile( BIG_REPLAY ) :
+		return
+	print( "-- saving the last replay" )
+	tmp = tempfile.mkdtemp()
+	last = os.path.join( tmp, "last.KWReplay" )
+
+	def save_legacy() :
+		tmpf = os.path.join( tmp, "tmp.KWReplay" )
+		shutil.copyfile( last, tmpf )
+		r = KWReplay( fname=tmpf )
+		os.replace( tmpf, os.path.join( tmp, "saved.KWReplay" ) )
+
+	how = []
+	def save() :
+		r = KWReplay( fname=last )
+		fd, tmpf = tempfile.mkstemp( prefix="tmp", suffix=".KWReplay", dir=tmp )
+		how.append( utils.clone_file( last, fd ) )
+		os.close( fd )
+		os.replace( tmpf, os.path.join( tmp, "saved.KWReplay" ) )
+
+	data = open( BIG_REPLAY, "rb" ).read()
+	for mb in [ 0, 16, 128 ] :
+		f = open( last, "wb" )
+		f.write( data )
+		f.write( bytes( mb * 2**20 ) )
+		f.close()
+		size = os.path.getsize( last )
+		report( "copy, parse copy %d MB" % ( size // 2**20 ), best_of( save_legacy, repeat ), size/2**20, "MB" )
+		report( "parse, clone %d MB" % ( size // 2**20 ), best_of( save, repeat ), size/2**20, "MB" )
+	print( "clone_file used:", ", ".join( sorted( set( how ) ) ) )
+
+	shutil.rmtree( tmp )
+	print()
+
+
+
+###
+### FactorySim: the heap (analyzer.EventQueue) vs the sorted list it replaced,
+### on a marathon of queue clicks in a few factories, and some selling.
+###
+class LegacyEventQueue :
+	def __init__( self ) :
+		self.events = []
+
+	def __len__( self ) :
+		return len( self.events )
+
+	def push( self, evt ) :
+		index = -1
+		for i in range( len( self.events ) ) :
+			if self.events[ i ].time_code > evt.time_code :
+				index = i
+				break
+		if index == -1 :
+			self.events.append( evt )
+		else :
+			self.events.insert( index, evt )
+
+	def pop( self ) :
+		return self.events.pop( 0 )
+
+	def find( self, factory ) :
+		for i in range( len( self.events ) ) :
+			e = self.events[ i ]
+			if hasattr( e, "factory" ) and e.factory == factory and e.cmd_ty == 0xFF+1 :
+				return i
+		return -1
+
+	def remove_factory( self, factory ) :
+		for i in reversed( range( len( self.events ) ) ) :
+			e = self.events[ i ]
+			if hasattr( e, "factory" ) and e.factory == factory :
+				del self.events[ i ]
+
+	def completion( self, factory ) :
+		i = self.find( factory )
+		return None if i < 0 else self.events[ i ]
+
+	def remove_completion( self, factory ) :
+		i = self.find( factory )
+		if i >= 0 :
+			self.events.pop( i )
+
+def production_clicks( n ) :
+	import random
+	from chunks import Command, ProductionRecord, TargetRecord
+	rnd = random.Random( 1 )
+	cmds = []
+	t = 0
+	for i in range( n ) :
+		t += rnd.choice( [ 0, 1, 5, 15 ] )
+		c = Command()
+		c.time_code = t
+		if rnd.random() < 0.98 :
+			c.cmd_ty = Command.QUEUE
+			c.rec = ProductionRecord()
+			c.factory = rnd.randint( 1, 8 )
+			c.unit_ty = rnd.choice( "ABCD" )
+			c.cnt = rnd.choice( [ 1, 1, 5 ] )
+			c.cost = 100 * ( ord( c.unit_ty ) - 64 )
+		else :
+			c.cmd_ty = Command.SELL
+			c.rec = TargetRecord()
+			c.target = rnd.randint( 1, 8 )
+		cmds.append( c )
+	return cmds, t + 15*60
+
+def run_sim( cmds, end, legacy ) :
+	import analyzer
+	from chunks import Command
+	sim = analyzer.FactorySim()
+	if legacy :
+		sim.events = LegacyEventQueue()
+	sim.end_time = end
+	for c in cmds :
+		if c.cmd_ty == Command.QUEUE :
+			sim.insert_build_evt( c )
+		else :
+			sim.insert_sell_evt( c )
+	spent = []
+	while len( sim.events ) > 0 :
+		spent.append( sim.run() )
+	return spent
+
+def bench_factorysim( fnames, repeat=3 ) :
+	print( "-- FactorySim event queue" )
+	for n in [ 1000, 4000, 16000 ] :
+		cmds, end = production_clicks( n )
+		assert run_sim( cmds, end, True ) == run_sim( cmds, end, False )
+		report( "list %d clicks" % n, best_of( lambda : run_sim( cmds, end, True ), repeat ), n, "clicks" )
+		report( "heap %d clicks" % n, best_of( lambda : run_sim( cmds, end, False ), repeat ), n, "clicks" )
+	print()
+
+
+
+###
+### APM windows: each second added to the windows one by one (legacy)
+### vs prefix sums (analyzer.window_sums), with and without numpy.
+### A synthetic marathon, 8 players clicking for 2 hours.
+###
+def legacy_count_player_actions( nplayers, interval, cmds_at_second ) :
+	counts_at_second = [ [0]*nplayers for i in range( len( cmds_at_second ) ) ]
+	for sec in range( len( cmds_at_second ) ) :
+		left = max( 0, sec - interval )
+		for t in range( left, sec+1 ) :
+			for cmd in cmds_at_second[ sec ] :
+				pid = cmd.player_id
+				if pid < nplayers :
+					counts_at_second[ t ][ pid ] += 1
+	return counts_at_second
+
+def bench_apm( fnames, repeat=3 ) :
+	import random
+	import analyzer
+	from chunks import Command
+
+	print( "-- APM windows" )
+	nplayers = 8
+	rnd = random.Random( 1 )
+	cmds_at_second = []
+	for sec in range( 2*3600 ) :
+		cmds = []
+		for i in range( rnd.randint( 0, 20 ) ) :
+			cmd = Command()
+			cmd.player_id = rnd.randrange( nplayers )
+			cmds.append( cmd )
+		cmds_at_second.append( cmds )
+	ncmds = sum( len( cmds ) for cmds in cmds_at_second )
+
+	class Fake( analyzer.APMAnalyzer ) :
+		def __init__( self ) :
+			self.nplayers = nplayers
+	ana = Fake()
+	np = analyzer.numpy
+	for interval in [ 10, 60 ] :
+		want = legacy_count_player_actions( nplayers, interval, cmds_at_second )
+		t = best_of( lambda : legacy_count_player_actions( nplayers, interval, cmds_at_second ), 1 )
+		report( "legacy, interval %d" % interval, t, ncmds, "cmds" )
+		for name, mod in [ ( "numpy", np ), ( "python", None ) ] :
+			if name == "numpy" and np == None :
+				continue
+			analyzer.numpy = mod
+			assert ana.count_player_actions( interval, cmds_at_second ) == want
+			t = best_of( lambda : ana.count_player_actions( interval, cmds_at_second ), repeat )
+			report( "%s, interval %d" % ( name, interval ), t, ncmds, "cmds" )
+		analyzer.numpy = np
+	print()
+
+
+
+###
+### Average APM for the player list: loading all commands (legacy)
+### vs counting them in the file buffer (analyzer.quick_avg_apm).
+###
+def legacy_avg_apm( fname ) :
+	import analyzer
+	from chunks import KWReplayWithCommands
+	kwr = KWReplayWithCommands( fname=fname, verbose=False )
+	ana = analyzer.APMAnalyzer( kwr )
+	return ana.calc_avg_apm( ana.group_commands_by_time() )
+
+def bench_avg_apm( fnames, repeat=3 ) :
+	import analyzer
+	print( "-- average APM" )
+	good = []
+	for fname in fnames :
+		try :
+			with contextlib.redirect_stdout( io.StringIO() ), contextlib.redirect_stderr( io.StringIO() ) :
+				want = legacy_avg_apm( fname )
+		except Exception :
+			continue
+		assert analyzer.quick_avg_apm( fname ) == want, fname
+		good.append( fname )
+	size = sum( os.path.getsize( f ) for f in good ) / 2**20
+
+	def legacy() :
+		with contextlib.redirect_stdout( io.StringIO() ), contextlib.redirect_stderr( io.StringIO() ) :
+			for fname in good :
+				legacy_avg_apm( fname )
+	def quick() :
+		for fname in good :
+			analyzer.quick_avg_apm( fname )
+
+	report( "load commands", best_of( legacy, repeat ), size, "MB" )
+	report( "count_actions", best_of( quick, repeat ), size, "MB" )
+	print()
+
+
+
+BENCHMARKS = [
+	( "header", bench_header ),
+	( "body", bench_body ),
+	( "split", bench_split ),
+	( "cmdmem", bench_cmdmem ),
+	( "table", bench_table ),
+	( "items", bench_items ),
+	( "filter", bench_filter ),
+	( "trigram", bench_trigram ),
+	( "save", bench_save ),
+	( "factorysim", bench_factorysim ),
+	( "apm", bench_apm ),
+	( "avgapm", bench_avg_apm ),
+]
+
+def main() :
+	fnames = replay_files()
+	if not fnames :
+		print( "No replays found. Run me in the top directory of the source." )
+		return
+
+	todo = sys.argv[1:]
+	for name, func in BENCHMARKS :
+		if todo and not name in todo :
+			continue
+		func( fnames )
+
+
+
+if __name__ == "__main__" :
+	main()
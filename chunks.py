@@ -13,11 +13,80 @@ import io
 import codecs
 import datetime
 import time
+import importlib
 from kwreplay import KWReplay
 from utils import *
 
 
 
+###
+### Decoded command fields.
+### Most commands are never decoded (or decoded to nothing),
+### so Command itself only carries the raw stuff and rec,
+### the fields of the decoded kind of command live in one of these.
+### Fields that a decoder doesn't set are left unset, as before,
+### so hasattr( cmd, "factory" ) still tells you what you've got.
+###
+class CmdRecord :
+	__slots__ = ()
+
+	def has_1pos( self ) :
+		return False
+
+	def has_2pos( self ) :
+		return False
+
+# sell, powerdown, gg and end of game markers.
+class TargetRecord( CmdRecord ) :
+	__slots__ = ( "target", )
+
+class ScienceRecord( CmdRecord ) :
+	__slots__ = ( "science", )
+
+# queue, hold and construction complete events of the analyzer.
+class ProductionRecord( CmdRecord ) :
+	__slots__ = ( "factory", "unit_ty", "cnt", "cost", "cancel_all" )
+
+class UpgradeRecord( CmdRecord ) :
+	__slots__ = ( "upgrade", "cost" )
+
+class SkillRecord( CmdRecord ) :
+	__slots__ = ( "power", "cost", "target" )
+
+class SkillXYRecord( SkillRecord ) :
+	__slots__ = ( "x", "y", "orientation" )
+
+	def has_1pos( self ) :
+		return True
+
+class Skill2XYRecord( SkillRecord ) :
+	__slots__ = ( "x1", "y1", "x2", "y2" )
+
+	def has_2pos( self ) :
+		return True
+
+# move, formation move, reverse move
+class MoveRecord( CmdRecord ) :
+	__slots__ = ( "x", "y" )
+
+	def has_1pos( self ) :
+		return True
+
+class PlacedownRecord( CmdRecord ) :
+	__slots__ = ( "building_type", "substructure_cnt", "substructures",
+		"free_unit", "cost", "x", "y" )
+
+	def has_1pos( self ) :
+		# x, y is that of the last substructure.
+		return self.substructure_cnt > 0
+
+RECORD_FIELDS = [ "target", "science", "factory", "unit_ty", "cnt", "cost",
+	"cancel_all", "upgrade", "power", "x", "y", "orientation",
+	"x1", "y1", "x2", "y2", "building_type", "substructure_cnt",
+	"substructures", "free_unit" ]
+
+
+
 class Command :
 
 	verbose = False     # manually make this True if you want to debug...
@@ -94,43 +163,76 @@ class Command :
 		return self.cmd_ty == Command.SCIENCE
 
 	def has_1pos( self ) :
-		return hasattr( self, "x" )
+		return self.rec != None and self.rec.has_1pos()
 
 	def has_2pos( self ) :
-		return hasattr( self, "x2" )
+		return self.rec != None and self.rec.has_2pos()
 
 	def has_pos( self ) :
 		return self.has_1pos() or self.has_2pos()
 
 
 
+	# No __dict__, there are lots of commands in a replay.
+	# offset is the label row in the timeline. See animation.py.
+	__slots__ = ( "cmd_id", "time_code", "player_id", "buf", "start", "length",
+		"cmd_ty", "rec", "decoded", "offset" )
+
 	def __init__( self ) :
 		self.cmd_id = 0
 		self.time_code = 0
 		self.player_id = 0 # dunno if it really is player_id.
-		self.payload = None # raw command
+		# raw command is buf[ start:start+length ], see payload below.
+		# length, not end: small ints are shared, big offsets are not.
+		self.buf = None
+		self.start = 0
+		self.length = 0
 
 		self.cmd_ty = Command.NONE # not decoded at all! Decoded command type.
-		# other info are dynamically allocated when necessary.
-		# self.substructures = []
+		self.rec = None # decoded fields, one of the records above.
+		self.decoded = False # Chunk.decode_cmd has been done on this.
+
+
+
+	# The payload is not stored, only where it is in the replay buffer.
+	# buf is shared with all the other commands and chunks and
+	# a view is handed out only when someone asks.
+	@property
+	def payload( self ) :
+		if self.buf == None :
+			return None
+		return self.buf[ self.start:self.start + self.length ]
+
+	@payload.setter
+	def payload( self, buf ) :
+		self.buf = buf
+		self.start = 0
+		self.length = 0 if buf == None else len( buf )
+
+
+
+	def decode_hidden( self ) :
+		self.cmd_ty = Command.HIDDEN
 
 
 
 	def decode_sell_cmd( self ) :
 		self.cmd_ty = Command.SELL
-		self.target = uint42int( self.payload[ 1:5 ] )
+		self.rec = TargetRecord()
+		self.rec.target = uint42int( self.payload[ 1:5 ] )
 
 
 
 	# Science? Why? Because it was called science in C&C Generals modding.
 	def decode_science_sel_cmd( self, SCIENCENAMES ) :
 		self.cmd_ty = Command.SCIENCE
-		self.science = uint42int( self.payload[ 1:5 ] )
+		r = self.rec = ScienceRecord()
+		r.science = uint42int( self.payload[ 1:5 ] )
 
-		if self.science in SCIENCENAMES :
-			self.science = SCIENCENAMES[ self.science ]
+		if r.science in SCIENCENAMES :
+			r.science = SCIENCENAMES[ r.science ]
 		else :
-			self.science = "Science 0x%08X" % self.science
+			r.science = "Science 0x%08X" % r.science
 
 
 
@@ -142,42 +244,44 @@ class Command :
 
 	def decode_ra3_deploy_cmd( self ) :
 		self.cmd_ty = Command.SKILL_TARGET
+		r = self.rec = SkillXYRecord()
 		data = self.payload
-		self.x = uint42float( data[ 6:10] )
-		self.y = uint42float( data[ 10:14] )
-		self.orientation = uint42float( data[19:23] )
-		self.cost = 0
-		self.power = "Deploy Core/MCV"
+		r.x = uint42float( data[ 6:10] )
+		r.y = uint42float( data[ 10:14] )
+		r.orientation = uint42float( data[19:23] )
+		r.cost = 0
+		r.power = "Deploy Core/MCV"
 
 
 
 	def decode_ra3_queue_cmd( self, UNITNAMES, AFLD_UNITS, UNITCOST ) :
 		self.cmd_ty = Command.QUEUE
+		r = self.rec = ProductionRecord()
 		data = self.payload
 
-		self.factory = uint42int( data[ 1:5 ] ) # probably, but not too sure.
-		self.unit_ty = uint42int( data[ 6:10 ] )
-		self.cnt = 1 # how many queued?
+		r.factory = uint42int( data[ 1:5 ] ) # probably, but not too sure.
+		r.unit_ty = uint42int( data[ 6:10 ] )
+		r.cnt = 1 # how many queued?
 		fivex = data[11]
 		if fivex :
-			if self.unit_ty in AFLD_UNITS :
-				self.cnt = 4
+			if r.unit_ty in AFLD_UNITS :
+				r.cnt = 4
 				# Actually, fivex just tells us that it is
 				# shift + click on the unit produciton button.
 				# For normal units, it is definitely 5x.
 				# But for these air units, it could be
 				# 1 ~ 4, depending on the space left on the landing pad.
 			else :
-				self.cnt = 5
+				r.cnt = 5
 
-		self.cost = None # not zero but none, intended. units must have some info :D
-		if self.unit_ty in UNITCOST :
-			self.cost = UNITCOST[ self.unit_ty ]
+		r.cost = None # not zero but none, intended. units must have some info :D
+		if r.unit_ty in UNITCOST :
+			r.cost = UNITCOST[ r.unit_ty ]
 
-		if self.unit_ty in UNITNAMES :
-			self.unit_ty = UNITNAMES[ self.unit_ty ]
+		if r.unit_ty in UNITNAMES :
+			r.unit_ty = UNITNAMES[ r.unit_ty ]
 		else :
-			self.unit_ty = "Unit 0x%08X" % self.unit_ty
+			r.unit_ty = "Unit 0x%08X" % r.unit_ty
 
 
 
@@ -189,102 +293,99 @@ class Command :
 			# end of game marker?
 			#self.cmd_ty = Command.LOSE incorrect :(
 			self.cmd_ty = Command.EOG
-			self.target = self.player_id
+			self.rec = TargetRecord()
+			self.rec.target = self.player_id
 		elif data[ 1 ] == 0x02 :
 			#self.cmd_ty = Command.WIN incorrect :(
 			self.cmd_ty = Command.EOG
-			self.target = self.player_id
+			self.rec = TargetRecord()
+			self.rec.target = self.player_id
 		elif len( data ) <= 18 :
 			self.cmd_ty = Command.EOG
-			self.target = self.player_id
+			self.rec = TargetRecord()
+			self.rec.target = self.player_id
 		else :
-			self.factory = uint42int( data[ 1:5 ] )
-			self.unit_ty = uint42int( data[ 8:12 ] ) # This one is pretty sure
-			self.cnt = 1 # how many queued?
+			r = self.rec = ProductionRecord()
+			r.factory = uint42int( data[ 1:5 ] )
+			r.unit_ty = uint42int( data[ 8:12 ] ) # This one is pretty sure
+			r.cnt = 1 # how many queued?
 			fivex = data[ 17 ]
 			if fivex :
-				if self.unit_ty in AFLD_UNITS :
-					self.cnt = 4
+				if r.unit_ty in AFLD_UNITS :
+					r.cnt = 4
 					# Actually, fivex just tells us that it is
 					# shift + click on the unit produciton button.
 					# For normal units, it is definitely 5x.
 					# But for these air units, it could be
 					# 1 ~ 4, depending on the space left on the landing pad.
 				else :
-					self.cnt = 5
+					r.cnt = 5
 
-			self.cost = None
-			if self.unit_ty in UNITCOST :
-				self.cost = UNITCOST[ self.unit_ty ]
+			r.cost = None
+			if r.unit_ty in UNITCOST :
+				r.cost = UNITCOST[ r.unit_ty ]
 
-			if self.unit_ty in UNITNAMES :
-				self.unit_ty = UNITNAMES[ self.unit_ty ]
+			if r.unit_ty in UNITNAMES :
+				r.unit_ty = UNITNAMES[ r.unit_ty ]
 			else :
-				self.unit_ty = "Unit 0x%08X" % self.unit_ty
+				r.unit_ty = "Unit 0x%08X" % r.unit_ty
 
 
 
 	def decode_gg( self ) :
+		self.rec = TargetRecord()
 		if self.payload[0] == 0xFF :
 			self.cmd_ty = Command.EOG
-			self.target = self.player_id
+			self.rec.target = self.player_id
 		else :
 			self.cmd_ty = Command.GG
-			self.target = self.payload[1]
+			self.rec.target = self.payload[1]
+
+
+
+	# power and cost of the skill records.
+	def decode_power( self, r, power, POWERNAMES, POWERCOST ) :
+		r.cost = 0 # by default, 0.
+		if power in POWERCOST :
+			r.cost = POWERCOST[ power ]
+
+		if power in POWERNAMES :
+			r.power = POWERNAMES[ power ]
+		else :
+			r.power = "Skill 0x%08X" % power
 
 
 
 	def decode_skill_xy( self, POWERNAMES, POWERCOST ) :
 		self.cmd_ty = Command.SKILL_XY
+		r = self.rec = SkillXYRecord()
 		data = self.payload
-		self.power = uint42int( data[ 0:4 ] )
-		self.x = uint42float( data[ 6:10] )
-		self.y = uint42float( data[ 10:14] )
-
-		self.cost = 0 # by default, 0.
-		if self.power in POWERCOST :
-			self.cost = POWERCOST[ self.power ]
-
-		if self.power in POWERNAMES :
-			self.power = POWERNAMES[ self.power ]
-		else :
-			self.power = "Skill 0x%08X" % self.power
+		power = uint42int( data[ 0:4 ] )
+		r.x = uint42float( data[ 6:10] )
+		r.y = uint42float( data[ 10:14] )
+		self.decode_power( r, power, POWERNAMES, POWERCOST )
 
 
 
 	def decode_skill_2xy( self, POWERNAMES, POWERCOST ) :
 		self.cmd_ty = Command.SKILL_2XY
+		r = self.rec = Skill2XYRecord()
 		data = self.payload
-		self.x1 = uint42float( data[ 16:20] )
-		self.y1 = uint42float( data[ 20:24] )
-		self.x2 = uint42float( data[ 28:32] )
-		self.y2 = uint42float( data[ 32:36] )
-		self.power = uint42int( data[ 0:4 ] )
-
-		self.cost = 0 # by default, 0.
-		if self.power in POWERCOST :
-			self.cost = POWERCOST[ self.power ]
-
-		if self.power in POWERNAMES :
-			self.power = POWERNAMES[ self.power ]
-		else :
-			self.power = "Skill 0x%08X" % self.power
+		r.x1 = uint42float( data[ 16:20] )
+		r.y1 = uint42float( data[ 20:24] )
+		r.x2 = uint42float( data[ 28:32] )
+		r.y2 = uint42float( data[ 32:36] )
+		power = uint42int( data[ 0:4 ] )
+		self.decode_power( r, power, POWERNAMES, POWERCOST )
 
 
 
 	def decode_skill_targetless( self, POWERNAMES, POWERCOST ) :
 		self.cmd_ty = Command.SKILL_TARGETLESS
+		r = self.rec = SkillRecord()
 		data = self.payload
-		self.power = uint42int( data[ 0:4 ] )
-
-		self.cost = 0 # by default, 0.
-		if self.power in POWERCOST :
-			self.cost = POWERCOST[ self.power ]
-
-		if self.power in POWERNAMES :
-			self.power = POWERNAMES[ self.power ]
-		else :
-			self.power = "Skill 0x%08X" % self.power
+		power = uint42int( data[ 0:4 ] )
+		self.decode_power( r, power, POWERNAMES, POWERCOST )
 
 
 
@@ -295,71 +396,70 @@ class Command :
 		if len( data ) < 5 :
 			# GG?
 			self.cmd_ty = Command.EOG
+			self.rec = None
 			return
 
 		self.cmd_ty = Command.SKILL_TARGET
-		self.power = uint42int( data[ 0:4 ] )
+		r = self.rec = SkillRecord()
+		power = uint42int( data[ 0:4 ] )
+		r.power = power
 		# dunno about target, but it is certain that this is only used on walling
 		# structures -_-
 
 		# Sometimes, GG in RA3.
-		if self.power == 0x00 :
+		if power == 0x00 :
 			self.cmd_ty = Command.EOG
-			self.target = self.player_id
+			r.target = self.player_id
 			return
 
-		self.cost = 0 # by default, 0.
-		if self.power in POWERCOST :
-			self.cost = POWERCOST[ self.power ]
-
-		if self.power in POWERNAMES :
-			self.power = POWERNAMES[ self.power ]
-		else :
-			self.power = "Skill 0x%08X" % self.power
+		self.decode_power( r, power, POWERNAMES, POWERCOST )
 
 
 
 	def decode_upgrade_cmd( self, UPGRADENAMES, UPGRADECOST ) :
 		self.cmd_ty = Command.UPGRADE
+		r = self.rec = UpgradeRecord()
 		data = self.payload
-		self.upgrade = uint42int( data[1:5] )
+		r.upgrade = uint42int( data[1:5] )
 
-		self.cost = 0 # by default, 0.
-		if self.upgrade in UPGRADECOST :
-			self.cost = UPGRADECOST[ self.upgrade ]
+		r.cost = 0 # by default, 0.
+		if r.upgrade in UPGRADECOST :
+			r.cost = UPGRADECOST[ r.upgrade ]
 
-		if self.upgrade in UPGRADENAMES :
-			self.upgrade = UPGRADENAMES[ self.upgrade ]
+		if r.upgrade in UPGRADENAMES :
+			r.upgrade = UPGRADENAMES[ r.upgrade ]
 		else :
-			self.upgrade = "Upgrade 0x%08X" % self.upgrade
+			r.upgrade = "Upgrade 0x%08X" % r.upgrade
 
 
 
 	def decode_hold_cmd( self, UNITNAMES ) :
 		self.cmd_ty = Command.HOLD
+		r = self.rec = ProductionRecord()
 		data = self.payload
-		self.factory = uint42int( data[ 1:5 ] )
-		self.unit_ty = uint42int( data[ 8:12 ] )
-		self.cancel_all = data[13] # remove all build queue of this type
+		r.factory = uint42int( data[ 1:5 ] )
+		r.unit_ty = uint42int( data[ 8:12 ] )
+		r.cancel_all = data[13] # remove all build queue of this type
 
-		if self.unit_ty in UNITNAMES :
-			self.unit_ty = UNITNAMES[ self.unit_ty ]
+		if r.unit_ty in UNITNAMES :
+			r.unit_ty = UNITNAMES[ r.unit_ty ]
 		else :
-			self.unit_ty = "Unit 0x%08X" % self.unit_ty
+			r.unit_ty = "Unit 0x%08X" % r.unit_ty
 
 
 
 	def decode_ra3_hold_cmd( self, UNITNAMES ) :
 		self.cmd_ty = Command.HOLD
+		r = self.rec = ProductionRecord()
 		data = self.payload
-		self.factory = uint42int( data[ 1:5 ] )
-		self.unit_ty = uint42int( data[ 6:10 ] )
-		self.cancel_all = data[11] # remove all build queue of this type
+		r.factory = uint42int( data[ 1:5 ] )
+		r.unit_ty = uint42int( data[ 6:10 ] )
+		r.cancel_all = data[11] # remove all build queue of this type
 
-		if self.unit_ty in UNITNAMES :
-			self.unit_ty = UNITNAMES[ self.unit_ty ]
+		if r.unit_ty in UNITNAMES :
+			r.unit_ty = UNITNAMES[ r.unit_ty ]
 		else :
-			self.unit_ty = "Unit 0x%08X" % self.unit_ty
+			r.unit_ty = "Unit 0x%08X" % r.unit_ty
 
 
 
@@ -372,9 +472,10 @@ class Command :
 
 	def decode_move_cmd( self ) :
 		self.cmd_ty = Command.MOVE
+		r = self.rec = MoveRecord()
 		data = self.payload
-		self.x = uint42float( data[ 1:5 ] )
-		self.y = uint42float( data[ 5:9 ] )
+		r.x = uint42float( data[ 1:5 ] )
+		r.y = uint42float( data[ 5:9 ] )
 		#self.z = uint42float( data[ 9:13 ] ) # it really seems to be Z;;;
 
 	def decode_reverse_move_cmd( self ) :
@@ -385,32 +486,33 @@ class Command :
 
 	def decode_placedown_cmd( self, UNITNAMES, UNITCOST, FREEUNITS ) :
 		self.cmd_ty = Command.PLACEDOWN
+		r = self.rec = PlacedownRecord()
 		data = self.payload
-		self.building_type = uint42int( data[6:10] )
-		self.substructure_cnt = data[10]
-		self.substructures = []
-		self.free_unit = None # harvesters.
+		r.building_type = uint42int( data[6:10] )
+		r.substructure_cnt = data[10]
+		r.substructures = []
+		r.free_unit = None # harvesters.
 
 		# substructure X and Y decoding.
 		pos = 11
-		for i in range( self.substructure_cnt ) :
+		for i in range( r.substructure_cnt ) :
 			pos += 4
-			self.x = uint42float( data[pos:pos+4] )
+			r.x = uint42float( data[pos:pos+4] )
 			pos += 4
-			self.y = uint42float( data[pos:pos+4] )
+			r.y = uint42float( data[pos:pos+4] )
 			pos += 4
 
-		self.cost = None
-		if self.building_type in UNITCOST :
-			self.cost = UNITCOST[ self.building_type ]
+		r.cost = None
+		if r.building_type in UNITCOST :
+			r.cost = UNITCOST[ r.building_type ]
 
-		if self.building_type in UNITNAMES :
-			if self.building_type in FREEUNITS :
-				self.free_unit = FREEUNITS[ self.building_type ]
-				self.free_unit = UNITNAMES[ self.free_unit ]
-			self.building_type = UNITNAMES[ self.building_type ]
+		if r.building_type in UNITNAMES :
+			if r.building_type in FREEUNITS :
+				r.free_unit = FREEUNITS[ r.building_type ]
+				r.free_unit = UNITNAMES[ r.free_unit ]
+			r.building_type = UNITNAMES[ r.building_type ]
 		else :
-			self.building_type = "Bldg 0x%08X" % self.building_type
+			r.building_type = "Bldg 0x%08X" % r.building_type
 
 
 
@@ -474,6 +576,21 @@ class Command :
 
 
 
+# cmd.x, cmd.unit_ty, ... read and write the fields of cmd.rec.
+# Reading a field the record doesn't have raises AttributeError,
+# just like a missing attribute did, when they were in __dict__.
+def record_field( name ) :
+	def get( self ) :
+		return getattr( self.rec, name )
+	def set( self, val ) :
+		setattr( self.rec, name, val )
+	return property( get, set )
+
+for name in RECORD_FIELDS :
+	setattr( Command, name, record_field( name ) )
+
+
+
 class Splitter :
 	def split_fixed_len( cmd, f, cmdlen ) :
 		# that cmdlen includes the terminator and cmd code+0xff Thus, -3.
@@ -658,14 +775,17 @@ class Chunk :
 		self.time_code = 0
 		self.ty = 0
 		self.size = 0
-		self.data = None
+		self.buf = None # the replay body buffer, data is a view into this.
+		self.data_pos = 0
+		self.game = None
 
 		self.time = 0 # decoded time (str)
 
 		# for ty == 1
+		# ncmd and payload are valid after commands are accessed.
 		self.ncmd = 0
-		self.payload = None # undecoded payload
-		self.commands = []
+		self.payload_pos = None # undecoded payload is buf[ payload_pos:data_end ]
+		self._commands = None # None = not split yet. See commands below.
 
 		# for ty == 2
 		# player number, index in the player list in the plain-text game info
@@ -675,23 +795,62 @@ class Chunk :
 
 
 
+	# Slicing the buffer doesn't copy but a memoryview isn't free either.
+	# Most chunks are tiny heartbeats, nobody looks at their data,
+	# so the view is made only on demand.
+	@property
+	def data( self ) :
+		if self.buf == None :
+			return None
+		return self.buf[ self.data_pos:self.data_pos + self.size ]
+
+	@property
+	def payload( self ) :
+		if self.payload_pos == None :
+			return None
+		return self.buf[ self.payload_pos:self.data_pos + self.size ]
+
+
+
+	# Splitting is done on first access, not while loading.
+	# Lots of users only want the chunk time codes and
+	# they shouldn't pay for the splitting.
+	@property
+	def commands( self ) :
+		if self._commands == None :
+			if self.ty == 1 :
+				self._commands = []
+				self.split( self.game )
+			else :
+				# no commands in here. Don't make a list for each heartbeat.
+				self._commands = ()
+		return self._commands
+
+	@commands.setter
+	def commands( self, commands ) :
+		self._commands = commands
+
+
+
 	def split( self, game ) :
 		if self.ty != 1 :
 			# I only care about game affecting stuff.
 			return
 
-		f = io.BytesIO( self.data )
-		one = read_byte( f )
+		# data is a memoryview into the replay file buffer.
+		# Slicing it doesn't copy, so payload and the commands are views, too.
+		data = self.data
+		one, pos = unpack_byte( data, 0 )
 		assert one == 1
-		if self.data[ -1 ] != 0xFF :
+		if data[ -1 ] != 0xFF :
 			if Command.verbose :
 				print( "Some unknown command format:" )
 				print( "data:" )
-				print_bytes( self.data )
+				print_bytes( data )
 				print()
 		else :
-			self.ncmd = read_uint32( f )
-			self.payload = f.read()
+			self.ncmd, pos = unpack_uint32( data, pos )
+			self.payload_pos = self.data_pos + pos
 			self.split_commands( self.ncmd, self.payload, game )
 
 			if len( self.commands ) != self.ncmd :
@@ -711,7 +870,64 @@ class Chunk :
 
 
 	# Just try splitting commands by "FF".
+	# Each command is cmd_id, player byte, then content up to and including
+	# the first 0xFF. When ncmd == 1, there's nothing to split and the
+	# content runs to the last 0xFF.
+	# The terminators are searched by find(), which scans in C, instead of
+	# looking at each byte in Python. Views have no find(), so it's done on
+	# raw, where raw[ i ] is buf[ base+i ]:
+	# the bytes of the view when it is all of them (the whole body, base 0),
+	# otherwise a copy of the payload.
+	# payload is there for the old interface, we work on self.buf.
 	def split_commands( self, ncmd, payload, game ) :
+		# 3 for CNC3/KW. for RA3, k should be 2.
+		if game == "KW" or game == "CNC3" :
+			k = 3
+		else :
+			k = 2
+
+		buf = self.buf
+		pos = self.payload_pos
+		end = self.data_pos + self.size
+		assert end <= len( buf ), "Chunk runs past its buffer"
+		raw = buf.obj
+		if type( raw ) is bytes and buf.c_contiguous and len( raw ) == buf.nbytes :
+			base = 0
+		else :
+			base = pos
+			raw = bytes( buf[ pos:end ] )
+		pos -= base
+		end -= base
+		commands = self.commands
+
+		while pos < end :
+			c = Command()
+			commands.append( c )
+			c.cmd_id = raw[ pos ]
+			if pos+1 >= end :
+				break
+			c.player_id = raw[ pos+1 ] // 8 - k
+
+			start = pos + 2 # start of the cmd payload.
+			if ncmd == 1 :
+				ff = raw.rfind( 0xFF, start, end )
+			else :
+				ff = raw.find( 0xFF, start, end )
+			if ff < 0 :
+				break # unterminated, payload stays None.
+
+			c.buf = buf
+			c.start = base + start
+			c.length = ff+1 - start # +1 to include 0xFF as well.
+			if ncmd == 1 :
+				break
+			pos = ff+1
+
+
+
+	# The original byte by byte splitter. Does the same as split_commands.
+	# Kept for checking split_commands against it, see benchmark.py.
+	def split_commands_legacy( self, ncmd, payload, game ) :
 		# FSM modes
 		CMD_ID = 0
 		PID = 1
@@ -746,7 +962,9 @@ class Chunk :
 				# Well, do nothing.
 				if byte == 0xFF :
 					end = i+1 # +1 to include 0xFF as well.
-					c.payload = payload[ start:end ]
+					c.buf = self.buf
+					c.start = self.payload_pos + start
+					c.length = end - start
 
 					if ncmd != 1 :
 						# When ncmd ==1, we don't need to split!
@@ -784,9 +1002,21 @@ class Chunk :
 
 
 
+	# cmd_id -> ( Command decoder method, extra args for it ).
+	# Each game's Chunk class has its own table, built once at import.
+	DECODERS = {}
+
+	# Decoding is done once per command. The analyzers all call this on
+	# the same commands, and some of them modify the decoded fields
+	# (the timeline merges queue counts), so re-decoding would be wrong, too.
 	def decode_cmd( self, cmd ) :
-		# You need to override this function.
-		pass
+		if cmd.decoded :
+			return
+		decoder = self.DECODERS.get( cmd.cmd_id )
+		if decoder != None :
+			decode, args = decoder
+			decode( cmd, *args )
+		cmd.decoded = True
 
 
 
@@ -819,7 +1049,8 @@ class Chunk :
 
 	def dump_commands( self ) :
 		# print( "Time\tPlayer\tcmd_id\tparams" )
-		if self.ncmd != len( self.commands ) :
+		commands = self.commands # splits the chunk, if not done yet. ncmd is valid after this.
+		if self.ncmd != len( commands ) :
 			print( "Warning: ncmd & # command mismatch: %d:%d" %
 				(self.ncmd, len( self.commands ) ) )
 			print( "Just printing the chunk." )
@@ -834,7 +1065,6 @@ class Chunk :
 					# just hide this command.
 					continue
 				elif self.is_bo_cmd( cmd ) :
-					self.decode_cmd( cmd )
 					cmd.print_bo()
 				elif self.is_known_cmd( cmd ) :
 					print( self.resolve_known( cmd ) )
@@ -846,32 +1076,74 @@ class Chunk :
 	
 
 
+###
+### Chunk class registry.
+### Each game module registers its Chunk subclass here, like
+###     chunks.register_chunk_class( "KW", KWChunk )
+### at the bottom of kwchunks.py.
+### A game module that is not part of this package can do the same,
+### no need to touch this file.
+###
+CHUNK_CLASSES = {}
+
+# The games we ship. These modules import chunks, so we can't import them
+# at the top of this file. They get imported when the game is first asked for.
+BUILTIN_CHUNK_MODULES = {
+	"KW"   : "kwchunks",
+	"CNC3" : "twchunks",
+	"RA3"  : "ra3chunks",
+}
+
+# The registry of the chunks module.
+# When this file runs as a script, it is __main__ and the game modules
+# import (and register into) another copy of it, named chunks.
+# There must be only one registry, so we always go through that one.
+def chunk_classes() :
+	return importlib.import_module( "chunks" ).CHUNK_CLASSES
+
+def register_chunk_class( game, cls ) :
+	chunk_classes()[ game ] = cls
+
+def chunk_class( game ) :
+	classes = chunk_classes()
+	if not game in classes and game in BUILTIN_CHUNK_MODULES :
+		importlib.import_module( BUILTIN_CHUNK_MODULES[ game ] )
+	assert game in classes, "What game is this?"
+	return classes[ game ]
+
+
+
 class ReplayBody :
+	CHUNK_HEAD = struct.Struct( "<BI" ) # ty, size. Follows time_code.
+
 	def __init__( self, f, game="KW" ) :
 		self.chunks = []
 		self.game = game
+		self.chunk_class = chunk_class( game ) # resolved once, not per chunk.
+		self.decoded = False # decode_all() done.
+		self.buf = None # the rest of the replay file, after the header.
 		self.loadFromStream( f )
 	
-	def read_chunk( self, f ) :
-		if self.game == "KW" :
-			import kwchunks
-			chunk = kwchunks.KWChunk()
-		elif self.game == "CNC3" :
-			import twchunks
-			chunk = twchunks.TWChunk()
-		elif self.game == "RA3" :
-			import ra3chunks
-			chunk = ra3chunks.RA3Chunk()
-		else :
-			assert 0, "What game is this?"
-		chunk.time_code = read_uint32( f )
+	# Reads a chunk from buf at pos.
+	# buf should be a memoryview, chunk data is kept as a view into it.
+	# Returns ( chunk, pos after the chunk ). chunk == None on the end marker.
+	def read_chunk( self, buf, pos ) :
+		chunk = self.chunk_class()
+		chunk.time_code, pos = unpack_uint32( buf, pos )
 		if chunk.time_code == 0x7FFFFFFF :
-			return None
-
-		chunk.ty = read_byte( f )
-		chunk.size = read_uint32( f )
-		chunk.data = f.read( chunk.size )
-		unknown = read_uint32( f ) # mostly 0, but not always.
+			return None, pos
+
+		chunk.ty, chunk.size = ReplayBody.CHUNK_HEAD.unpack_from( buf, pos )
+		pos += ReplayBody.CHUNK_HEAD.size
+		end = pos + chunk.size
+		# after data, there's uint32 unknown, mostly 0, but not always.
+		# We don't need it but a truncated chunk must raise struct.error.
+		nxt = end + 4
+		if nxt > len( buf ) :
+			raise struct.error( "chunk runs past the end of the buffer" )
+		chunk.buf = buf
+		chunk.data_pos = pos
+		chunk.game = self.game
 
 		# chunk debugging stuff:
 		#print( "chunk pos: 0x%08X" % f.tell() )
@@ -882,23 +1154,41 @@ class ReplayBody :
 		#print_bytes( chunk.data )
 		#print()
 	
-		chunk.split( self.game )
-		return chunk
+		# no splitting here, chunk.commands does it when needed.
+		return chunk, nxt
 	
+	# Reads the rest of the file once and cuts chunks out of it.
+	# f is left right after the chunks, where the footer begins.
 	def loadFromStream( self, f ) :
+		start = f.tell()
+		self.buf = memoryview( f.read() )
+		pos = 0
 		while True :
-			chunk = self.read_chunk( f )
+			chunk, pos = self.read_chunk( self.buf, pos )
 			if chunk == None :
 				break
 			self.chunks.append( chunk )
+		f.seek( start + pos )
 	
+	# Decode all the commands, once. Users of the decoded commands
+	# call this first and then just read the commands.
+	def decode_all( self ) :
+		if self.decoded :
+			return
+		for chunk in self.chunks :
+			for cmd in chunk.commands :
+				chunk.decode_cmd( cmd )
+		self.decoded = True
+
 	def print_bo( self ) :
+		self.decode_all()
 		print( "Dump of known build order related commands" )
 		print( "Time\tPlayer\tAction" )
 		for chunk in self.chunks :
 			chunk.print_bo()
 	
 	def dump_commands( self ) :
+		self.decode_all()
 		print( "Dump of commands" )
 		print( "Time\tPlayer\tcmd_id\tparams" )
 		for chunk in self.chunks :
@@ -909,6 +1199,7 @@ class ReplayBody :
 class KWReplayWithCommands( KWReplay ) :
 	def __init__( self, fname=None, verbose=False ) :
 		self.replay_body = None
+		self.cmd_table = None # columnar view, see command_table()
 
 		# self.footer_str ... useless
 		self.final_time_code = 0
@@ -951,6 +1242,22 @@ class KWReplayWithCommands( KWReplay ) :
 
 
 
+	# Decodes all commands. Does nothing if already done.
+	def decode_all( self ) :
+		self.replay_body.decode_all()
+
+
+
+	# All commands, decoded, as parallel arrays. See cmdtable.py.
+	# Built on first call. numpy arrays if numpy is there.
+	def command_table( self ) :
+		if self.cmd_table == None :
+			import cmdtable
+			self.cmd_table = cmdtable.CommandTable.from_replay( self )
+		return self.cmd_table
+
+
+
 	def loadFromFile( self, fname ) :
 		self.guess_game( fname )
 		f = open( fname, 'rb' )
@@ -961,6 +1268,89 @@ class KWReplayWithCommands( KWReplay ) :
 
 
 
+###
+### Counting commands without making them, for the APM column of the player list.
+### Walks the chunks in the file buffer and looks at the player byte of each
+### command, split the way Chunk.split_commands does it. No Chunk, no Command,
+### nothing is decoded.
+###
+### Returns ( header (KWReplay), counts, game_len ):
+### counts[ pid ] = commands of the player, game_len = seconds up to the last command.
+### The same numbers APMAnalyzer gets out of KWReplayWithCommands:
+### chunks with a count mismatch are dropped (fix_mismatch) and
+### so are commands of invalid players (fix_pid).
+###
+def count_actions( fname ) :
+	kwr = KWReplay()
+	kwr.guess_game( fname )
+	f = open( fname, 'rb' )
+	kwr.loadFromStream( f )
+	raw = f.read()
+	f.close()
+
+	# 3 for CNC3/KW. for RA3, k should be 2.
+	if kwr.game == "KW" or kwr.game == "CNC3" :
+		k = 3
+	else :
+		k = 2
+	nplayers = len( kwr.players )
+	counts = [ 0 ] * nplayers
+	game_len = 0
+
+	# time_code, ty, size in one go. Most chunks are heartbeats, this loop is it.
+	frame = struct.Struct( "<IBI" )
+	raw_len = len( raw )
+	pos = 0
+	while True :
+		if pos + frame.size <= raw_len :
+			time_code, ty, size = frame.unpack_from( raw, pos )
+		else :
+			# only the end marker fits in here, or it's broken.
+			time_code, nxt = unpack_uint32( raw, pos )
+			if time_code != 0x7FFFFFFF :
+				raise struct.error( "chunk runs past the end of the buffer" )
+		if time_code == 0x7FFFFFFF :
+			break
+		data_pos = pos + frame.size
+		end = data_pos + size
+		pos = end + 4
+		if pos > raw_len :
+			raise struct.error( "chunk runs past the end of the buffer" )
+		if ty != 1 :
+			continue
+
+		assert raw[ data_pos ] == 1
+		if raw[ end-1 ] != 0xFF :
+			continue # unknown command format, no commands.
+		ncmd, cmd_pos = unpack_uint32( raw, data_pos+1 )
+
+		pids = []
+		while cmd_pos < end :
+			if cmd_pos+1 >= end :
+				pids.append( 0 ) # Command() has player_id 0.
+				break
+			pids.append( raw[ cmd_pos+1 ] // 8 - k )
+			if ncmd == 1 :
+				break
+			ff = raw.find( 0xFF, cmd_pos+2, end )
+			if ff < 0 :
+				break
+			cmd_pos = ff+1
+		if len( pids ) != ncmd :
+			continue # fix_mismatch drops them all.
+
+		counted = False
+		for pid in pids :
+			if pid < nplayers :
+				counts[ pid ] += 1
+				counted = True
+		if counted :
+			game_len = max( game_len, int( time_code / 15 ) + 1 )
+
+	return kwr, counts, game_len
+
+
+
 ###
 ###
 ###
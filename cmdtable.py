@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# coding: utf8
+
+###
+### Columnar view of all the commands in a replay.
+### One array per field instead of one object per command,
+### so statistics can be done on whole columns at once.
+###
+### Columns are numpy arrays if numpy is installed.
+### Without numpy, they are array.array, which is still compact,
+### works with len(), indexing and loops, just not vectorized math.
+###
+
+import sys
+import array
+from chunks import Command
+
+try :
+	import numpy
+except ImportError :
+	numpy = None
+
+
+
+class CommandTable :
+	NO_NAME = -1 # name_id of commands without unit/power/upgrade name.
+	NO_COST = -1 # cost of commands without cost (or with unknown cost).
+
+	# name: array.array typecode. numpy dtypes are derived from these.
+	COLUMNS = [
+		( "time_code", "I" ),
+		( "player_id", "h" ),
+		( "cmd_id", "B" ),
+		( "cmd_ty", "B" ),
+		( "x", "f" ), # for 2pos commands, this is x1. NaN if no position.
+		( "y", "f" ),
+		( "x2", "f" ), # NaN if not a 2pos command.
+		( "y2", "f" ),
+		( "cost", "i" ),
+		( "name_id", "i" ), # index into names
+	]
+
+	def __init__( self ) :
+		self.names = [] # interned unit/power/upgrade/building names.
+		self.name_ids = {} # name -> index in names
+		for name, code in CommandTable.COLUMNS :
+			setattr( self, name, array.array( code ) )
+
+	def __len__( self ) :
+		return len( self.time_code )
+
+	def intern( self, name ) :
+		if name in self.name_ids :
+			return self.name_ids[ name ]
+		nid = len( self.names )
+		self.names.append( name )
+		self.name_ids[ name ] = nid
+		return nid
+
+	def name_of( self, nid ) :
+		if nid == CommandTable.NO_NAME :
+			return None
+		return self.names[ nid ]
+
+
+
+	# append one decoded command.
+	def append( self, cmd ) :
+		nan = float( "nan" )
+		x = y = x2 = y2 = nan
+		if cmd.has_2pos() :
+			x, y, x2, y2 = cmd.x1, cmd.y1, cmd.x2, cmd.y2
+		elif cmd.has_1pos() :
+			x, y = cmd.x, cmd.y
+
+		# The name is whatever the decoder set.
+		# Unknown ones are still strings like "Unit 0x12345678".
+		name = None
+		rec = cmd.rec
+		for field in ( "unit_ty", "power", "upgrade", "building_type", "science" ) :
+			name = getattr( rec, field, None )
+			if name != None :
+				break
+		nid = CommandTable.NO_NAME
+		if type( name ) == str :
+			nid = self.intern( name )
+
+		# RA3 costs are ( cost, build time ).
+		cost = getattr( rec, "cost", None )
+		if type( cost ) == tuple :
+			cost = cost[0]
+		if cost == None :
+			cost = CommandTable.NO_COST
+
+		self.time_code.append( cmd.time_code )
+		self.player_id.append( cmd.player_id )
+		self.cmd_id.append( cmd.cmd_id )
+		self.cmd_ty.append( cmd.cmd_ty )
+		self.x.append( x )
+		self.y.append( y )
+		self.x2.append( x2 )
+		self.y2.append( y2 )
+		self.cost.append( cost )
+		self.name_id.append( nid )
+
+
+
+	# Turn the columns into numpy arrays, without copying.
+	def to_numpy( self ) :
+		if numpy == None :
+			return
+		for name, code in CommandTable.COLUMNS :
+			col = getattr( self, name )
+			setattr( self, name, numpy.frombuffer( col, dtype=code ) )
+
+
+
+	# Decodes all commands of kwr (KWReplayWithCommands) into a table.
+	def from_replay( kwr ) :
+		table = CommandTable()
+		kwr.decode_all()
+		for chunk in kwr.replay_body.chunks :
+			for cmd in chunk.commands :
+				table.append( cmd )
+		table.to_numpy()
+		return table
+
+
+
+###
+### Dump the table of a replay.
+###
+def main() :
+	from chunks import KWReplayWithCommands
+	fname = "1.KWReplay"
+	if len( sys.argv ) >= 2 :
+		fname = sys.argv[1]
+	kwr = KWReplayWithCommands( fname=fname )
+	table = kwr.command_table()
+	print( len( table ), "commands,", len( table.names ), "names" )
+	if numpy == None :
+		print( "numpy not found, columns are array.array" )
+	print( "time_code\tplayer_id\tcmd_id\tcmd_ty\tx\ty\tcost\tname" )
+	for i in range( len( table ) ) :
+		if table.cmd_ty[ i ] == Command.NONE :
+			continue
+		print( "%d\t%d\t0x%02X\t%d\t%.1f\t%.1f\t%d\t%s" % ( table.time_code[ i ],
+			table.player_id[ i ], table.cmd_id[ i ], table.cmd_ty[ i ],
+			table.x[ i ], table.y[ i ], table.cost[ i ],
+			table.name_of( table.name_id[ i ] ) ) )
+
+if __name__ == "__main__" :
+	main()
@@ -5,6 +5,41 @@ import string
 # I'm not gonna do that.
 # Lets support simpler version of this google like search:
 # https://cloud.google.com/appengine/docs/python/search/query_strings
+# Search fields of a replay, for field scoped terms like map:rocktagon.
+FIELDS = [ "map", "desc", "player", "ip", "file", "apm" ]
+
+# Numbers, only searched with the field, apm:150 (or apm:>100, apm:<50).
+# Otherwise every term with a digit in it would hit some APM.
+SCOPED_ONLY = [ "apm" ]
+
+
+
+# Every 3 letter substring of text. Terms shorter than that have none.
+def trigrams( text ) :
+	return set( text[ i:i+3 ] for i in range( len( text ) - 2 ) )
+
+
+
+# The searchable strings of one replay, lowercased once.
+# Compute this once per replay and match as many queries as you like.
+# pairs: ( field, text ) list. field is one of FIELDS.
+class SearchProps :
+	def __init__( self, pairs ) :
+		self.props = [ text.lower() for field, text in pairs ]
+		self.fields = [ field for field, text in pairs ]
+		self.all = ( 1 << len( self.props ) ) - 1 # bit i = props[ i ]
+
+		# All props in one string. If a term isn't in there, it isn't in any prop
+		# and we don't have to look at them one by one.
+		self.text = "\n".join( prop
+			for f, prop in zip( self.fields, self.props ) if not f in SCOPED_ONLY )
+		self.field_text = {}
+		for field in FIELDS :
+			self.field_text[ field ] = "\n".join( prop
+				for f, prop in zip( self.fields, self.props ) if f == field )
+
+
+
 class FilterQuery :
 	def __init__( self, qstring ) :
 		self.postfix = self.compile( qstring )
@@ -12,11 +47,23 @@ class FilterQuery :
 			print( qstring )
 			print( self.postfix )
 			print()
+		self.func = self.build( self.postfix )
 	
 
 
 	# see if the replay is a hit to query.
+	# props: SearchProps of the replay.
 	def match( self, props ) :
+		if self.func == None :
+			# empty query.
+			return True
+		return self.func( props )
+
+
+
+	# The old interpreter, kept for the benchmark.
+	# props: list of lowercase strings.
+	def match_legacy( self, props ) :
 		if len( self.postfix ) == 0 :
 			# empty query.
 			return True
@@ -48,7 +95,6 @@ class FilterQuery :
 					if prop.find( item ) >= 0 :
 						hits.add( prop )
 				operand_stack.append( hits )
-				print( operand_stack )
 
 		assert len( operand_stack ) >= 1
 
@@ -61,16 +107,179 @@ class FilterQuery :
 
 
 
+	# Turn postfix into a tree of closures, once per query.
+	# Like match_legacy, operands are sets of props, here as bit masks:
+	# bit i is set if props[ i ] is in the set.
+	# Raises SyntaxError on broken queries like "gdi and".
+	def build( self, postfix ) :
+		if len( postfix ) == 0 :
+			return None
+
+		operand_stack = []
+		for item in postfix :
+			try :
+				if item == "not" :
+					op = operand_stack.pop()
+					operand_stack.append( FilterQuery.op_not( op ) )
+				elif item == "and" :
+					op1 = operand_stack.pop()
+					op2 = operand_stack.pop()
+					operand_stack.append( FilterQuery.op_and( op1, op2 ) )
+				elif item == "or" :
+					op1 = operand_stack.pop()
+					op2 = operand_stack.pop()
+					operand_stack.append( FilterQuery.op_or( op1, op2 ) )
+				else :
+					operand_stack.append( FilterQuery.term( item ) )
+			except IndexError :
+				raise SyntaxError( "Missing operand for " + item.upper() )
+
+		# implied OR of the left overs.
+		if len( operand_stack ) == 1 :
+			op = operand_stack[0]
+			return lambda props : op( props ) != 0
+		return lambda props : any( op( props ) for op in operand_stack )
+
+	def op_not( op ) :
+		return lambda props : props.all & ~op( props )
+
+	def op_and( op1, op2 ) :
+		return lambda props : op1( props ) & op2( props )
+
+	def op_or( op1, op2 ) :
+		return lambda props : op1( props ) | op2( props )
+
+	# A search string. field:text only looks in the props of that field.
+	# Quoted ones are never field scoped, "map:x" looks for map:x.
+	# Returns ( field, text ), field is None if not scoped.
+	def split_term( item ) :
+		field = None
+		if item.startswith( "\"" ) and item.endswith( "\"" ) :
+			item = item[1:-1]
+		else :
+			head, sep, tail = item.partition( ":" )
+			if sep and head in FIELDS :
+				field = head
+				item = tail
+				if item.startswith( "\"" ) and item.endswith( "\"" ) :
+					item = item[1:-1]
+		return field, item
+
+	def term( item ) :
+		field, item = FilterQuery.split_term( item )
+		if field == "apm" and item[:1] in [ "<", ">" ] and item[1:].isdigit() :
+			return FilterQuery.compare( field, item[0], int( item[1:] ) )
+
+		def hits( props ) :
+			if field == None :
+				if not item in props.text :
+					return 0
+			elif not item in props.field_text[ field ] :
+				return 0
+			mask = 0
+			for i, prop in enumerate( props.props ) :
+				if not item in prop :
+					continue
+				if field == None :
+					if not props.fields[ i ] in SCOPED_ONLY :
+						mask |= 1 << i
+				elif props.fields[ i ] == field :
+					mask |= 1 << i
+			return mask
+		return hits
+
+	# apm:>100, the props of field are numbers.
+	def compare( field, op, val ) :
+		def hits( props ) :
+			mask = 0
+			for i, prop in enumerate( props.props ) :
+				if props.fields[ i ] != field :
+					continue
+				if ( op == ">" and int( prop ) > val ) or ( op == "<" and int( prop ) < val ) :
+					mask |= 1 << i
+			return mask
+		return hits
+
+	# Is there a field:text term of field?
+	def has_field( self, field ) :
+		for item in self.postfix :
+			if item in [ "and", "or", "not" ] :
+				continue
+			if FilterQuery.split_term( item )[0] == field :
+				return True
+		return False
+
+
+
+	# Replays that may match, from an index.
+	# lookup( text, field ) returns the set of replays that may contain text,
+	# or None if it can't tell (all of them may).
+	# Returns a set that has every match, plus some that the match() will drop.
+	# None if it can't narrow it down.
+	def candidates( self, lookup ) :
+		if len( self.postfix ) == 0 :
+			return None
+
+		operand_stack = []
+		for item in self.postfix :
+			if item == "not" :
+				# anything may have a prop without the term.
+				operand_stack.pop()
+				operand_stack.append( None )
+			elif item == "and" :
+				op1 = operand_stack.pop()
+				op2 = operand_stack.pop()
+				if op1 == None :
+					operand_stack.append( op2 )
+				elif op2 == None :
+					operand_stack.append( op1 )
+				else :
+					operand_stack.append( op1 & op2 )
+			elif item == "or" :
+				op1 = operand_stack.pop()
+				op2 = operand_stack.pop()
+				operand_stack.append( FilterQuery.union( op1, op2 ) )
+			else :
+				field, text = FilterQuery.split_term( item )
+				operand_stack.append( lookup( text, field ) )
+
+		result = operand_stack[0]
+		for op in operand_stack[1:] :
+			result = FilterQuery.union( result, op )
+		return result
+
+	def union( op1, op2 ) :
+		if op1 == None or op2 == None :
+			return None
+		return op1 | op2
+
+
+
 	def compile( self, qstring ) :
 		tokens = self.tokenize( qstring )
 		# smaller case conversion.
 		for i, tok in enumerate( tokens ) :
 			tokens[ i ] = tok.lower()
+		tokens = self.join_fields( tokens )
 		postfix = self.to_postfix( tokens )
 		return postfix
 
 
 
+	# map:"the rocktagon" is tokenized as map: and "the rocktagon".
+	# Glue them back together.
+	def join_fields( self, tokens ) :
+		result = []
+		for tok in tokens :
+			if result and tok.startswith( "\"" ) and \
+					result[-1].endswith( ":" ) and result[-1][:-1] in FIELDS :
+				result[-1] += tok
+			else :
+				result.append( tok )
+		return result
+
+
+
 	# http://en.wikipedia.org/wiki/Shunting-yard_algorithm
 	# infix -> postfix conversion.
 	def to_postfix( self, tokens ) :
@@ -89,10 +298,12 @@ class FilterQuery :
 			elif tok == ")" :
 				# Until the token at the top of the stack is a left parenthesis,
 				# pop operators off the stack onto the output queue.
-				while operator_stack[-1] != "(" :
+				while operator_stack and operator_stack[-1] != "(" :
 					# there SHOULD be a ( in the stack already.
 					# Otherwise, it is a syntax error.
 					result.append( operator_stack.pop() )
+				if not operator_stack :
+					raise SyntaxError( "Unmatched parenthesis" )
 				lpar = operator_stack.pop()
 				assert lpar == "("
 			elif not tok in operators : # operand
@@ -106,8 +317,7 @@ class FilterQuery :
 		# pop left-overs.
 		while len( operator_stack ) > 0 :
 			if operator_stack[-1] == "(" :
-				print( "Unmatched parenthesis" )
-				raise SyntaxError
+				raise SyntaxError( "Unmatched parenthesis" )
 			else :
 				result.append( operator_stack.pop() )
 
@@ -209,6 +419,12 @@ def main() :
 	fq = FilterQuery( "not gdi or nod" )
 	fq = FilterQuery( "(not gdi) or nod" )
 	fq = FilterQuery( "not (gdi or nod)" )
+	fq = FilterQuery( "map:\"the rocktagon\" or player:kyky" )
+
+	props = SearchProps( [ ( "map", "The Rocktagon" ), ( "player", "kyky" ), ( "player", "noonal" ) ] )
+	for q in [ "rock", "map:rock", "player:rock", "map:\"the rocktagon\"", "kyky and noonal",
+			"not kyky", "player:kyky or desc:kyky" ] :
+		print( q, FilterQuery( q ).match( props ) )
 
 
 
@@ -1142,35 +1142,23 @@ class KWChunk( chunks.Chunk ) :
 	def resolve_known( self, cmd ) :
 		return CMDNAMES[ cmd.cmd_id ]
 
-	def decode_cmd( self, cmd ) :
-		if cmd.cmd_id == 0x31 :
-			cmd.decode_placedown_cmd( UNITNAMES, UNITCOST, FREEUNITS )
-		elif cmd.cmd_id == 0x26 :
-			cmd.decode_skill_targetless( POWERNAMES, POWERCOST )
-		elif cmd.cmd_id == 0x27 :
-			cmd.decode_skill_xy( POWERNAMES, POWERCOST )
-		elif cmd.cmd_id == 0x28 :
-			cmd.decode_skill_target( POWERNAMES, POWERCOST )
-		elif cmd.cmd_id == 0x2B :
-			cmd.decode_upgrade_cmd( UPGRADENAMES, UPGRADECOST )
-		elif cmd.cmd_id == 0x2D :
-			cmd.decode_queue_cmd( UNITNAMES, AFLD_UNITS, UNITCOST )
-		elif cmd.cmd_id == 0x2E :
-			cmd.decode_hold_cmd( UNITNAMES )
-		elif cmd.cmd_id == 0x8A :
-			cmd.decode_skill_2xy( POWERNAMES, POWERCOST )
-		elif cmd.cmd_id == 0x34 :
-			cmd.decode_sell_cmd()
-		elif cmd.cmd_id == 0x7A :
-			cmd.decode_formation_move_cmd()
-		elif cmd.cmd_id == 0x46 :
-			cmd.decode_move_cmd()
-		elif cmd.cmd_id == 0x8E :
-			cmd.decode_reverse_move_cmd()
-		elif cmd.cmd_id == 0x89 :
-			cmd.decode_powerdown_cmd()
-		elif cmd.cmd_id == 0x91 :
-			cmd.decode_gg()
+	# cmd_id -> ( decoder, args ). See chunks.Chunk.decode_cmd.
+	DECODERS = {
+		0x31 : ( chunks.Command.decode_placedown_cmd, ( UNITNAMES, UNITCOST, FREEUNITS ) ),
+		0x26 : ( chunks.Command.decode_skill_targetless, ( POWERNAMES, POWERCOST ) ),
+		0x27 : ( chunks.Command.decode_skill_xy, ( POWERNAMES, POWERCOST ) ),
+		0x28 : ( chunks.Command.decode_skill_target, ( POWERNAMES, POWERCOST ) ),
+		0x2B : ( chunks.Command.decode_upgrade_cmd, ( UPGRADENAMES, UPGRADECOST ) ),
+		0x2D : ( chunks.Command.decode_queue_cmd, ( UNITNAMES, AFLD_UNITS, UNITCOST ) ),
+		0x2E : ( chunks.Command.decode_hold_cmd, ( UNITNAMES, ) ),
+		0x8A : ( chunks.Command.decode_skill_2xy, ( POWERNAMES, POWERCOST ) ),
+		0x34 : ( chunks.Command.decode_sell_cmd, () ),
+		0x7A : ( chunks.Command.decode_formation_move_cmd, () ),
+		0x46 : ( chunks.Command.decode_move_cmd, () ),
+		0x8E : ( chunks.Command.decode_reverse_move_cmd, () ),
+		0x89 : ( chunks.Command.decode_powerdown_cmd, () ),
+		0x91 : ( chunks.Command.decode_gg, () ),
+	}
 
 
 
@@ -1248,3 +1236,7 @@ class KWChunk( chunks.Chunk ) :
 			if not cmd :
 				self.commands = [] # Let's not have anything... it is meaningless.
 				break
+
+
+
+chunks.register_chunk_class( "KW", KWChunk )
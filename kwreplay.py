@@ -196,6 +196,10 @@ class Player :
 
 
 class KWReplay :
+	# loadFromStream reads this much to parse the header from memory.
+	# Headers are around 1KB. If not enough, it reads more.
+	HEADER_READ_SIZE = 4096
+
 	def __init__( self, fname=None, verbose=False, game=None ) :
 		self.fname = fname # for tracking
 		self.game = game
@@ -325,7 +329,95 @@ class KWReplay :
 
 
 
+	# Reads the header in one go and decodes it from memory.
+	# read_tb_str does one f.read per character and it really shows
+	# when scanning a folder with thousands of replays.
+	# Leaves f right after the header, just like the legacy reader.
 	def loadFromStream( self, f ) :
+		if self.verbose :
+			# The legacy one prints everything it reads. Good for debugging.
+			self.loadFromStreamLegacy( f )
+			return
+
+		pos = f.tell()
+		size = KWReplay.HEADER_READ_SIZE
+		while True :
+			buf = f.read( size )
+			try :
+				end = self.parse_header( buf )
+				break
+			except struct.error :
+				if len( buf ) < size :
+					# we've got the whole file and still it is not enough.
+					raise
+				# Unusually long header. Read more and try again.
+				size *= 4
+				f.seek( pos )
+
+		f.seek( pos + end )
+
+
+
+	# Decodes the header from buf, which begins with the magic.
+	# Returns the offset of the end of the header (= start of the chunks).
+	# This must stay in sync with loadFromStreamLegacy.
+	def parse_header( self, buf ) :
+		self.magic, pos = unpack_cstr( buf, 0, self.MAGIC_SIZE )
+		self.hnumber1, pos = unpack_byte( buf, pos )
+
+		( self.vermajor, self.verminor, self.buildmajor, self.buildminor ) = \
+				struct.unpack_from( '4I', buf, pos )
+		pos += 16
+
+		self.title, pos = unpack_tb_str( buf, pos )
+		self.desc, pos = unpack_tb_str( buf, pos )
+		self.map_name, pos = unpack_tb_str( buf, pos )
+		self.map_id, pos = unpack_tb_str( buf, pos )
+
+		self.player_cnt, pos = unpack_byte( buf, pos )
+		for i in range( self.player_cnt + 1 ) : # one extra dummy player exists!
+			pos += 4 # player_id
+			player_name, pos = unpack_tb_str( buf, pos )
+			if self.hnumber1 == 5 : # internet game has "team info".
+				pos += 1
+
+		offset, pos = unpack_uint32( buf, pos )
+		str_repl_length, pos = unpack_uint32( buf, pos ) # always == 8
+		repl_magic, pos = unpack_cstr( buf, pos, str_repl_length )
+
+		if self.game == "CNC3" or self.game == "RA3" :
+			self.mod_info, pos = unpack_cstr( buf, pos, 22 )
+
+		self.timestamp, pos = unpack_uint32( buf, pos )
+		pos += self.U1_SIZE # unknown 1
+
+		header_len, pos = unpack_uint32( buf, pos )
+		header, pos = unpack_cstr( buf, pos, header_len )
+
+		self.replay_saver, pos = unpack_byte( buf, pos )
+		pos += 8 # zero3, zero4
+
+		filename_length, pos = unpack_uint32( buf, pos )
+		filename, pos = unpack_tb_str( buf, pos, length=filename_length )
+		pos += 2*8 # date_time, 8 tb chars.
+
+		vermagic_len, pos = unpack_uint32( buf, pos )
+		pos += vermagic_len
+		pos += 4 # magic_hash
+		pos += 1 # zero5
+		pos += self.U2_SIZE*4
+
+		# The skipped parts must have been in the buffer, too.
+		if pos > len( buf ) :
+			raise struct.error( "header is truncated" )
+
+		self.decode_header_and_set( header )
+		return pos
+
+
+
+	# The original reader, field by field from the stream.
+	def loadFromStreamLegacy( self, f ) :
 		self.magic = read_cstr( f, self.MAGIC_SIZE )
 		if self.verbose :
 			print( "-- header" )
@@ -631,6 +723,53 @@ class KWReplay :
 		data = data.encode( "ascii" ) # cstr is meant to be ascii.
 		f.write( data )
 
+###
+### Is the replay complete? The game writes the footer last:
+###   0x7FFFFFFF (end of chunks), "C&C3 REPLAY FOOTER" or "RA3 REPLAY FOOTER",
+###   final time code, some data, footer length (uint32, counting the magic).
+### Footers are 27 to 67 bytes in the wild, so the tail of the file is enough.
+### repair.py checks the footers with footer_magic, too.
+###
+FOOTER_MAGICS = {
+	"KW" : b"C&C3 REPLAY FOOTER",
+	"CNC3" : b"C&C3 REPLAY FOOTER",
+	"RA3" : b"RA3 REPLAY FOOTER",
+}
+MIN_FOOTER = min( len( magic ) for magic in FOOTER_MAGICS.values() ) + 8 # + time code + length
+FOOTER_TAIL = 150 # bytes from the end of the file to look at.
+END_OF_CHUNKS = b"\xff\xff\xff\x7f"
+
+# The magic that footer begins with, None if there's none.
+# game: only that game's magic, None for any.
+def footer_magic( footer, game=None ) :
+	for g, magic in FOOTER_MAGICS.items() :
+		if ( game == None or g == game ) and footer.startswith( magic ) :
+			return magic
+	return None
+
+# tail: the last bytes of a replay file.
+def check_footer( tail, game=None ) :
+	if len( tail ) < 8 :
+		return False
+	footer_len = uint42int( tail[ -4: ] )
+	if footer_len < MIN_FOOTER or footer_len + 4 > len( tail ) :
+		return False
+	if footer_magic( tail[ -footer_len: ], game ) == None :
+		return False
+	return tail[ -footer_len-4 : -footer_len ] == END_OF_CHUNKS
+
+# Reads just the last FOOTER_TAIL bytes of fname.
+def has_footer( fname ) :
+	f = open( fname, "rb" )
+	try :
+		size = f.seek( 0, io.SEEK_END )
+		f.seek( max( 0, size - FOOTER_TAIL ) )
+		return check_footer( f.read() )
+	finally :
+		f.close()
+
+
+
 ###
 ###
 ###
@@ -422,43 +422,30 @@ class RA3Chunk( chunks.Chunk ) :
 		return CMDNAMES[ cmd.cmd_id ]
 
 	# Decode decodable commands
-	def decode_cmd( self, cmd ) :
+	# cmd_id -> ( decoder, args ). See chunks.Chunk.decode_cmd.
+	DECODERS = {
 		# hide some distracting commands
-		if cmd.cmd_id == 0x21 :
-			cmd.cmd_ty = chunks.Command.HIDDEN # lets forbid this from showing.
-
-		if cmd.cmd_id == 0x09 :
-			cmd.decode_placedown_cmd( UNITNAMES, UNITCOST, FREEUNITS )
-		elif cmd.cmd_id == 0x05 :
-			cmd.decode_ra3_queue_cmd( UNITNAMES, AFLD_UNITS, UNITCOST )
-		elif cmd.cmd_id == 0x06 :
-			cmd.decode_ra3_hold_cmd( UNITNAMES )
-		elif cmd.cmd_id == 0x00 :
-			cmd.decode_ra3_deploy_cmd()
-		elif cmd.cmd_id == 0x14 :
-			cmd.decode_move_cmd()
-		elif cmd.cmd_id == 0x0A :
-			cmd.decode_sell_cmd()
-		elif cmd.cmd_id == 0x2c :
-			cmd.decode_formation_move_cmd()
-		elif cmd.cmd_id == 0x36 :
-			cmd.decode_reverse_move_cmd()
-		elif cmd.cmd_id == 0x4E :
-			cmd.decode_science_sel_cmd( SCIENCENAMES )
-		elif cmd.cmd_id == 0xFF :
-			cmd.decode_skill_xy( POWERNAMES, POWERCOST )
-		elif cmd.cmd_id == 0x01 :
-			# sometimes, GG
-			cmd.decode_skill_target( POWERNAMES, POWERCOST )
-		elif cmd.cmd_id == 0x03 :
-			cmd.decode_upgrade_cmd( UPGRADENAMES, UPGRADECOST )
-		elif cmd.cmd_id == 0xFE :
-			cmd.decode_skill_targetless( POWERNAMES, POWERCOST )
-		elif cmd.cmd_id == 0x32 :
-			cmd.decode_skill_2xy( POWERNAMES, POWERCOST )
-
-		#if cmd.cmd_id == 0x01 :
-		#	cmd.decode_gg()
+		0x21 : ( chunks.Command.decode_hidden, () ), # lets forbid this from showing.
+
+		0x09 : ( chunks.Command.decode_placedown_cmd, ( UNITNAMES, UNITCOST, FREEUNITS ) ),
+		0x05 : ( chunks.Command.decode_ra3_queue_cmd, ( UNITNAMES, AFLD_UNITS, UNITCOST ) ),
+		0x06 : ( chunks.Command.decode_ra3_hold_cmd, ( UNITNAMES, ) ),
+		0x00 : ( chunks.Command.decode_ra3_deploy_cmd, () ),
+		0x14 : ( chunks.Command.decode_move_cmd, () ),
+		0x0A : ( chunks.Command.decode_sell_cmd, () ),
+		0x2c : ( chunks.Command.decode_formation_move_cmd, () ),
+		0x36 : ( chunks.Command.decode_reverse_move_cmd, () ),
+		0x4E : ( chunks.Command.decode_science_sel_cmd, ( SCIENCENAMES, ) ),
+		0xFF : ( chunks.Command.decode_skill_xy, ( POWERNAMES, POWERCOST ) ),
+		0x01 : ( chunks.Command.decode_skill_target, ( POWERNAMES, POWERCOST ) ), # sometimes, GG
+		0x03 : ( chunks.Command.decode_upgrade_cmd, ( UPGRADENAMES, UPGRADECOST ) ),
+		0xFE : ( chunks.Command.decode_skill_targetless, ( POWERNAMES, POWERCOST ) ),
+		0x32 : ( chunks.Command.decode_skill_2xy, ( POWERNAMES, POWERCOST ) ),
+
+		#0x01 : ( chunks.Command.decode_gg, () ),
 		# Fortunately, we don't have target skill, in the sidebar skills, in TW.
-		#elif cmd.cmd_id == 0x?? :
-		#	cmd.decode_skill_target( POWERNAMES, POWERCOST )
+		#0x?? : ( chunks.Command.decode_skill_target, ( POWERNAMES, POWERCOST ) ),
+	}
+
+
+chunks.register_chunk_class( "RA3", RA3Chunk )
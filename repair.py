@@ -5,9 +5,9 @@ import io
 import shutil
 import struct
 import traceback
-from chunks import KWReplayWithCommands, uint42int, print_bytes, ReplayBody
+from chunks import KWReplayWithCommands, uint42int, print_bytes, ReplayBody, chunk_class
 from kwreplay import KWReplay, read_byte, read_uint32, read_float, \
-	read_cstr, time_code2str, read_tb_str
+	read_cstr, time_code2str, read_tb_str, footer_magic
 
 
 
@@ -17,21 +17,28 @@ def write_cstr( f, s, null_terminate = False ) :
 
 
 class HealingReplayBody( ReplayBody ) :
-	def __init__( self, f ) :
+	def __init__( self, f, game="KW" ) :
 		self.chunks = []
+		self.game = game
+		self.chunk_class = chunk_class( game )
+		self.decoded = False
+		self.buf = None
 		self.creep_chunks( f )
 	
 	def creep_chunks( self, f ) :
 		good_chunk_cnt = 0
+		start = f.tell()
+		self.buf = memoryview( f.read() )
+		pos = 0
 		try :
 			while True :
-				pos = f.tell()
-				chunk = self.read_chunk( f )
+				chunk, nxt = self.read_chunk( self.buf, pos )
 				if chunk == None :
 					break
-				chunk.pos = pos
+				chunk.pos = start + pos # position in the file.
 				self.chunks.append( chunk )
 				good_chunk_cnt += 1
+				pos = nxt
 		except struct.error :
 			# This is the limit we reach. We stop reading chunks.
 			pass
@@ -74,21 +81,15 @@ class KWReplayRepair( KWReplayWithCommands ) :
 
 
 	def check_magic( self, footer_data, footer_len ) :
-		stream = io.BytesIO( footer_data )
-		if self.game == "RA3" :
-			self.FOOTER_MAGIC_SIZE = 17
-		magic = read_cstr( stream, self.FOOTER_MAGIC_SIZE )
-
-		if self.game == "KW" or self.game == "CNC3" :
-			if magic != "C&C3 REPLAY FOOTER" :
-				return False
-		elif self.game == "RA3" :
-			if magic != "RA3 REPLAY FOOTER" :
-				return False
+		magic = footer_magic( footer_data, self.game )
+		if magic == None :
+			return False
 
+		stream = io.BytesIO( footer_data )
+		stream.seek( len( magic ) )
 		self.final_time_code = read_uint32( stream )
 
-		data_len = footer_len - self.FOOTER_MAGIC_SIZE - 8
+		data_len = footer_len - len( magic ) - 8
 		if data_len > 16*8 :
 			print( "footer too long. Probably bad." )
 			return False
@@ -107,7 +108,7 @@ class KWReplayRepair( KWReplayWithCommands ) :
 
 
 	def creep_chunks( self, f ) :
-		self.replay_body = HealingReplayBody( f )
+		self.replay_body = HealingReplayBody( f, game=self.game )
 	
 
 
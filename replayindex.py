@@ -0,0 +1,379 @@
+#!/usr/bin/python3
+# coding: utf8
+
+###
+### On-disk index of parsed replay headers, and the APM cache.
+### This replaces cache.py, which was a printed python dict that we
+### compiled back on every start.
+###
+### A header is stored with the (size, mtime) of the file it was parsed from.
+### If the file still has the same size and mtime, we don't parse it again.
+###
+### There's also an inverted trigram index over the search props of each
+### replay (see filterquery.SearchProps), for the filter. It is made after
+### the scan, in the background (GramJob), so scanning only costs the header.
+### Until a folder is done, the filter doesn't use the grams. A replay can only
+### contain a term if it has all the trigrams of the term, so the replays
+### worth checking are the intersection of the trigrams' replay sets.
+### AKAs aren't in there, they change without the replays changing.
+### The caller looks them up and searches the IPs instead.
+###
+### APMs are keyed by the sha1 of the replay. The hash is kept with the header,
+### so it's only computed again when the file changes.
+###
+
+import os
+import sys
+import json
+import sqlite3
+import threading
+from kwreplay import KWReplay, Player
+from filterquery import trigrams
+from replayitems import calc_search_props
+from utils import hash_file
+
+
+
+class ReplayIndex :
+	# Bump this when the stored header format changes.
+	# Old entries are thrown away then.
+	VERSION = 4
+
+	# The viewer, the APM job and the watch service workers each have their own
+	# connection to the same file. WAL lets them read while one writes,
+	# and a writer waits for another one a while before giving up.
+	TIMEOUT = 30 # sec
+
+	def __init__( self, fname ) :
+		self.fname = fname
+		self.db = sqlite3.connect( fname, timeout=ReplayIndex.TIMEOUT )
+		self.db.execute( "PRAGMA journal_mode=WAL" )
+		self.create_tables()
+
+	def create_tables( self ) :
+		db = self.db
+		ver = db.execute( "PRAGMA user_version" ).fetchone()[0]
+		if ver != ReplayIndex.VERSION :
+			db.execute( "DROP TABLE IF EXISTS headers" )
+			db.execute( "DROP TABLE IF EXISTS grams" )
+			if ver < 3 :
+				db.execute( "DROP TABLE IF EXISTS apms" ) # was keyed by timestamp.
+			db.execute( "PRAGMA user_version = %d" % ReplayIndex.VERSION )
+
+		# path is the full path, dir is there for forgetting removed files.
+		# name is the base name as it is on the disk, path and dir are normcase'd.
+		# hash is the sha1 of the file, NULL until someone wants it.
+		# grams is 1 when the trigrams of the replay are in grams.
+		db.execute( """CREATE TABLE IF NOT EXISTS headers (
+			path TEXT PRIMARY KEY,
+			dir TEXT,
+			name TEXT,
+			size INTEGER,
+			mtime INTEGER,
+			header TEXT,
+			hash TEXT,
+			grams INTEGER DEFAULT 0 )""" )
+		db.execute( "CREATE INDEX IF NOT EXISTS headers_dir ON headers ( dir )" )
+
+		# file is the rowid of the replay in headers.
+		db.execute( """CREATE TABLE IF NOT EXISTS grams (
+			gram TEXT,
+			file INTEGER,
+			PRIMARY KEY ( gram, file ) ) WITHOUT ROWID""" )
+		db.execute( "CREATE INDEX IF NOT EXISTS grams_file ON grams ( file )" )
+
+		# APMs are keyed by the content of the replay.
+		# That way, they survive renaming and moving the replay,
+		# and two replays that started in the same second don't get each other's APMs.
+		db.execute( """CREATE TABLE IF NOT EXISTS apms (
+			hash TEXT PRIMARY KEY,
+			apms TEXT )""" )
+		db.commit()
+
+	def commit( self ) :
+		self.db.commit()
+
+	def close( self ) :
+		self.db.commit()
+		self.db.close()
+
+
+
+	###
+	### Headers
+	###
+	def key( fname ) :
+		return os.path.normcase( os.path.abspath( fname ) )
+
+	def encode_header( kwr ) :
+		fields = dict( vars( kwr ) )
+		del fields[ "fname" ]
+		del fields[ "verbose" ]
+		fields[ "players" ] = [ vars( p ) for p in kwr.players ]
+		return json.dumps( fields )
+
+	def decode_header( fname, header ) :
+		fields = json.loads( header )
+		kwr = KWReplay()
+		players = []
+		for p in fields[ "players" ] :
+			player = Player()
+			vars( player ).update( p )
+			players.append( player )
+		fields[ "players" ] = players
+		vars( kwr ).update( fields )
+		kwr.fname = fname
+		return kwr
+
+	# Returns KWReplay (header only) of fname.
+	# From the index if fname is unchanged, otherwise parsed and stored.
+	# Raises whatever KWReplay raises on broken replays.
+	# Call commit() after a batch of these.
+	def load_header( self, fname ) :
+		st = os.stat( fname )
+		kwr = self.lookup_header( fname, st )
+		if kwr == None :
+			kwr = KWReplay( fname=fname )
+			self.store_header( fname, st, kwr )
+		return kwr
+
+	# The stored header, if fname still has the size and mtime of st.
+	# None if we haven't got it or it is out of date.
+	def lookup_header( self, fname, st ) :
+		row = self.db.execute( "SELECT size, mtime, header FROM headers WHERE path = ?",
+			( ReplayIndex.key( fname ), ) ).fetchone()
+		if row and row[0] == st.st_size and row[1] == st.st_mtime_ns :
+			return ReplayIndex.decode_header( fname, row[2] )
+		return None
+
+	# st is the stat taken BEFORE parsing, so if the file changed while
+	# we parsed it, it won't match next time and gets parsed again.
+	def store_header( self, fname, st, kwr ) :
+		key = ReplayIndex.key( fname )
+		# REPLACE gives the row a new rowid, the grams of the old one must go.
+		# The new grams are made by index_dir, when someone filters.
+		self.forget_grams( [ ( key, ) ] )
+		self.db.execute( """INSERT OR REPLACE INTO headers
+			( path, dir, name, size, mtime, header ) VALUES ( ?, ?, ?, ?, ?, ? )""",
+			( key, os.path.dirname( key ), os.path.basename( fname ),
+			st.st_size, st.st_mtime_ns, ReplayIndex.encode_header( kwr ) ) )
+
+	# Forget the files in directory path that are not in fnames (base names).
+	def prune( self, path, fnames ) :
+		path = ReplayIndex.key( path )
+		keep = set( ReplayIndex.key( os.path.join( path, f ) ) for f in fnames )
+		rows = self.db.execute( "SELECT path FROM headers WHERE dir = ?", ( path, ) ).fetchall()
+		gone = [ row for row in rows if not row[0] in keep ]
+		self.forget_grams( gone )
+		self.db.executemany( "DELETE FROM headers WHERE path = ?", gone )
+
+	def forget( self, fname ) :
+		key = ReplayIndex.key( fname )
+		self.forget_grams( [ ( key, ) ] )
+		self.db.execute( "DELETE FROM headers WHERE path = ?", ( key, ) )
+
+	# The viewer renamed src to dest. The header stays, the file name is a prop
+	# so the grams are made again. Right here, it's one replay,
+	# unless GramJob hasn't got to it yet.
+	def rename( self, src, dest, kwr ) :
+		row = self.db.execute( "SELECT rowid, grams FROM headers WHERE path = ?",
+			( ReplayIndex.key( src ), ) ).fetchone()
+		if not row :
+			return
+		file, indexed = row
+		key = ReplayIndex.key( dest )
+		if key != ReplayIndex.key( src ) :
+			self.forget( dest ) # overwritten, if it was there.
+		# else only the case changed (Windows), dest's row is src's row.
+		self.db.execute( "UPDATE headers SET path = ?, dir = ?, name = ? WHERE rowid = ?",
+			( key, os.path.dirname( key ), os.path.basename( dest ), file ) )
+		if indexed :
+			self.db.execute( "DELETE FROM grams WHERE file = ?", ( file, ) )
+			self.index_grams( file, dest, kwr )
+
+
+
+	###
+	### Trigrams
+	###
+	def index_grams( self, file, fname, kwr ) :
+		props = calc_search_props( kwr, os.path.basename( fname ) )
+		grams = set()
+		for prop in props.props :
+			grams.update( trigrams( prop ) )
+		self.db.executemany( "INSERT OR IGNORE INTO grams VALUES ( ?, ? )",
+			( ( gram, file ) for gram in grams ) )
+
+	# Makes the grams of the replays in directory path that haven't got them.
+	# That's a lot of rows (a few seconds for 10k replays), so the viewer runs
+	# this in GramJob, off the UI thread. Committed every batch replays,
+	# not to keep the db locked for long. stop: threading.Event, or None.
+	# kwrs: { base name: KWReplay } if the caller has them at hand,
+	#     the others are decoded from the index.
+	def index_dir( self, path, kwrs={}, batch=500, stop=None ) :
+		rows = self.db.execute( "SELECT rowid, name, header FROM headers WHERE dir = ? AND grams = 0",
+			( ReplayIndex.key( path ), ) ).fetchall()
+		for i in range( 0, len( rows ), batch ) :
+			if stop and stop.is_set() :
+				break
+			some = rows[ i:i+batch ]
+			for file, name, header in some :
+				kwr = kwrs.get( name )
+				if kwr == None :
+					kwr = ReplayIndex.decode_header( os.path.join( path, name ), header )
+				self.index_grams( file, name, kwr )
+			self.db.executemany( "UPDATE headers SET grams = 1 WHERE rowid = ?",
+				( ( row[0], ) for row in some ) )
+			self.db.commit()
+
+	# True if all the replays of directory path have their grams.
+	# Until then, candidates() can't be trusted for this folder.
+	def dir_indexed( self, path ) :
+		row = self.db.execute( "SELECT 1 FROM headers WHERE dir = ? AND grams = 0 LIMIT 1",
+			( ReplayIndex.key( path ), ) ).fetchone()
+		return row == None
+
+	# keys: ( path, ) rows
+	def forget_grams( self, keys ) :
+		self.db.executemany( """DELETE FROM grams WHERE file IN
+			( SELECT rowid FROM headers WHERE path = ? )""", keys )
+
+	# Set of files (rowids) whose props might contain text (lowercase).
+	# None if text is too short to tell, then all of them might.
+	def candidates( self, text ) :
+		grams = trigrams( text )
+		if not grams :
+			return None
+		result = None
+		for gram in grams :
+			rows = self.db.execute( "SELECT file FROM grams WHERE gram = ?", ( gram, ) )
+			files = set( row[0] for row in rows )
+			if result == None :
+				result = files
+			else :
+				result &= files
+			if not result :
+				break
+		return result
+
+	# Base names of files (rowids) that are in directory path.
+	# Looked up by rowid, a few hundred at a time, there's a limit on ? in sqlite.
+	def file_names( self, path, files ) :
+		path = ReplayIndex.key( path )
+		files = list( files )
+		names = []
+		for i in range( 0, len( files ), 500 ) :
+			some = files[ i:i+500 ]
+			rows = self.db.execute( "SELECT name FROM headers WHERE dir = ? AND rowid IN ( %s )" %
+				",".join( "?" * len( some ) ), [ path ] + some )
+			names.extend( row[0] for row in rows )
+		return names
+
+
+
+	###
+	### Content hashes
+	###
+
+	# The stored hash, if fname still has the size and mtime of st.
+	def lookup_hash( self, fname, st ) :
+		row = self.db.execute( "SELECT size, mtime, hash FROM headers WHERE path = ?",
+			( ReplayIndex.key( fname ), ) ).fetchone()
+		if row and row[0] == st.st_size and row[1] == st.st_mtime_ns :
+			return row[2]
+		return None
+
+	# Kept with the header of fname, if the header is of the same st.
+	# Without the header there's nowhere to keep it, it's hashed again next time.
+	def store_hash( self, fname, st, sha1 ) :
+		self.db.execute( "UPDATE headers SET hash = ? WHERE path = ? AND size = ? AND mtime = ?",
+			( sha1, ReplayIndex.key( fname ), st.st_size, st.st_mtime_ns ) )
+
+	# sha1 of fname, hashed only if it changed since the last time.
+	def file_hash( self, fname ) :
+		st = os.stat( fname )
+		sha1 = self.lookup_hash( fname, st )
+		if sha1 == None :
+			sha1 = hash_file( fname )
+			self.store_hash( fname, st, sha1 )
+		return sha1
+
+
+
+	###
+	### APM cache
+	###
+	def lookup_apm( self, sha1 ) :
+		row = self.db.execute( "SELECT apms FROM apms WHERE hash = ?",
+			( sha1, ) ).fetchone()
+		if not row :
+			return None
+		return json.loads( row[0] )
+
+	def save_apm( self, sha1, apms ) :
+		self.db.execute( "INSERT OR REPLACE INTO apms VALUES ( ?, ? )",
+			( sha1, json.dumps( apms ) ) )
+		self.db.commit()
+
+
+
+###
+### index_dir in a thread with its own connection, for the viewer.
+### Started after each scan. Until it's done, the filter checks all the replays.
+###
+class GramJob :
+	def __init__( self, index_fname, path ) :
+		self.index_fname = index_fname
+		self.path = path
+		self.stop_event = threading.Event()
+		self.thread = None
+
+	def start( self ) :
+		self.thread = threading.Thread( target=self.run, name="gram-job", daemon=True )
+		self.thread.start()
+
+	def cancel( self ) :
+		self.stop_event.set()
+
+	def join( self, timeout=None ) :
+		if self.thread :
+			self.thread.join( timeout )
+
+	def run( self ) :
+		index = ReplayIndex( self.index_fname )
+		try :
+			index.index_dir( self.path, stop=self.stop_event )
+		finally :
+			index.close()
+
+
+
+###
+### Index a folder and see how long it takes, first and second time.
+###
+def main() :
+	import time
+	path = "."
+	if len( sys.argv ) >= 2 :
+		path = sys.argv[1]
+	index = ReplayIndex( "cache.db" )
+
+	for i in range( 2 ) :
+		t = time.time()
+		cnt = 0
+		for f in os.listdir( path ) :
+			ext = os.path.splitext( f )[1].lower()
+			if not ext in [ ".kwreplay", ".ra3replay", ".cnc3replay" ] :
+				continue
+			try :
+				index.load_header( os.path.join( path, f ) )
+				cnt += 1
+			except Exception as e :
+				print( f, e )
+		index.commit()
+		print( "%d replays, %.3f s" % ( cnt, time.time() - t ) )
+
+	index.close()
+
+if __name__ == "__main__" :
+	main()
@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+# coding: utf8
+
+###
+### The replays of the folder the replay viewer is showing.
+### No GUI in here, the viewer shows them.
+###
+### Items are looked up by id (the list control rows) and by file name
+### (rename, delete), so we keep a dict for each. They must agree with each
+### other after every append, remove, rename and scan_path.
+###
+
+import os
+from kwreplay import KWReplay
+from scanner import Scanner
+from filterquery import SearchProps
+
+
+
+# What the filter searches in a replay: map, desc, players (and their AKAs),
+# the file name and the APMs, if we have them.
+# get_aka: ip -> aka or None. Args.args.get_aka in the viewer.
+def calc_search_props( kwr, fname, get_aka=None, apms=None ) :
+	pairs = []
+	pairs.append( ( "map", kwr.map_name ) )
+	pairs.append( ( "desc", kwr.desc ) )
+
+	# wtf? why do we not get players?
+	if not kwr.players :
+		print( kwr.fname, "got problems with players" )
+	else :
+		for player in kwr.players :
+			pairs.append( ( "player", player.name ) )
+			pairs.append( ( "ip", player.ip ) )
+			aka = None
+			if get_aka :
+				aka = get_aka( player.ip )
+			if aka :
+				pairs.append( ( "player", aka ) )
+
+	pairs.append( ( "file", fname ) ) # fname is a prop, too
+	for apm in player_apms( kwr, apms ) :
+		pairs.append( ( "apm", str( apm ) ) )
+	return SearchProps( pairs )
+
+
+
+# APMs of the real players, no observers. apms: of all of kwr.players, or None.
+def player_apms( kwr, apms ) :
+	if apms == None :
+		return []
+	return [ apm for player, apm in zip( kwr.players, apms ) if player.is_player() ]
+
+
+
+# Not just the replay class, this class is for ease of management in rep_list.
+class ReplayItem() :
+	def __init__( self ) :
+		self.fname = None # without path!!! = not full path!
+		self.kwr = None
+		self.id = -1
+		self.props = None # SearchProps, made on the first filtering.
+		self.apms = None # of kwr.players, from the index. See lookup_apms.
+
+class ReplayItems() :
+	def __init__( self, index=None ) :
+		self.by_id = {} # id -> ReplayItem, in the order they were appended.
+		self.by_fname = {} # base name -> ReplayItem
+		self.id = 0 # Keep available UID for newly appended replays.
+		self.index = index # ReplayIndex, parsed headers are kept there.
+		self.path = None # the folder of the last scan_path.
+
+	# All items, in the order they were appended.
+	@property
+	def items( self ) :
+		return self.by_id.values()
+
+	def __len__( self ) :
+		return len( self.by_id )
+
+	def clear( self ) :
+		self.by_id = {}
+		self.by_fname = {}
+
+	def append( self, it ) :
+		it.id = self.id
+		self.by_id[ it.id ] = it
+		self.by_fname[ it.fname ] = it
+		self.id += 1
+
+	# find the replay with fname or id. KeyError if there's none.
+	def find( self, fname=None, id=None ) :
+		assert fname != None or id != None
+		assert not ( fname != None and id != None )
+
+		if fname :
+			return self.find_fname( fname )
+		else :
+			return self.find_id( id )
+
+	def find_id( self, id ) :
+		return self.by_id[ id ]
+
+	def find_fname( self, fname ) :
+		fname = os.path.basename( fname ) # incase...
+		return self.by_fname[ fname ]
+
+	# Happens when u delete a repaly from replay view.
+	def remove( self, fname ) :
+		it = self.find( fname )
+		del self.by_id[ it.id ]
+		del self.by_fname[ it.fname ]
+		if self.index and self.path != None :
+			self.index.forget( os.path.join( self.path, it.fname ) )
+			self.index.commit()
+
+	# rename it.fname
+	def rename( self, src, dest ) :
+		it = self.find( src ) # find does basename for me.
+		dest = os.path.basename( dest )
+		if self.index and self.path != None :
+			self.index.rename( os.path.join( self.path, it.fname ),
+				os.path.join( self.path, dest ), it.kwr )
+			self.index.commit()
+		del self.by_fname[ it.fname ]
+		it.fname = dest
+		it.props = None # file name is a prop
+		self.by_fname[ dest ] = it
+
+	# AKAs changed, all SearchProps are out of date.
+	def clear_props( self ) :
+		for it in self.items :
+			it.props = None
+
+	# scan a folder, yielding the new ReplayItems a batch at a time, as the
+	# Scanner hands them over. They're appended before they're yielded.
+	# The viewer shows each batch as it comes. Once this is exhausted,
+	# scanner.errors has the broken ones, to be reported all at once.
+	def scan_batches( self, path, scanner ) :
+		self.clear()
+		self.path = path
+		for batch in scanner.scan( path ) :
+			items = []
+			for f, kwr in batch :
+				i = ReplayItem()
+				i.fname = f
+				i.kwr = kwr
+				self.append( i )
+				items.append( i )
+			yield items
+
+	# The same, all at once. Returns the Scanner.
+	def scan_path( self, path ) :
+		scanner = Scanner( index=self.index )
+		for items in self.scan_batches( path, scanner ) :
+			pass
+		return scanner
+
+	# APMs of it.kwr.players, once APMJob has put them in the index, or None.
+	# The hash is only looked up, not calculated, hashing is the job's.
+	# Sorting and filtering by APM look up all of them, that must stay cheap.
+	def lookup_apms( self, it ) :
+		if it.apms != None or not self.index or self.path == None :
+			return it.apms
+		fname = os.path.join( self.path, it.fname )
+		try :
+			sha1 = self.index.lookup_hash( fname, os.stat( fname ) )
+		except OSError :
+			return None
+		if sha1 != None :
+			it.apms = self.index.lookup_apm( sha1 )
+			if it.apms != None :
+				it.props = None # they're search props too.
+		return it.apms
+
+	# Parsed header of the replay. Only unseen or modified ones are parsed.
+	def load_header( self, fname ) :
+		if self.index :
+			kwr = self.index.load_header( fname )
+			self.index.commit()
+			return kwr
+		return KWReplay( fname=fname )
+
+
+
+	# Items that match query, a FilterQuery.
+	# With an index, only the replays that have the trigrams of the terms
+	# are checked. Without, all of them.
+	# get_aka: ip -> aka, akas: { ip : aka }, both from Args in the viewer.
+	# items: check only these (a batch of scan_batches), default all of them.
+	def filter( self, query, get_aka=None, akas={}, items=None ) :
+		if query.has_field( "apm" ) :
+			for it in ( items if items != None else self.items ) :
+				self.lookup_apms( it )
+
+		some = items != None
+		if not some :
+			items = self.items
+		# The grams are made in the background after the scan (GramJob).
+		# Until they're all there, check everything.
+		if not some and self.index and self.path != None and self.index.dir_indexed( self.path ) :
+			files = query.candidates( lambda text, field : self.lookup( text, field, akas ) )
+			if files != None :
+				names = self.index.file_names( self.path, files )
+				items = [ self.by_fname[ name ] for name in names if name in self.by_fname ]
+
+		result = []
+		for it in items :
+			if it.props == None :
+				it.props = calc_search_props( it.kwr, it.fname, get_aka, it.apms )
+			if query.match( it.props ) :
+				result.append( it )
+		return result
+
+	# Files in the index that may contain text.
+	# The index has no AKAs, for an AKA hit we take the replays of its IP.
+	def lookup( self, text, field, akas ) :
+		if field == "apm" :
+			return None # not in the index, the APMs come later.
+		files = self.index.candidates( text )
+		if files == None :
+			return None
+		if field == None or field == "player" :
+			for ip, aka in akas.items() :
+				if text in aka.lower() :
+					more = self.index.candidates( ip.lower() )
+					if more == None :
+						return None
+					files |= more
+		return files
@@ -6,7 +6,7 @@ from chunks import KWReplayWithCommands
 from gnuplot import Gnuplot
 from animation import TimelineViewer
 from mapzip import MapZip
-from filterquery import FilterQuery 
+from filterquery import FilterQuery, SearchProps
 import io
 import sys
 import os
@@ -20,147 +20,28 @@ import urllib.parse
 import repair
 import traceback
 import tempfile
+import sqlite3
 import utils
-import imp
+from replayindex import ReplayIndex, GramJob
+from apmjob import APMJob
+from replayitems import ReplayItem, ReplayItems, player_apms
+from scanner import Scanner
 
 
 
-def calc_props( kwr ) :
-	args = Args.args
-
-	props = []
-	props.append( kwr.map_name.lower() ) # map name
-	props.append( kwr.desc.lower() ) # desc
-
-	# wtf? why do we not get players?
-	if not kwr.players :
-		print( kwr.fname, "got problems with players" )
-	else :
-		for player in kwr.players :
-			props.append( player.name.lower() )
-			props.append( player.ip )
-			aka = args.get_aka( player.ip )
-			if aka :
-				props.append( aka )
-	
-	# lowercase everything!
-	for (i, prop) in enumerate( props ) :
-		props[i] = prop.lower()
-
-	return props
-
-
-
-# Returns True on some condition hit.
-# Used for filtering replays.
-def filter_hit( filter, props ) :
-	if not filter :
-		# either filter == None or empty string!
-		return True
-
-	so = sys.stdout # intercept stdout temporarily.
-	se = sys.stderr
-	f = io.StringIO()
-	sys.stdout = f
-	sys.stderr = f
-
+# Compile the filter text. None and an error box if it is broken.
+def make_filter( qstring, quiet=False ) :
 	try :
-		return filter.match( props )
-	except :
-		if filter.postfix :
-			print( filter.postfix )
-		traceback.print_exc()
-
-		msg = "Error in query!\n\n"
-		msg += f.getvalue()
-		msg += "\n"
-		wx.MessageBox( msg, "Error", wx.OK|wx.ICON_ERROR )
-
-	return True
-
-
-
-# Not just the replay class, this class is for ease of management in rep_list.
-class ReplayItem() :
-	def __init__( self ) :
-		self.fname = None # without path!!! = not full path!
-		self.kwr = None
-		self.id = -1
-
-class ReplayItems() :
-	def __init__( self ) :
-		self.items = []
-		self.id = 0 # Keep available UID for newly appended replays.
-
-	def append( self, it ) :
-		self.items.append( it )
-		it.id = self.id
-		self.id += 1
-
-	# delete the replay with fname from items
-	def find( self, fname=None, id=None ) :
-		assert fname != None or id != None
-		assert not ( fname != None and id != None )
-
-		if fname :
-			return self.find_fname( fname )
-		else :
-			return self.find_id( id )
-
-	# Since I'm only appending items (not not shuffling them)
-	# I should be able to do a binary search... but, nah, not now.
-	def find_id( self, id ) :
-		for it in self.items :
-			if it.id == id :
-				return it
-		raise KeyError
-	
-	def find_fname( self, fname ) :
-		fname = os.path.basename( fname ) # incase...
-		for it in self.items :
-			if it.fname == fname :
-				return it
-		raise KeyError
-
-	# Happens when u delete a repaly from replay view.
-	def remove( self, fname ) :
-		it = self.find( fname )
-		self.items.remove( it )
-
-	# rename it.fname
-	def rename( self, src, dest ) :
-		it = self.find( src ) # find does basename for me.
-		dest = os.path.basename( dest )
-		it.fname = dest
-
-	# scan a folder and return the replays as ReplayItem.
-	def scan_path( self, path ) :
-		fs = []
-		for f in os.listdir( path ) :
-			if not os.path.isfile( os.path.join( path, f ) ) :
-				continue
-
-			# must be a C&C replay file.
-			ext = os.path.splitext( f )[1]
-			ext = ext.lower()
-			if not ext in [ ".kwreplay", ".ra3replay", ".cnc3replay" ] :
-				continue
+		return FilterQuery( qstring )
+	except SyntaxError as e :
+		if not quiet :
+			msg = "Error in query!\n\n"
+			msg += str( e )
+			msg += "\n"
+			wx.MessageBox( msg, "Error", wx.OK|wx.ICON_ERROR )
+		return None
 
-			fs.append( f )
 
-		self.items = []
-		for f in fs :
-			i = ReplayItem()
-			i.fname = f
-			full_name = os.path.join( path, f )
-			try :
-				i.kwr = KWReplay( fname=full_name )
-				self.append( i )
-			except :
-				msg = full_name + " is an invalid replay!"
-				wx.MessageBox( msg, "Error", wx.OK|wx.ICON_ERROR )
-
-	
 
 class MapView( wx.StaticBitmap ) :
 	# maps: mapzip file name
@@ -351,7 +232,7 @@ class PlayerList( wx.ListCtrl ) :
 
 		# Check if we have any filter.
 		fil = self.frame.filter_text.GetValue()
-		fil = FilterQuery( fil )
+		fil = make_filter( fil, quiet=True )
 
 		for pid, p in enumerate( kwr.players ) :
 			# p is the Player class. You are quite free to do anything!
@@ -373,70 +254,60 @@ class PlayerList( wx.ListCtrl ) :
 			self.SetItemData( pos, pid ) # remember pid of this guy.
 
 			# Lets see if this player is a hit.
-			props = [ p.name.lower(), p.ip ]
+			pairs = [ ( "player", p.name ), ( "ip", p.ip ) ]
 			aka = Args.args.get_aka( p.ip )
 			if aka :
-				props.append( aka )
-			if fil and len( fil.postfix ) > 0 and filter_hit( fil, props ) :
+				pairs.append( ( "player", aka ) )
+			if fil and fil.func and fil.match( SearchProps( pairs ) ) :
 				self.SetItemBackgroundColour( pos, wx.YELLOW )
 
 		self.populate_apm( kwr )
 	
 
 
-	# Look up APM in the pre-calculated cache first.
-	# return None if not calculated yet.
-	def lookup_apm( self, kwr ) :
-		if not "apm" in self.frame.cache :
-			self.frame.cache[ "apm" ] = dict()
-		cache = self.frame.cache[ "apm" ]
-
-		# I'll use timestamp as its replay's UID...
-		# It will work, almost 100%.
-		key = kwr.timestamp
-
-		if key in cache :
-			return cache[ key ]
-		else :
-			return None
-	
-
-
-	def calc_apms( self, kwr ) :
-		# Check if replay is selected.
+	# The file of the shown replay.
+	def focused_fname( self ) :
 		# frame.get_selected_replay will not work since it requires
 		# selection of only one replay.
 		# For this one, focused one is enough.
 		pos = self.frame.rep_list.GetFocusedItem()
-		rep_name = self.frame.rep_list.GetItem( pos, 0 ).GetText()
-		fname = os.path.join( self.frame.rep_list.path, rep_name )
+		rep_name = self.frame.rep_list.get_rep_name( pos )
+		return os.path.join( self.frame.rep_list.path, rep_name )
 
-		if not fname :
-			# error message is shown by get_selected_replay.
-			return None
 
-		kwr_chunks = KWReplayWithCommands( fname=fname, verbose=False )
-		ana = analyzer.APMAnalyzer( kwr_chunks )
-		cmds_at_second = ana.group_commands_by_time()
-		avg_apms = ana.calc_avg_apm( cmds_at_second )
+
+	# Look up APM in the pre-calculated cache first.
+	# return None if not calculated yet.
+	# The cache is keyed by the content hash of the replay,
+	# the background APM job (apmjob.py) fills it for the whole folder.
+	def lookup_apm( self, sha1 ) :
+		return self.frame.index.lookup_apm( sha1 )
+	
+
+
+	def calc_apms( self, fname ) :
+		# Just counts the commands, no need to load them all.
+		avg_apms = analyzer.quick_avg_apm( fname )
 
 		result = [ int(val) for val in avg_apms ]
 		return result
 
 	
 
-	def cache_apms( self, kwr, apms ) :
-		# by now, this should hold.
-		assert "apm" in self.frame.cache
-		cache = self.frame.cache[ "apm" ]
-		key = kwr.timestamp
-		cache[ key ] = apms
+	def cache_apms( self, sha1, apms ) :
+		self.frame.index.save_apm( sha1, apms )
 
 
 
 	def populate_apm( self, kwr ) :
 		# Well, lets populate APM.
-		cached_apms = self.lookup_apm( kwr )
+		fname = self.focused_fname()
+		try :
+			sha1 = self.frame.index.file_hash( fname )
+			self.frame.index.commit() # the hash. Don't keep the APM job waiting for the db.
+			cached_apms = self.lookup_apm( sha1 )
+		except ( OSError, sqlite3.Error ) :
+			return # gone or unreadable, or the db is busy. Nothing to show.
 		apms = cached_apms
 
 		if apms and len( apms ) < self.GetItemCount() :
@@ -445,14 +316,14 @@ class PlayerList( wx.ListCtrl ) :
 			apms = None
 
 		if not apms :
-			if not Args.args.get_bool( 'calc_apm', default=False ) :
+			if not Args.args.get_bool( 'calc_apm', default=True ) :
 				cnt = self.GetItemCount()
 				for pos in range( cnt ) :
 					self.SetItem( pos, 4, "Enable APM analysis option in options menu!" )
 				return
 
 			try :
-				apms = self.calc_apms( kwr )
+				apms = self.calc_apms( fname )
 			except :
 				msg = "APM analysis failed!"
 				wx.MessageBox( msg, "Error", wx.OK|wx.ICON_ERROR )
@@ -472,7 +343,10 @@ class PlayerList( wx.ListCtrl ) :
 
 		# not cached so calculated -> newly save it in the cache!
 		if ( not cached_apms ) and apms :
-			self.cache_apms( kwr, apms )
+			try :
+				self.cache_apms( sha1, apms )
+			except sqlite3.Error :
+				pass # db busy, the APM job will get it.
 	
 
 
@@ -566,6 +440,9 @@ class PlayerList( wx.ListCtrl ) :
 		else :
 			args.set_aka( uid, result )
 
+		# AKAs are searched by the filter.
+		self.frame.rep_list.replay_items.clear_props()
+
 
 
 	# create context menu
@@ -604,7 +481,7 @@ class PlayerList( wx.ListCtrl ) :
 # I guess I don't have to inherit this,
 # Python's dynamicness can handle this alright...
 # having just one extra var of replay_item...
-# Actually, this is done with SetItemData!!!
+# Actually, this is done with ReplayList.rows!!!
 #class ReplayListItem( wx.ListItem ) :
 #	def __init__( self ) :
 #		super().__init( self )
@@ -613,17 +490,19 @@ class PlayerList( wx.ListCtrl ) :
 class ReplayList( wx.ListCtrl ) :
 	def __init__( self, parent, frame ) :
 		super().__init__( parent, size=(-1,200),
-				style=wx.LC_REPORT|wx.LC_EDIT_LABELS )
+				style=wx.LC_REPORT|wx.LC_EDIT_LABELS|wx.LC_VIRTUAL )
 		self.InsertColumn( 0, 'Name' )
 		self.InsertColumn( 1, 'Map' )
 		self.InsertColumn( 2, 'Description' )
 		self.InsertColumn( 3, 'Time' )
 		self.InsertColumn( 4, 'Date' )
+		self.InsertColumn( 5, 'APM' )
 		self.SetColumnWidth( 0, 400 )
 		self.SetColumnWidth( 1, 180 )
 		self.SetColumnWidth( 2, 200 )
 		self.SetColumnWidth( 3, 100 )
 		self.SetColumnWidth( 4, 100 )
+		self.SetColumnWidth( 5, 100 )
 		#self.SetMinSize( (600, 200) )
 
 		self.event_bindings()
@@ -631,7 +510,18 @@ class ReplayList( wx.ListCtrl ) :
 		self.frame = frame
 		self.replay_items = None # This is shared with frame, beware!
 		self.path = None
-		self.replay_items = ReplayItems()
+		self.replay_items = ReplayItems( index=frame.index )
+
+		# Virtual list: wx asks OnGetItemText for the rows on the screen.
+		# rows[ pos ] is the ReplayItem shown at pos, filtered and sorted.
+		self.rows = []
+		self.filter = None # FilterQuery of the rows, None for all.
+		self.shown = [] # rows, as of the last refresh_rows. What wx has.
+		self.reselecting = False # refresh_rows is selecting, not the user.
+
+		# The scan of path in progress, see set_path.
+		self.scan = None # ReplayItems.scan_batches generator
+		self.scanner = None
 
 		# sort stuff.
 		self.last_clicked_col = 0 # last clicked column number
@@ -667,10 +557,16 @@ class ReplayList( wx.ListCtrl ) :
 
 
 
+	# The rows come in a batch at a time, from scan_step.
 	def set_path( self, path ) :
+		self.stop_scan()
 		self.path = path
-		self.replay_items.scan_path( path )
-		self.populate( self.replay_items )
+		self.scanner = Scanner( index=self.replay_items.index )
+		self.scan = self.replay_items.scan_batches( path, self.scanner )
+		self.filter = None
+		self.rows = []
+		self.refresh_rows()
+		wx.CallAfter( self.scan_step, self.scan )
 		self.names = None # scratch memory for replay renaming presets (for context menu)
 		self.ctx_old_name = "" # lets have a space for the old replay name too.
 			# this one is for remembering click/right clicked ones only.
@@ -680,42 +576,119 @@ class ReplayList( wx.ListCtrl ) :
 
 
 
+	# One batch per call. Between the calls, wx gets to handle the events,
+	# the list is usable while the rest is being parsed.
+	def scan_step( self, scan ) :
+		if scan != self.scan :
+			return # stopped, or an old folder's.
+		try :
+			items = next( scan )
+		except StopIteration :
+			self.scan_done()
+			return
+		self.add_rows( items )
+		self.frame.SetStatusText( "Scanning... %d replays" % len( self.replay_items.items ) )
+		wx.CallAfter( self.scan_step, scan )
+
+	def scan_done( self ) :
+		self.scan = None
+		self.frame.SetStatusText( "%d replays" % len( self.replay_items.items ) )
+		if self.scanner.errors :
+			wx.MessageBox( self.scanner.error_report(), "Error", wx.OK|wx.ICON_ERROR )
+		# the headers are in the index now.
+		self.frame.start_gram_job( self.path )
+		self.frame.start_apm_job( self.path )
+
+	# Closes the pool of an unfinished scan.
+	def stop_scan( self ) :
+		if self.scan :
+			scan = self.scan
+			self.scan = None
+			scan.close()
+
+	# New items of the scan, filtered like the rest of the rows.
+	def add_rows( self, items ) :
+		if self.filter and self.filter.func != None :
+			items = self.replay_items.filter( self.filter, Args.args.get_aka, Args.args.get_akas(), items )
+		self.rows.extend( items )
+		self.sort()
+
 	# reps: repaly_items
+	# During a scan, these are the replays so far, add_rows does the rest.
 	def populate( self, reps, filter=None ) :
 		self.replay_items = reps
 
-		# destroy all existing items
-		self.DeleteAllItems()
-
-		# now read freshly.
-		for rep in reps.items :
-			self.add_replay( rep, filter=filter )
+		if not filter or filter.func == None :
+			rows = list( reps.items )
+		else :
+			rows = reps.filter( filter, Args.args.get_aka, Args.args.get_akas() )
+		self.rows = rows
+		self.filter = filter
 
 		# after filtering, sort.
 		self.sort()
 
 
 
-	def add_replay( self, rep, filter=None ) :
-		fname = rep.fname
-		kwr = rep.kwr
+	# wx calls this for the visible rows only.
+	# we need map, name, game desc, time, date and APM.
+	# Fortunately, only time and date need computation.
+	# APMs are from the index, blank until the APM job has done the replay.
+	def OnGetItemText( self, pos, col ) :
+		rep = self.rows[ pos ]
+		if col == 0 :
+			return rep.fname # replay name
+		elif col == 1 :
+			return rep.kwr.map_name
+		elif col == 2 :
+			return rep.kwr.desc
+		elif col == 5 :
+			apms = player_apms( rep.kwr, self.replay_items.lookup_apms( rep ) )
+			return " / ".join( str( apm ) for apm in apms )
+
+		t = datetime.datetime.fromtimestamp( rep.kwr.timestamp )
+		if col == 3 :
+			return t.strftime("%X") # time
+		else :
+			return t.strftime("%x") # date
+
+
+
+	# Rows changed (count or order). Selection is by position, so
+	# the selected replays are found in the old rows (shown) and
+	# selected again where they are now. The deleted ones are gone.
+	def refresh_rows( self ) :
+		old = list( selected( self ) )
+		items = [ self.shown[ pos ] for pos in old if pos < len( self.shown ) ]
+		focused = self.GetFocusedItem()
+		if 0 <= focused < len( self.shown ) :
+			focused = self.shown[ focused ]
+		else :
+			focused = None
+
+		for pos in reversed( old ) :
+			self.Select( pos, on=0 )
+		self.SetItemCount( len( self.rows ) )
+		self.shown = list( self.rows )
 
-		props = calc_props( kwr )
-		props.append( fname.lower() ) # fname is a prop, too
-		if filter_hit( filter, props ) :
-			# we need map, name, game desc, time and date.
-			# Fortunately, only time and date need computation.
-			t = datetime.datetime.fromtimestamp( kwr.timestamp )
-			time = t.strftime("%X")
-			date = t.strftime("%x")
+		if items or focused :
+			where = { id( it ) : pos for pos, it in enumerate( self.rows ) }
+			# It's the same replays, the panels showing them are fine.
+			self.reselecting = True
+			for it in items :
+				if id( it ) in where :
+					self.Select( where[ id( it ) ] )
+			if focused and id( focused ) in where :
+				# Focus() would scroll to it, not while the user is looking elsewhere.
+				self.SetItemState( where[ id( focused ) ], wx.LIST_STATE_FOCUSED, wx.LIST_STATE_FOCUSED )
+			self.reselecting = False
+		self.Refresh()
 
-			index = self.GetItemCount()
-			pos = self.InsertItem( index, fname ) # replay name
-			self.SetItem( pos, 1, kwr.map_name ) # replay name
-			self.SetItem( pos, 2, kwr.desc ) # desc
-			self.SetItem( pos, 3, time ) # time
-			self.SetItem( pos, 4, date ) # date
-			self.SetItemData( pos, rep.id ) # associate replay
+
+
+	# Replay name at pos.
+	def get_rep_name( self, pos ) :
+		return self.rows[ pos ].fname
 
 
 
@@ -728,9 +701,7 @@ class ReplayList( wx.ListCtrl ) :
 		# I think I could use self.ctx_old_name but...
 		pos = self.GetFocusedItem()
 		assert pos >= 0 # GetSelectedItemCount will assure it, but to be sure
-		id = self.GetItemData( pos )
-
-		rep = self.replay_items.find( id=id )
+		rep = self.rows[ pos ]
 		fname = os.path.join( self.path, rep.fname )
 
 		# so, old_name should be quite valid by now.
@@ -738,69 +709,38 @@ class ReplayList( wx.ListCtrl ) :
 		kwr.modify_desc_inplace( fname, desc )
 
 		# update it in the interface.
-		self.SetItem( pos, 2, desc ) # desc
-		kwr = KWReplay( fname ) # reload it.
+		kwr = self.replay_items.load_header( fname ) # reload it.
 		rep.kwr = kwr
+		rep.props = None
+		self.RefreshItem( pos )
 
 
 
 	def get_related_replay( self, pos ) :
-		rep_id = self.GetItemData( pos )
-		rep_item = self.replay_items.find( id=rep_id )
-		return rep_item
-
+		return self.rows[ pos ]
 
 
-	def key_func( self, rep_id1, rep_id2 ) :
-		col = self.last_clicked_col
-		asc = self.ascending
-
-		# Since API's sorting function will sort by what I have
-		# SetItemData'ed, rep1 and rep2 are my replay items.
-		rep1 = self.replay_items.find( id=rep_id1 )
-		rep2 = self.replay_items.find( id=rep_id2 )
-		#print( rep1.fname )
-		#print( rep2.fname )
-
-		if col == 0 :
-			# name
-			data1 = rep1.fname
-			data2 = rep2.fname
-		elif col == 1 :
-			data1 = rep1.kwr.map_name
-			data2 = rep2.kwr.map_name
-		elif col == 2 :
-			data1 = rep1.kwr.desc
-			data2 = rep2.kwr.desc
-		elif col == 3 :
-			# time of the day...
-			# I'll just use timestamp, who cares?
-			data1 = rep1.kwr.timestamp
-			data2 = rep2.kwr.timestamp
-		elif col == 4 :
-			# date
-			data1 = rep1.kwr.timestamp
-			data2 = rep2.kwr.timestamp
-		else :
-			print( "invalid col", col )
-			assert 0
-
-		if data1 == data2 :
-			result = 0
-		elif data1 < data2 :
-			result = -1
-		else :
-			result = 1
-
-		if not asc :
-			result *= -1
-
-		return result
-
 
+	# Sort key of each column.
+	# Time of the day... I'll just use timestamp, who cares?
+	SORT_KEYS = [
+		lambda rep : rep.fname, # name
+		lambda rep : rep.kwr.map_name,
+		lambda rep : rep.kwr.desc,
+		lambda rep : rep.kwr.timestamp, # time
+		lambda rep : rep.kwr.timestamp, # date
+		lambda rep : max( player_apms( rep.kwr, rep.apms ) + [ -1 ] ), # the fastest player
+	]
 
+	# One list.sort, each key computed once.
 	def sort( self ) :
-		self.SortItems( self.key_func )
+		if self.last_clicked_col == 5 :
+			# the keys don't look up APMs, they're just there.
+			for rep in self.rows :
+				self.replay_items.lookup_apms( rep )
+		key = ReplayList.SORT_KEYS[ self.last_clicked_col ]
+		self.rows.sort( key=key, reverse=not self.ascending )
+		self.refresh_rows()
 
 
 
@@ -830,13 +770,14 @@ class ReplayList( wx.ListCtrl ) :
 	# scan commands in kwr, owner==pid.
 	# If queue, placedown command is met, try to resolve the faction of the player
 	# given by pid.
+	# Stops at the first one, only pid's commands up to there are decoded.
 	def resolve_faction_with_commands( self, kwr, pid ) :
 		for chunk in kwr.replay_body.chunks :
 			for cmd in chunk.commands :
-				chunk.decode_cmd( cmd )
 				# use placedown'ed building to resolve faction.
 				if cmd.player_id != pid :
 					continue
+				chunk.decode_cmd( cmd )
 
 				name = None
 				if cmd.is_placedown() :
@@ -901,7 +842,7 @@ class ReplayList( wx.ListCtrl ) :
 		for pos in selected( self ) :
 			kwr = self.get_related_replay( pos ).kwr
 
-			rep_name = self.GetItem( pos, 0 ).GetText()
+			rep_name = self.get_rep_name( pos )
 			if rep_name.find( "(Rnd)" ) < 0 :
 				#print( rep_name, "has no random in its name" )
 				continue
@@ -919,7 +860,7 @@ class ReplayList( wx.ListCtrl ) :
 				continue
 
 			#print( factions )
-			old_stem = self.GetItem( pos, 0 ).GetText()
+			old_stem = self.get_rep_name( pos )
 			new_stem = old_stem
 
 			for pname, faction in factions.items() :
@@ -950,7 +891,7 @@ class ReplayList( wx.ListCtrl ) :
 
 		fnames = []
 		for pos in selected( self ) :
-			rep_name = self.GetItem( pos, 0 ).GetText()
+			rep_name = self.get_rep_name( pos )
 			fname = os.path.join( self.path, rep_name )
 			fnames.append( fname )
 
@@ -989,7 +930,7 @@ class ReplayList( wx.ListCtrl ) :
 			return
 
 		pos = self.GetNextSelected( -1 ) # get first selected index
-		rep_name = self.GetItem( pos, 0 ).GetText()
+		rep_name = self.get_rep_name( pos )
 
 		# confirmation message
 		msg = "Really delete " + rep_name
@@ -1006,13 +947,14 @@ class ReplayList( wx.ListCtrl ) :
 			return
 
 		for pos in reversed( list( selected( self ) ) ) :
-			rep_name = self.GetItem( pos, 0 ).GetText()
+			rep_name = self.get_rep_name( pos )
 			fname = os.path.join( self.path, rep_name )
 
-			self.DeleteItem( pos ) # delete from list
+			del self.rows[ pos ] # delete from list
 			self.replay_items.remove( rep_name ) # delete from mem
 			os.remove( fname ) # delete the file
 			self.ctx_old_name = None
+		self.refresh_rows()
 
 
 
@@ -1091,7 +1033,7 @@ class ReplayList( wx.ListCtrl ) :
 		# ... I thought so but in fact, I can right click and rename multiple times without
 		# generating EVT_LIST_ITEM_SELECTED.
 		# Do it here again!
-		rep_name = self.GetItem( pos, 0 ).GetText()
+		rep_name = self.get_rep_name( pos )
 		fname = os.path.join( self.path, rep_name )
 		self.ctx_old_name = fname
 		ext = os.path.splitext( fname )[1]
@@ -1201,7 +1143,7 @@ class ReplayList( wx.ListCtrl ) :
 			return
 
 		pos = self.GetFocusedItem()
-		rep_name = self.GetItem( pos, 0 ).GetText()
+		rep_name = self.get_rep_name( pos )
 		fname = os.path.join( self.path, rep_name )
 		os.startfile( fname ) # launch default app with file
 
@@ -1224,10 +1166,9 @@ class ReplayList( wx.ListCtrl ) :
 		fname = os.path.join( self.path, rep_name )
 		os.rename( old_name, fname )
 
-		# rename in the viewer
-		self.SetItem( pos, 0, rep_name ) # replay name
-		# rename in the replay_items
+		# rename in the replay_items, the viewer shows the same item.
 		self.replay_items.rename( old_name, fname )
+		self.RefreshItem( pos )
 
 	# given some user friendly name "rep_name" as stem,
 	# canonicalize it.
@@ -1313,11 +1254,11 @@ class ReplayList( wx.ListCtrl ) :
 
 	def on_Click( self, event ) :
 		pos = event.GetIndex()
-		if pos < 0 :
+		if pos < 0 or self.reselecting :
 			return
 
 		# get the selected item and fill desc_text for editing.
-		txt = self.GetItem( pos, 2 ).GetText()
+		txt = self.rows[ pos ].kwr.desc
 		self.frame.desc_text.SetValue( txt )
 
 		# get related replay.
@@ -1345,7 +1286,7 @@ class ReplayList( wx.ListCtrl ) :
 		#	return
 
 		pos = event.GetIndex() # maybe this is a more correct
-		old_stem = self.GetItem( pos, 0 ).GetText()
+		old_stem = self.get_rep_name( pos )
 		# if valid, the edit is accepted and updated by some update function.
 
 		old_ext = os.path.splitext( old_stem )[1]
@@ -1371,14 +1312,15 @@ class ReplayList( wx.ListCtrl ) :
 
 	def on_begin_label_edit( self, event ) :
 		pos = event.GetIndex() # maybe this is a more correct
-		stem = self.GetItem( pos, 0 ).GetText()
+		stem = self.get_rep_name( pos )
 		self.custom_old_name = os.path.join( self.path, stem )
 		# remember the old name from custom renaming
 	
 
 
 class ReplayViewer( wx.Frame ) :
-	def __init__( self, parent ) :
+	# index: ReplayIndex to use, we make our own if None.
+	def __init__( self, parent, index=None ) :
 		super().__init__( parent, title='Replay Info Viewer', size=(1024,800) )
 
 		self.temp_files = [] # temp files...
@@ -1392,7 +1334,18 @@ class ReplayViewer( wx.Frame ) :
 		# used by on_min
 
 		self.MAPS_ZIP = 'maps.zip' # the name of the zip file that has map previews
+
+		# Save some calculated stuff in here, for acceleration.
+		# Parsed replay headers and APMs.
+		self.index = index
+		if self.index == None :
+			self.index = ReplayIndex( 'cache.db' )
+
+		self.apm_job = None # APMJob of the folder, while it's running.
+		self.gram_job = None # GramJob, trigrams of the folder for the filter.
+
 		self.do_layout()
+		self.CreateStatusBar() # APM job progress
 		self.event_bindings()
 		self.create_accel_tab()
 		self.set_icon()
@@ -1405,29 +1358,6 @@ class ReplayViewer( wx.Frame ) :
 
 		# don't need DB. we just set the image name right.
 		#self.map_db = self.load_map_db( 'MapDB.txt' )
-
-		# Save some calculated stuff in here, for acceleration.
-		self.cachef = 'cache.py'
-		self.cache = self.load_cache( self.cachef )
-	
-
-
-	def load_cache( self, fname ) :
-		if os.path.isfile( fname ) :
-			cache = imp.load_source( 'cache', fname )
-			return cache.cache
-		else :
-			# if not exists, init a dictionary.
-			return dict()
-
-
-
-	def save_cache( self, fname ) :
-		f = open( fname, "w" )
-		print( "#!/usr/bin/python3", file=f )
-		print( "cache = ", file=f, end="" )
-		print( self.cache, file=f )
-		f.close()
 	
 
 
@@ -1683,7 +1613,9 @@ class ReplayViewer( wx.Frame ) :
 	
 	def on_filter_applyClick( self, event ) :
 		fil = self.filter_text.GetValue()
-		fil = FilterQuery( fil )
+		fil = make_filter( fil )
+		if fil == None :
+			return
 		self.rep_list.populate( self.rep_list.replay_items, filter=fil )
 
 
@@ -1696,7 +1628,7 @@ class ReplayViewer( wx.Frame ) :
 			return None
 		elif self.rep_list.GetSelectedItemCount() == 1 :
 			pos = self.rep_list.GetFocusedItem()
-			rep_name = self.rep_list.GetItem( pos, 0 ).GetText()
+			rep_name = self.rep_list.get_rep_name( pos )
 			fname = os.path.join( self.rep_list.path, rep_name )
 			return fname
 		else :
@@ -1974,6 +1906,10 @@ class ReplayViewer( wx.Frame ) :
 
 	def on_close( self, evt ) :
 		self.save_win_props()
+		self.rep_list.stop_scan()
+		self.stop_apm_job()
+		if self.gram_job :
+			self.gram_job.cancel()
 
 		# remove gnuplot temp files
 		for fname in Gnuplot.temp_files :
@@ -1984,7 +1920,7 @@ class ReplayViewer( wx.Frame ) :
 			os.unlink( fname )
 		self.temp_files = [] # purge the list.
 
-		self.save_cache( self.cachef )
+		self.index.commit()
 
 		par = self.Parent
 		if par :
@@ -2114,6 +2050,58 @@ class ReplayViewer( wx.Frame ) :
 			val = 'false'
 		args.set_var( 'calc_apm', val )
 
+		if event.IsChecked() :
+			self.start_apm_job( self.rep_list.path )
+		else :
+			self.stop_apm_job()
+
+	def on_stop_apm( self, event ) :
+		self.stop_apm_job()
+
+
+
+	# Search index of the folder, in the background. See ReplayIndex.index_dir.
+	def start_gram_job( self, path ) :
+		if self.gram_job :
+			self.gram_job.cancel()
+		self.gram_job = GramJob( self.index.fname, path )
+		self.gram_job.start()
+
+
+
+	###
+	### APMs of the whole folder, in the background. See apmjob.py.
+	###
+	def start_apm_job( self, path ) :
+		self.stop_apm_job()
+		if path == None or not Args.args.get_bool( 'calc_apm', default=True ) :
+			return
+		job = APMJob( path, index_fname=self.index.fname )
+		# progress comes from the job thread, the UI must be touched from here.
+		job.progress = lambda done, total : wx.CallAfter( self.show_apm_progress, job, done, total )
+		self.apm_job = job
+		job.start()
+
+	def stop_apm_job( self ) :
+		if self.apm_job :
+			self.apm_job.cancel()
+			self.apm_job = None
+			self.SetStatusText( "APM calculation stopped" )
+
+	def show_apm_progress( self, job, done, total ) :
+		if job != self.apm_job :
+			return # stopped, or an old folder's.
+		if job.finished or done % 20 == 0 :
+			self.rep_list.Refresh() # the APM column
+		if not job.finished :
+			self.SetStatusText( "Calculating APM... %d/%d" % ( done, total ) )
+			return
+		msg = "APM of %d replays calculated" % job.calculated
+		if job.errors :
+			msg += ", %d failed" % len( job.errors )
+		self.SetStatusText( msg )
+		self.apm_job = None
+
 
 
 	def make_options_menu( self ) :
@@ -2138,6 +2126,8 @@ class ReplayViewer( wx.Frame ) :
 		# calculate apm?
 		calc_apm = options_menu.Append( wx.ID_ANY, 'Calculate APM', kind=wx.ITEM_CHECK )
 		options_menu.Bind( wx.EVT_MENU, self.on_calc_apm, calc_apm )
+		stop_apm = options_menu.Append( wx.ID_ANY, 'Stop calculating APM of the folder' )
+		options_menu.Bind( wx.EVT_MENU, self.on_stop_apm, stop_apm )
 
 		# read the val and apply it.
 		args = Args.args
@@ -2152,7 +2142,7 @@ class ReplayViewer( wx.Frame ) :
 			on_minimize.Check( min_to_tbar.GetId(), True )
 
 		# calc apm option
-		checked = args.get_bool( 'calc_apm', default=False )
+		checked = args.get_bool( 'calc_apm', default=True )
 		options_menu.Check( calc_apm.GetId(), checked )
 
 		return options_menu
@@ -0,0 +1,319 @@
+#!/usr/bin/python3
+# coding: utf8
+
+###
+### ResourceAnalyzer over a whole directory of replays, for meta statistics.
+### No GUI. The replays are analyzed in a process pool, each worker sends back
+### a small summary (see summarize) and ResourceStats adds them up as they come:
+###
+###   spending: average money spent (so far) at each second, per faction.
+###       At second t, only the players whose game lasted t seconds count.
+###   units: how many of each unit were built on each map.
+###   builds: when each faction got its first of each building, upgrade
+###       and unit (n, mean, median, min, max seconds).
+###
+### Written to prefix_spending.csv, prefix_units.csv, prefix_builds.csv
+### and, with numpy, prefix.npz (same tables as arrays, no pickles in it).
+###
+###   python3 resbatch.py dump [prefix] [workers]
+###
+
+import os
+import sys
+import time
+import concurrent.futures
+from chunks import KWReplayWithCommands
+from analyzer import ResourceAnalyzer
+from scanner import walk_replays
+
+try :
+	import numpy
+except ImportError :
+	numpy = None
+
+
+
+# What the workers send back about a replay, plain data so that it pickles small.
+# players = [ ( faction, spent, units, first ) ] of the real players, where
+#     spent[ t ] = money spent until second t, one for each second of the game,
+#     units = { unit: count }, first = { building/upgrade/unit: second }.
+def summarize( kwr, res ) :
+	length = 0
+	if len( kwr.replay_body.chunks ) > 0 :
+		length = int( kwr.replay_body.chunks[-1].time_code / 15 )
+
+	players = []
+	for pid in range( res.nplayers ) :
+		player = kwr.players[ pid ]
+		if not player.is_player() :
+			continue
+
+		spent = [ 0 ] * ( length+1 )
+		pair = res.split( res.spents[ pid ] )
+		if pair :
+			ts, costs = pair
+			for i, t in enumerate( ts ) :
+				if t > length :
+					break
+				end = length+1
+				if i+1 < len( ts ) :
+					end = min( ts[i+1], end )
+				spent[ t:end ] = [ costs[i] ] * ( end - t )
+
+		first = {}
+		for t, what in res.builds[ pid ] :
+			if not what in first or t < first[ what ] :
+				first[ what ] = t
+
+		players.append( ( player.decode_faction(), spent, dict( res.units[ pid ] ), first ) )
+
+	return kwr.map_name, length, players
+
+
+
+# Runs in the workers, like scanner.parse_header.
+# Returns ( summary, None ) or ( None, "Type: msg" ).
+def analyze( fname ) :
+	try :
+		kwr = KWReplayWithCommands( fname=fname, verbose=False )
+		res = ResourceAnalyzer( kwr )
+		res.calc()
+		return summarize( kwr, res ), None
+	except Exception as e :
+		return None, "%s: %s" % ( type( e ).__name__, e )
+
+
+
+class ResourceStats :
+	def __init__( self ) :
+		self.replays = 0
+		self.spent_sum = {} # faction -> [ sum of spent at t ]
+		self.spent_cnt = {} # faction -> [ players at t ]
+		self.units = {} # map -> { unit: count }
+		self.map_players = {} # map -> players
+		self.firsts = {} # faction -> { what: [ seconds ] }
+
+	def add( self, summary ) :
+		map_name, length, players = summary
+		self.replays += 1
+		for faction, spent, units, first in players :
+			sums = self.spent_sum.setdefault( faction, [] )
+			cnts = self.spent_cnt.setdefault( faction, [] )
+			if len( sums ) < len( spent ) :
+				sums.extend( [ 0 ] * ( len( spent ) - len( sums ) ) )
+				cnts.extend( [ 0 ] * ( len( spent ) - len( cnts ) ) )
+			for t, val in enumerate( spent ) :
+				sums[ t ] += val
+				cnts[ t ] += 1
+
+			histo = self.units.setdefault( map_name, {} )
+			for unit, cnt in units.items() :
+				histo[ unit ] = histo.get( unit, 0 ) + cnt
+			self.map_players[ map_name ] = self.map_players.get( map_name, 0 ) + 1
+
+			times = self.firsts.setdefault( faction, {} )
+			for what, t in first.items() :
+				times.setdefault( what, [] ).append( t )
+
+	def factions( self ) :
+		return sorted( self.spent_sum.keys() )
+
+	# faction -> average spent at each second, None where nobody played that long.
+	def avg_spending( self ) :
+		avgs = {}
+		for faction in self.factions() :
+			avgs[ faction ] = [ s / n if n else None
+				for s, n in zip( self.spent_sum[ faction ], self.spent_cnt[ faction ] ) ]
+		return avgs
+
+	# ( faction, what, n, mean, median, min, max ), sorted by faction and mean.
+	def build_timings( self ) :
+		rows = []
+		for faction in sorted( self.firsts.keys() ) :
+			some = []
+			for what, times in self.firsts[ faction ].items() :
+				times = sorted( times )
+				n = len( times )
+				if n % 2 :
+					median = times[ n//2 ]
+				else :
+					median = ( times[ n//2-1 ] + times[ n//2 ] ) / 2
+				some.append( ( faction, what, n, sum( times ) / n, median, times[0], times[-1] ) )
+			some.sort( key=lambda row: ( row[3], row[1] ) )
+			rows.extend( some )
+		return rows
+
+	# ( map, unit, count, per player ), sorted by map and count.
+	def unit_table( self ) :
+		rows = []
+		for map_name in sorted( self.units.keys() ) :
+			players = self.map_players[ map_name ]
+			histo = self.units[ map_name ]
+			for unit in sorted( histo.keys(), key=lambda unit: ( -histo[ unit ], unit ) ) :
+				rows.append( ( map_name, unit, histo[ unit ], histo[ unit ] / players ) )
+		return rows
+
+
+
+	###
+	### Output
+	###
+	def emit_csv( self, prefix ) :
+		factions = self.factions()
+		avgs = self.avg_spending()
+		length = max( [ len( avgs[ faction ] ) for faction in factions ] + [ 0 ] )
+
+		f = open( prefix + "_spending.csv", "w", encoding="utf-8" )
+		print( ",".join( [ "t" ] + factions ), file=f )
+		for t in range( length ) :
+			line = [ str( t ) ]
+			for faction in factions :
+				avg = avgs[ faction ]
+				if t < len( avg ) and avg[ t ] != None :
+					line.append( "%.1f" % avg[ t ] )
+				else :
+					line.append( "" )
+			print( ",".join( line ), file=f )
+		f.close()
+
+		f = open( prefix + "_units.csv", "w", encoding="utf-8" )
+		print( "map,unit,count,per player", file=f )
+		for map_name, unit, cnt, per_player in self.unit_table() :
+			print( "%s,%s,%d,%.2f" % ( csv_str( map_name ), csv_str( unit ), cnt, per_player ), file=f )
+		f.close()
+
+		f = open( prefix + "_builds.csv", "w", encoding="utf-8" )
+		print( "faction,what,n,mean,median,min,max", file=f )
+		for faction, what, n, mean, median, lo, hi in self.build_timings() :
+			print( "%s,%s,%d,%.1f,%.1f,%d,%d" % ( csv_str( faction ), csv_str( what ),
+				n, mean, median, lo, hi ), file=f )
+		f.close()
+
+	# Same tables as the CSVs. Strings are numpy unicode arrays,
+	# numpy.load reads it without allow_pickle.
+	def emit_npz( self, fname ) :
+		factions = self.factions()
+		avgs = self.avg_spending()
+		length = max( [ len( avgs[ faction ] ) for faction in factions ] + [ 0 ] )
+		spending = numpy.full( ( len( factions ), length ), numpy.nan )
+		players = numpy.zeros( ( len( factions ), length ), dtype=numpy.int32 )
+		for i, faction in enumerate( factions ) :
+			cnts = self.spent_cnt[ faction ]
+			spending[ i, :len( cnts ) ] = [ numpy.nan if avg == None else avg for avg in avgs[ faction ] ]
+			players[ i, :len( cnts ) ] = cnts
+
+		maps = sorted( self.units.keys() )
+		unit_names = sorted( set( unit for histo in self.units.values() for unit in histo ) )
+		col = { unit: j for j, unit in enumerate( unit_names ) }
+		unit_counts = numpy.zeros( ( len( maps ), len( unit_names ) ), dtype=numpy.int64 )
+		for i, map_name in enumerate( maps ) :
+			for unit, cnt in self.units[ map_name ].items() :
+				unit_counts[ i, col[ unit ] ] = cnt
+
+		builds = self.build_timings()
+		numpy.savez( fname,
+			factions=numpy.array( factions, dtype=str ),
+			spending=spending, # [ faction, t ], nan where nobody played that long
+			spending_players=players,
+			maps=numpy.array( maps, dtype=str ),
+			map_players=numpy.array( [ self.map_players[ m ] for m in maps ], dtype=numpy.int64 ),
+			units=numpy.array( unit_names, dtype=str ),
+			unit_counts=unit_counts, # [ map, unit ]
+			build_faction=numpy.array( [ row[0] for row in builds ], dtype=str ),
+			build_what=numpy.array( [ row[1] for row in builds ], dtype=str ),
+			build_n=numpy.array( [ row[2] for row in builds ], dtype=numpy.int64 ),
+			build_mean=numpy.array( [ row[3] for row in builds ], dtype=float ),
+			build_median=numpy.array( [ row[4] for row in builds ], dtype=float ),
+			build_min=numpy.array( [ row[5] for row in builds ], dtype=numpy.int64 ),
+			build_max=numpy.array( [ row[6] for row in builds ], dtype=numpy.int64 ) )
+
+
+
+# Unit and map names may have commas.
+def csv_str( s ) :
+	if "," in s or "\"" in s :
+		return "\"" + s.replace( "\"", "\"\"" ) + "\""
+	return s
+
+
+
+class ResourceBatch :
+	# workers: pool size, None for one per CPU. 1 works without a pool.
+	# Unlike headers, a replay takes long enough to analyze that the pool
+	# pays off for a couple of them already.
+	def __init__( self, workers=None ) :
+		self.workers = workers
+		if self.workers == None :
+			self.workers = os.cpu_count() or 1
+		self.stats = ResourceStats()
+		self.errors = [] # ( fname, message )
+		self.nbytes = 0 # of the analyzed replays
+
+	def analyze_all( self, fnames ) :
+		if self.workers <= 1 or len( fnames ) < 2 :
+			for result in map( analyze, fnames ) :
+				yield result
+			return
+
+		with concurrent.futures.ProcessPoolExecutor( max_workers=self.workers ) as executor :
+			chunksize = max( 1, min( 4, len( fnames ) // ( self.workers*4 ) ) )
+			for result in executor.map( analyze, fnames, chunksize=chunksize ) :
+				yield result
+
+	def run( self, path ) :
+		fnames = walk_replays( path )
+		for fname, ( summary, err ) in zip( fnames, self.analyze_all( fnames ) ) :
+			if summary == None :
+				self.errors.append( ( fname, err ) )
+				continue
+			self.stats.add( summary )
+			self.nbytes += os.path.getsize( fname )
+		return len( fnames )
+
+	def report( self, limit=20 ) :
+		lines = []
+		if self.errors :
+			lines.append( "%d replay(s) failed:" % len( self.errors ) )
+			for fname, err in self.errors[ :limit ] :
+				lines.append( "%s (%s)" % ( fname, err ) )
+			if len( self.errors ) > limit :
+				lines.append( "... and %d more." % ( len( self.errors ) - limit ) )
+		return "\n".join( lines )
+
+
+
+def main() :
+	if len( sys.argv ) < 2 :
+		print( "Usage: python3 resbatch.py dump [prefix] [workers]" )
+		sys.exit( 1 )
+	src = sys.argv[1]
+	prefix = "resources"
+	workers = None
+	if len( sys.argv ) >= 3 :
+		prefix = sys.argv[2]
+	if len( sys.argv ) >= 4 :
+		workers = int( sys.argv[3] )
+
+	batch = ResourceBatch( workers=workers )
+	t = time.perf_counter()
+	cnt = batch.run( src )
+	t = time.perf_counter() - t
+
+	batch.stats.emit_csv( prefix )
+	outputs = [ prefix + "_spending.csv", prefix + "_units.csv", prefix + "_builds.csv" ]
+	if numpy != None :
+		batch.stats.emit_npz( prefix + ".npz" )
+		outputs.append( prefix + ".npz" )
+	else :
+		print( "No numpy, no .npz." )
+
+	print( batch.report() )
+	print( "%d replays: %d analyzed, %d failed, %d workers" % ( cnt,
+		batch.stats.replays, len( batch.errors ), batch.workers ) )
+	if t > 0 :
+		print( "%.2f s, %.1f replays/s, %.2f MB/s" % ( t,
+			batch.stats.replays / t, batch.nbytes / t / 2**20 ) )
+	print( "Wrote", ", ".join( outputs ) )
+
+if __name__ == "__main__" :
+	main()
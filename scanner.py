@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+# coding: utf8
+
+###
+### Scanning a replay folder, without any GUI.
+### Headers are parsed in a process pool and handed back in batches,
+### so whoever is listening (the replay viewer) can show them as they come.
+### Broken replays don't stop the scan, they are collected in errors
+### and reported once at the end.
+###
+### With a ReplayIndex, the unchanged replays are taken from the index
+### and only the new or modified ones go to the pool.
+###
+
+import os
+import sys
+import time
+import concurrent.futures
+from kwreplay import KWReplay
+
+
+
+REPLAY_EXTS = [ ".kwreplay", ".ra3replay", ".cnc3replay" ]
+
+
+
+# Base names of the replays in path.
+def list_replays( path ) :
+	fs = []
+	for f in os.listdir( path ) :
+		ext = os.path.splitext( f )[1].lower()
+		if not ext in REPLAY_EXTS :
+			continue
+		if not os.path.isfile( os.path.join( path, f ) ) :
+			continue
+		fs.append( f )
+	return fs
+
+
+
+# All the replays under path, full names.
+def walk_replays( path ) :
+	fs = []
+	for root, dirs, files in os.walk( path ) :
+		dirs.sort()
+		for f in sorted( files ) :
+			ext = os.path.splitext( f )[1].lower()
+			if ext in REPLAY_EXTS :
+				fs.append( os.path.join( root, f ) )
+	return fs
+
+
+
+# Runs in the workers. Must be a top level function so that it can be pickled.
+# Exceptions are turned into messages here, not all of them survive pickling.
+def parse_header( fname ) :
+	try :
+		return KWReplay( fname=fname ), None
+	except Exception as e :
+		return None, "%s: %s" % ( type( e ).__name__, e )
+
+
+
+class Scanner :
+	BATCH = 64
+	# With fewer replays to parse than this, we parse them right here.
+	# A header takes ~0.1 ms, starting the pool (and pickling the results back)
+	# costs more than parsing a few hundred of them.
+	MIN_PARALLEL = 500
+
+	# workers: pool size, None for one per CPU. 1 parses without a pool.
+	# threads: ThreadPoolExecutor instead of processes.
+	#     Parsing is mostly python code, so threads only help with slow disks.
+	def __init__( self, index=None, workers=None, threads=False, batch=BATCH ) :
+		self.index = index # ReplayIndex or None
+		self.workers = workers
+		self.threads = threads
+		self.batch = batch
+		self.min_parallel = Scanner.MIN_PARALLEL
+		self.fnames = [] # base names of the replays found by the last scan
+		self.errors = [] # ( full name, message ) of the replays that failed
+		self.parsed = 0 # how many were parsed, not taken from the index
+
+	# Generator of batches, lists of ( base name, KWReplay ).
+	# errors is complete when the generator is exhausted.
+	def scan( self, path ) :
+		self.errors = []
+		self.parsed = 0
+		self.fnames = list_replays( path )
+
+		todo = []
+		batch = []
+		for f in self.fnames :
+			full_name = os.path.join( path, f )
+			try :
+				st = os.stat( full_name )
+			except OSError as e :
+				self.errors.append( ( full_name, str( e ) ) )
+				continue
+
+			kwr = None
+			if self.index :
+				kwr = self.index.lookup_header( full_name, st )
+			if kwr == None :
+				todo.append( ( f, st ) )
+				continue
+
+			batch.append( ( f, kwr ) )
+			if len( batch ) >= self.batch :
+				yield batch
+				batch = []
+		if batch :
+			yield batch
+
+		for batch in self.parse( path, todo ) :
+			yield batch
+
+		if self.index :
+			self.index.prune( path, self.fnames )
+			self.index.commit()
+
+	# Parses todo, ( base name, stat ) pairs, and stores them in the index.
+	def parse( self, path, todo ) :
+		full_names = [ os.path.join( path, f ) for f, st in todo ]
+		workers = self.workers
+		if workers == None :
+			workers = os.cpu_count() or 1
+
+		if workers <= 1 or len( todo ) < self.min_parallel :
+			for batch in self.collect( todo, full_names, map( parse_header, full_names ) ) :
+				yield batch
+			return
+
+		if self.threads :
+			executor = concurrent.futures.ThreadPoolExecutor( max_workers=workers )
+		else :
+			executor = concurrent.futures.ProcessPoolExecutor( max_workers=workers )
+		with executor :
+			# map keeps the order and chunksize cuts down the pickling round trips.
+			chunksize = max( 1, min( self.batch, len( todo ) // ( workers*4 ) ) )
+			results = executor.map( parse_header, full_names, chunksize=chunksize )
+			for batch in self.collect( todo, full_names, results ) :
+				yield batch
+
+	def collect( self, todo, full_names, results ) :
+		batch = []
+		for ( f, st ), full_name, ( kwr, err ) in zip( todo, full_names, results ) :
+			if kwr == None :
+				self.errors.append( ( full_name, err ) )
+				continue
+			self.parsed += 1
+			if self.index :
+				self.index.store_header( full_name, st, kwr )
+			batch.append( ( f, kwr ) )
+			if len( batch ) >= self.batch :
+				yield batch
+				batch = []
+		if batch :
+			yield batch
+
+	# One message for all the failed replays, for a message box or the console.
+	def error_report( self, limit=20 ) :
+		if not self.errors :
+			return ""
+		lines = [ "%d invalid replay(s):" % len( self.errors ) ]
+		for fname, err in self.errors[ :limit ] :
+			lines.append( "%s (%s)" % ( fname, err ) )
+		if len( self.errors ) > limit :
+			lines.append( "... and %d more." % ( len( self.errors ) - limit ) )
+		return "\n".join( lines )
+
+
+
+###
+### Files/sec with 1..N workers, no index, so everything is parsed.
+###
+###   python3 scanner.py [path] [max workers] [threads]
+###
+def main() :
+	path = "."
+	max_workers = os.cpu_count() or 1
+	threads = False
+	if len( sys.argv ) >= 2 :
+		path = sys.argv[1]
+	if len( sys.argv ) >= 3 :
+		max_workers = int( sys.argv[2] )
+	if len( sys.argv ) >= 4 :
+		threads = sys.argv[3] == "threads"
+
+	print( "%d replays in %s, %s" % ( len( list_replays( path ) ), path,
+		"threads" if threads else "processes" ) )
+	for workers in range( 1, max_workers+1 ) :
+		scanner = Scanner( workers=workers, threads=threads )
+		scanner.min_parallel = 0 # measure the pool, even on small folders.
+		t = time.perf_counter()
+		cnt = 0
+		for batch in scanner.scan( path ) :
+			cnt += len( batch )
+		t = time.perf_counter() - t
+		print( "%2d workers: %8.2f ms %8.0f files/s" % ( workers, t*1000, cnt/t ) )
+	if scanner.errors :
+		print( scanner.error_report() )
+
+if __name__ == "__main__" :
+	main()
@@ -188,7 +188,9 @@ autosaver_ra3 = Target(
 
 py2exe_options = dict(
     packages = [],
-    excludes = "_ssl _hashlib pyreadline doctest pickle optparse pdb unittest difflib inspect".split(),
+    # chunks.py imports these by name, py2exe can't see that.
+    includes = "kwchunks twchunks ra3chunks".split(),
+    excludes = "_ssl _hashlib pyreadline doctest optparse pdb unittest difflib inspect".split(),
 ##    ignores = "dotblas gnosis.xml.pickle.parsers._cexpat mx.DateTime".split(),
 ##    dll_excludes = "MSVCP90.dll mswsock.dll powrprof.dll".split(),
     optimize=2,
@@ -0,0 +1,16 @@
+#!/usr/bin/python3
+# coding: utf8
+
+###
+### The modules are in the top directory, not in a package.
+### Tests import them from there and run with it as the working directory,
+### where cornercases/, tw/ and ra3/ are.
+###
+
+import os
+import sys
+
+TOP = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+if not TOP in sys.path :
+	sys.path.insert( 0, TOP )
+os.chdir( TOP )
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# coding: utf8
+
+import os
+import shutil
+import time
+import apmjob
+from apmjob import APMJob
+from replayindex import ReplayIndex
+from utils import hash_file
+
+REPLAYS = [ "2.KWReplay", "3.KWReplay", "4.KWReplay" ]
+
+
+
+def copy_replays( tmp_path ) :
+	path = tmp_path / "replays"
+	path.mkdir()
+	for f in REPLAYS :
+		shutil.copy( os.path.join( "cornercases", f ), str( path ) )
+	return str( path )
+
+# Stands in for calc_apm in the workers (forked, they see the monkeypatch).
+def slow_calc_apm( fname ) :
+	time.sleep( 3 )
+	return None, None, "too slow"
+
+
+
+def test_job( tmp_path ) :
+	path = copy_replays( tmp_path )
+	index_fname = str( tmp_path / "cache.db" )
+	job = APMJob( path, index_fname=index_fname, workers=2 )
+	job.start()
+	job.join()
+	assert job.finished
+	assert job.calculated == len( REPLAYS )
+
+	index = ReplayIndex( index_fname )
+	for f in REPLAYS :
+		assert index.lookup_apm( hash_file( os.path.join( path, f ) ) ) != None
+
+# Cancel doesn't wait for the replays being calculated.
+def test_cancel( tmp_path, monkeypatch ) :
+	monkeypatch.setattr( apmjob, "calc_apm", slow_calc_apm )
+	path = copy_replays( tmp_path )
+	job = APMJob( path, index_fname=str( tmp_path / "cache.db" ), workers=2 )
+	job.start()
+	time.sleep( 0.5 )
+	t = time.perf_counter()
+	job.cancel()
+	job.join( 2 )
+	assert not job.is_alive()
+	assert time.perf_counter() - t < 1
+	assert job.calculated == 0
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# coding: utf8
+
+import os
+import shutil
+import zipfile
+import pytest
+from args import Args
+from archiver import Archiver
+from utils import hash_file
+
+REPLAYS = [
+	os.path.join( "cornercases", "2.KWReplay" ),
+	os.path.join( "cornercases", "3.KWReplay" ),
+	os.path.join( "ra3", "Kimi_vs_GOW_funny_game__[Red3.org].ra3replay" ),
+]
+
+
+
+# A dump folder with the replays, a duplicate and a broken one.
+def make_dump( tmp_path ) :
+	dump = tmp_path / "dump"
+	dump.mkdir()
+	for fname in REPLAYS :
+		shutil.copy( fname, str( dump ) )
+	shutil.copy( REPLAYS[0], str( dump / "dup.KWReplay" ) )
+	( dump / "bad.KWReplay" ).write_bytes( b"junk" )
+	return str( dump )
+
+def make_zip( tmp_path, dump ) :
+	zname = str( tmp_path / "dump.zip" )
+	zf = zipfile.ZipFile( zname, "w" )
+	for fname in sorted( os.listdir( dump ) ) :
+		zf.write( os.path.join( dump, fname ), "sub/" + fname )
+	zf.close()
+	return zname
+
+def archived_hashes( root ) :
+	hashes = []
+	for top, dirs, files in os.walk( root ) :
+		hashes.extend( hash_file( os.path.join( top, f ) ) for f in files )
+	return sorted( hashes )
+
+
+
+# The same archive from a folder and from a zip of it, in a pool or not.
+@pytest.mark.parametrize( "workers", [ 1, 2 ] )
+def test_zip( tmp_path, workers ) :
+	dump = make_dump( tmp_path )
+	zname = make_zip( tmp_path, dump )
+	args = Args( str( tmp_path / "config.ini" ), ask=False )
+
+	archives = []
+	for src in [ dump, zname ] :
+		root = str( tmp_path / ( os.path.basename( src ) + ".archive" ) )
+		archiver = Archiver( root, args, workers=workers )
+		archiver.min_parallel = 0
+		assert archiver.ingest( src ) == 5
+		assert len( archiver.archived ) == 3
+		assert len( archiver.duplicates ) == 1
+		assert len( archiver.errors ) == 1
+		archives.append( ( root, archiver.archived ) )
+
+	( root1, archived1 ), ( root2, archived2 ) = archives
+	assert archived_hashes( root1 ) == archived_hashes( root2 ) == sorted( hash_file( f ) for f in REPLAYS )
+	for ( src1, dest1 ), ( src2, dest2 ) in zip( archived1, archived2 ) :
+		assert os.path.relpath( dest1, root1 ) == os.path.relpath( dest2, root2 )
+		assert src2 == os.path.join( zname, "sub", os.path.basename( src1 ) )
+		# the zip has the time to 2 seconds.
+		assert abs( os.path.getmtime( dest1 ) - os.path.getmtime( dest2 ) ) <= 2
+
+# Moving, what's left in the dump is reported.
+def test_move( tmp_path ) :
+	dump = make_dump( tmp_path )
+	args = Args( str( tmp_path / "config.ini" ), ask=False )
+	archiver = Archiver( str( tmp_path / "archive" ), args, mode="move", workers=1 )
+	archiver.ingest( dump )
+	assert sorted( os.listdir( dump ) ) == [ "bad.KWReplay", "dup.KWReplay" ]
+	assert "1 duplicate(s) left in the dump" in archiver.report()
+	assert os.path.join( dump, "dup.KWReplay" ) in archiver.report()
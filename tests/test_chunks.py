@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+# coding: utf8
+
+import os
+import sys
+import subprocess
+import pytest
+from chunks import KWReplayWithCommands
+
+TOP = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+
+
+# Running chunks.py as a script makes it __main__, the game modules register
+# into the imported chunks. They must still be found.
+@pytest.mark.parametrize( "fname", [
+	os.path.join( "cornercases", "2.KWReplay" ),
+	os.path.join( "tw", "GAmeOne__[GameReplays.org].cnc3replay" ),
+	os.path.join( "ra3", "Kimi_vs_GOW_funny_game__[Red3.org].ra3replay" ),
+] )
+def test_cli( fname ) :
+	proc = subprocess.run( [ sys.executable, "chunks.py", fname ], cwd=TOP,
+		stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+	assert proc.returncode == 0, proc.stderr.decode( errors="replace" )
+	out = proc.stdout.decode( "utf-8", errors="replace" )
+	assert out.startswith( fname )
+	assert "Dump of known build order related commands" in out
+	assert "Dump of commands" in out
+
+
+
+def split_all( kwr ) :
+	cmds = []
+	for chunk in kwr.replay_body.chunks :
+		for cmd in chunk.commands :
+			payload = None if cmd.payload == None else bytes( cmd.payload )
+			cmds.append( ( chunk.time_code, cmd.cmd_id, cmd.player_id, payload ) )
+	return cmds
+
+# split_commands must not take the offsets in the view for offsets in the
+# bytes behind it. Here the view starts 3 bytes into them.
+@pytest.mark.parametrize( "fname", [
+	os.path.join( "cornercases", "2.KWReplay" ),
+	os.path.join( "ra3", "Kimi_vs_GOW_funny_game__[Red3.org].ra3replay" ),
+] )
+def test_split_offset_view( fname ) :
+	kwr = KWReplayWithCommands( fname=fname )
+	cmds = split_all( kwr )
+	assert cmds
+
+	kwr = KWReplayWithCommands( fname=fname )
+	buf = kwr.replay_body.buf
+	shifted = memoryview( b"pad" + bytes( buf ) )[ 3: ]
+	assert len( shifted.obj ) != shifted.nbytes
+	for chunk in kwr.replay_body.chunks :
+		assert chunk.buf is buf
+		chunk.buf = shifted
+	assert split_all( kwr ) == cmds
@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+# coding: utf8
+
+import os
+import pytest
+from kwreplay import has_footer, check_footer, footer_magic
+from repair import KWReplayRepair
+from chunks import uint42int
+
+REPLAYS = [
+	( os.path.join( "cornercases", "2.KWReplay" ), "KW" ),
+	( os.path.join( "tw", "GAmeOne__[GameReplays.org].cnc3replay" ), "CNC3" ),
+	( os.path.join( "ra3", "Kimi_vs_GOW_funny_game__[Red3.org].ra3replay" ), "RA3" ),
+]
+
+
+
+def read( fname ) :
+	f = open( fname, "rb" )
+	buf = f.read()
+	f.close()
+	return buf
+
+# The watcher (has_footer) and repair (check_magic) agree on the footers.
+@pytest.mark.parametrize( "fname, game", REPLAYS )
+def test_footer( fname, game ) :
+	buf = read( fname )
+	assert has_footer( fname )
+	assert check_footer( buf, game )
+	assert not check_footer( buf[ :-1 ] )
+
+	footer_len = uint42int( buf[ -4: ] )
+	footer = buf[ -footer_len: ]
+	assert footer_magic( footer ) == footer_magic( footer, game ) != None
+
+	rep = KWReplayRepair()
+	rep.game = game
+	assert rep.check_magic( footer, footer_len )
+	for other in [ "KW", "RA3" ] :
+		if footer_magic( footer, other ) == None :
+			rep.game = other
+			assert not rep.check_magic( footer, footer_len )
+			assert not check_footer( buf, other )
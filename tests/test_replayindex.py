@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# coding: utf8
+
+import os
+from kwreplay import KWReplay
+from replayindex import ReplayIndex
+
+REPLAY = os.path.join( "cornercases", "2.KWReplay" )
+
+
+
+def grams_of( index, file ) :
+	return index.db.execute( "SELECT COUNT(*) FROM grams WHERE file = ?", ( file, ) ).fetchone()[0]
+
+def orphan_grams( index ) :
+	return index.db.execute( """SELECT COUNT(*) FROM grams WHERE NOT file IN
+		( SELECT rowid FROM headers )""" ).fetchone()[0]
+
+
+
+# Scanning stores headers only, the grams come from index_dir.
+def test_grams_are_lazy( tmp_path ) :
+	index = ReplayIndex( str( tmp_path / "cache.db" ) )
+	kwr = KWReplay( fname=REPLAY )
+	st = os.stat( REPLAY )
+	fname = os.path.join( "replays", "a.KWReplay" )
+	index.store_header( fname, st, kwr )
+	file = index.db.execute( "SELECT rowid FROM headers" ).fetchone()[0]
+
+	assert grams_of( index, file ) == 0
+	assert not index.dir_indexed( "replays" )
+
+	index.index_dir( "replays" )
+	assert grams_of( index, file ) > 0
+	assert index.dir_indexed( "replays" )
+	assert index.candidates( "a.kwreplay" ) == set( [ file ] )
+
+	# stored again (modified replay), the old grams go.
+	index.store_header( fname, st, kwr )
+	assert orphan_grams( index ) == 0
+	assert not index.dir_indexed( "replays" )
+	index.close()
+
+
+
+# Renaming to the same file in another case (normcase is lower() on Windows)
+# must keep the header and its grams.
+def test_rename_case_only( tmp_path, monkeypatch ) :
+	monkeypatch.setattr( ReplayIndex, "key",
+		lambda fname : os.path.normcase( os.path.abspath( fname ) ).lower() )
+	index = ReplayIndex( str( tmp_path / "cache.db" ) )
+	kwr = KWReplay( fname=REPLAY )
+	st = os.stat( REPLAY )
+	src = os.path.join( "replays", "last.KWReplay" )
+	dest = os.path.join( "replays", "LAST.KWReplay" )
+	index.store_header( src, st, kwr )
+	index.index_dir( "replays" )
+	index.rename( src, dest, kwr )
+
+	rows = index.db.execute( "SELECT rowid, name FROM headers" ).fetchall()
+	assert len( rows ) == 1
+	assert rows[0][1] == "LAST.KWReplay"
+	assert index.lookup_header( dest, st ) != None
+	assert index.candidates( "last" ) == set( [ rows[0][0] ] )
+	assert orphan_grams( index ) == 0
+	index.close()
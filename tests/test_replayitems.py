@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# coding: utf8
+
+import os
+from filterquery import FilterQuery
+from replayindex import ReplayIndex
+from replayitems import ReplayItems
+from scanner import Scanner
+from utils import hash_file
+
+
+
+# The batches are appended as they come, and add up to the scan.
+def test_scan_batches( tmp_path ) :
+	index = ReplayIndex( str( tmp_path / "cache.db" ) )
+	for cold in [ True, False ] :
+		reps = ReplayItems( index=index )
+		scanner = Scanner( index=index, workers=1, batch=8 )
+		seen = []
+		for items in reps.scan_batches( "cornercases", scanner ) :
+			assert 0 < len( items ) <= 8
+			seen.extend( items )
+			assert list( reps.items ) == seen
+		assert len( seen ) + len( scanner.errors ) == len( scanner.fnames )
+
+		all_of_them = reps.scan_path( "cornercases" ).fnames
+		assert sorted( it.fname for it in reps.items ) == sorted( it.fname for it in seen )
+		assert len( all_of_them ) == len( scanner.fnames )
+
+	# filtering a batch is filtering those only.
+	query = FilterQuery( "kwreplay" )
+	some = list( reps.items )[ :5 ]
+	assert reps.filter( query, items=some ) == [ it for it in reps.filter( query ) if it in some ]
+
+
+
+# APMs are in the index once the APM job has the replay, then they can be searched.
+def test_apm_filter( tmp_path ) :
+	index = ReplayIndex( str( tmp_path / "cache.db" ) )
+	reps = ReplayItems( index=index )
+	reps.scan_path( "cornercases" )
+	it = reps.find( "2.KWReplay" )
+	assert reps.lookup_apms( it ) == None
+
+	fname = os.path.join( "cornercases", it.fname )
+	apms = [ 1000 + pid for pid in range( len( it.kwr.players ) ) ]
+	index.store_hash( fname, os.stat( fname ), hash_file( fname ) )
+	index.save_apm( hash_file( fname ), apms )
+
+	assert reps.filter( FilterQuery( "apm:>999" ) ) == [ it ]
+	assert it.apms == apms
+	assert reps.filter( FilterQuery( "apm:100" ) ) == [ it ]
+	assert reps.filter( FilterQuery( "apm:<999 and 2.kwreplay" ) ) == []
+	# not without the field, 1000 is not in the file name.
+	assert not it in reps.filter( FilterQuery( "1000" ) )
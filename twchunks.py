@@ -47,34 +47,25 @@ class TWChunk( chunks.Chunk ) :
 		return CMDNAMES[ cmd.cmd_id ]
 
 	# Decode decodable commands
-	def decode_cmd( self, cmd ) :
-		if cmd.cmd_id == 0x27 :
-			cmd.decode_placedown_cmd( UNITNAMES, UNITCOST, FREEUNITS )
-		elif cmd.cmd_id == 0x23 :
-			cmd.decode_queue_cmd( UNITNAMES, AFLD_UNITS, UNITCOST )
-		elif cmd.cmd_id == 0x1C :
-			cmd.decode_skill_targetless( POWERNAMES, POWERCOST )
-		elif cmd.cmd_id == 0x1D :
-			cmd.decode_skill_xy( POWERNAMES, POWERCOST )
-		elif cmd.cmd_id == 0x80 :
-			cmd.decode_skill_2xy( POWERNAMES, POWERCOST )
-		elif cmd.cmd_id == 0x21 :
-			cmd.decode_upgrade_cmd( UPGRADENAMES, UPGRADECOST )
-		elif cmd.cmd_id == 0x24 :
-			cmd.decode_hold_cmd( UNITNAMES )
-		elif cmd.cmd_id == 0x2A :
-			cmd.decode_sell_cmd()
-		elif cmd.cmd_id == 0x3C :
-			cmd.decode_move_cmd()
-		elif cmd.cmd_id == 0x70 :
-			cmd.decode_formation_move_cmd()
-		elif cmd.cmd_id == 0x7F :
-			cmd.decode_powerdown_cmd()
-		elif cmd.cmd_id == 0x84 :
-			cmd.decode_reverse_move_cmd()
-		elif cmd.cmd_id == 0x2D :
-			cmd.decode_gg()
+	# cmd_id -> ( decoder, args ). See chunks.Chunk.decode_cmd.
+	DECODERS = {
+		0x27 : ( chunks.Command.decode_placedown_cmd, ( UNITNAMES, UNITCOST, FREEUNITS ) ),
+		0x23 : ( chunks.Command.decode_queue_cmd, ( UNITNAMES, AFLD_UNITS, UNITCOST ) ),
+		0x1C : ( chunks.Command.decode_skill_targetless, ( POWERNAMES, POWERCOST ) ),
+		0x1D : ( chunks.Command.decode_skill_xy, ( POWERNAMES, POWERCOST ) ),
+		0x80 : ( chunks.Command.decode_skill_2xy, ( POWERNAMES, POWERCOST ) ),
+		0x21 : ( chunks.Command.decode_upgrade_cmd, ( UPGRADENAMES, UPGRADECOST ) ),
+		0x24 : ( chunks.Command.decode_hold_cmd, ( UNITNAMES, ) ),
+		0x2A : ( chunks.Command.decode_sell_cmd, () ),
+		0x3C : ( chunks.Command.decode_move_cmd, () ),
+		0x70 : ( chunks.Command.decode_formation_move_cmd, () ),
+		0x7F : ( chunks.Command.decode_powerdown_cmd, () ),
+		0x84 : ( chunks.Command.decode_reverse_move_cmd, () ),
+		0x2D : ( chunks.Command.decode_gg, () ),
 
 		# Fortunately, we don't have target skill, in the sidebar skills, in TW.
-		#elif cmd.cmd_id == 0x?? :
-		#	cmd.decode_skill_target( POWERNAMES, POWERCOST )
+		#0x?? : ( chunks.Command.decode_skill_target, ( POWERNAMES, POWERCOST ) ),
+	}
+
+
+chunks.register_chunk_class( "CNC3", TWChunk )
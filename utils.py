@@ -7,6 +7,7 @@ import time
 import subprocess
 import os
 import sys
+import shutil
 
 
 
@@ -20,6 +21,68 @@ def open_in_default_app( fname ) :
 
 
 
+###
+### Copy src into dst_fd, an empty file opened for writing. Cheapest way first:
+### reflink (btrfs, xfs...: the copy shares the blocks until one is written),
+### copy_file_range (the kernel copies, no round trip through us),
+### then plain read/write.
+### No hardlinks: the game rewrites the last replay in place, our copy would change too.
+### Returns the way that worked.
+###
+FICLONE = 0x40049409 # _IOW( 0x94, 9, int ), linux/fs.h
+
+def clone_file( src, dst_fd ) :
+	sf = open( src, "rb" )
+	try :
+		src_fd = sf.fileno()
+		try :
+			import fcntl
+			fcntl.ioctl( dst_fd, FICLONE, src_fd )
+			return "reflink"
+		except ( ImportError, OSError ) :
+			pass # Windows, or the file system can't.
+
+		if hasattr( os, "copy_file_range" ) :
+			size = os.fstat( src_fd ).st_size
+			copied = 0
+			try :
+				while copied < size :
+					n = os.copy_file_range( src_fd, dst_fd, size - copied )
+					if n == 0 :
+						break
+					copied += n
+			except OSError :
+				pass
+			if copied == size :
+				return "copy_file_range"
+			# start over for the plain copy.
+			sf.seek( 0 )
+			os.lseek( dst_fd, 0, os.SEEK_SET )
+			os.ftruncate( dst_fd, 0 )
+
+		df = open( dst_fd, "wb", closefd=False )
+		shutil.copyfileobj( sf, df )
+		df.close()
+		return "copy"
+	finally :
+		sf.close()
+
+
+
+# sha1 of the file contents, hex. Read a MB at a time, replays can be big.
+def hash_file( fname ) :
+	h = hashlib.sha1()
+	f = open( fname, "rb" )
+	while True :
+		buf = f.read( 2**20 )
+		if not buf :
+			break
+		h.update( buf )
+	f.close()
+	return h.hexdigest()
+
+
+
 def encrypt( ip ) :
 	m = hashlib.md5()
 	m.update( ip.encode() )
@@ -75,6 +138,59 @@ def read_uint32( f ) :
 
 
 
+###
+### Offset based decoders.
+### Same as the read_* functions above, but they work on a buffer that is
+### already in memory. They return ( value, next offset ).
+### Running out of buffer raises struct.error, just like the read_* ones.
+###
+def unpack_byte( buf, pos ) :
+	return struct.unpack_from( 'B', buf, pos )[0], pos+1
+
+
+
+def unpack_uint32( buf, pos ) :
+	return struct.unpack_from( 'I', buf, pos )[0], pos+4
+
+
+
+def unpack_cstr( buf, pos, length ) :
+	end = pos + length
+	if end > len( buf ) :
+		raise struct.error( "buffer too short for cstr" )
+	data = bytes( buf[ pos:end ] ).decode( "utf-8" )
+	return data, end
+
+
+
+# Two byte (UTF-16) string, null terminated or of given length (in chars).
+def unpack_tb_str( buf, pos, length=-1 ) :
+	if length == -1 :
+		end = buf.find( b"\x00\x00", pos )
+		# The terminator must be on a character boundary.
+		# 0x0100 0x0001 has 00 00 in the middle, for example.
+		while end >= 0 and ( end - pos ) % 2 :
+			end = buf.find( b"\x00\x00", end+1 )
+		if end < 0 :
+			raise struct.error( "unterminated tb_str" )
+		nxt = end + 2
+	else :
+		end = pos + 2*length
+		if end > len( buf ) :
+			raise struct.error( "buffer too short for tb_str" )
+		nxt = end
+
+	data = buf[ pos:end ]
+	s = data.decode( "utf-16-le", "surrogatepass" )
+	if len( s )*2 != len( data ) :
+		# Surrogate pairs got merged. read_tb_str keeps each code unit as
+		# a char, let's stay compatible with that.
+		cnt = len( data ) // 2
+		s = "".join( map( chr, struct.unpack( "%dH" % cnt, data ) ) )
+	return s, nxt
+
+
+
 def time_code2str( tc ) :
 	t = time.gmtime( tc )
 	return time.strftime( "%H:%M:%S", t )
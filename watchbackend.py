@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# coding: utf8
+
+###
+### How the Watcher learns that the last replay may have changed.
+###
+### InotifyBackend asks the kernel (Linux). Nothing happens until the game
+### touches the replay, so we can check often and still be idle.
+### PollingBackend is what we always did: look every now and then.
+### Windows and everything else get that one.
+###
+### Both answer changed(): "may have changed since last time, go stat it".
+### wait( timeout ) blocks until there's something for changed() or the timeout,
+### for console watchers. It doesn't eat the events, changed() still sees them.
+###
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+
+class PollingBackend :
+	INTERVAL = 2000 # msec between polls
+
+	def __init__( self, fname ) :
+		self.fname = fname
+
+	# We can't tell, always go and look.
+	def changed( self ) :
+		return True
+
+	def wait( self, timeout ) :
+		time.sleep( timeout )
+		return True
+
+	def close( self ) :
+		pass
+
+
+
+class InotifyBackend :
+	INTERVAL = 250 # msec. Checking costs one read() that fails, when idle.
+
+	# from sys/inotify.h
+	IN_MODIFY = 0x00000002
+	IN_ATTRIB = 0x00000004 # mtime set without writing, like touch.
+	IN_CLOSE_WRITE = 0x00000008
+	IN_MOVED_TO = 0x00000080
+	IN_CREATE = 0x00000100
+	IN_NONBLOCK = 0o4000
+	IN_CLOEXEC = 0o2000000
+
+	EVENT = struct.Struct( "iIII" ) # wd, mask, cookie, len. name follows.
+
+	libc = None
+
+	# Raises OSError if inotify is not there.
+	def __init__( self, fname ) :
+		self.fname = fname
+		self.name = os.fsencode( os.path.basename( fname ) )
+		self.fd = -1
+		libc = InotifyBackend.load_libc()
+
+		fd = libc.inotify_init1( InotifyBackend.IN_NONBLOCK | InotifyBackend.IN_CLOEXEC )
+		if fd < 0 :
+			err = ctypes.get_errno()
+			raise OSError( err, os.strerror( err ) )
+		self.fd = fd
+
+		# Watch the folder, not the file. The game may delete and create it again.
+		path = os.path.dirname( os.path.abspath( fname ) )
+		mask = InotifyBackend.IN_MODIFY | InotifyBackend.IN_ATTRIB | InotifyBackend.IN_CLOSE_WRITE | \
+			InotifyBackend.IN_MOVED_TO | InotifyBackend.IN_CREATE
+		wd = libc.inotify_add_watch( fd, os.fsencode( path ), mask )
+		if wd < 0 :
+			err = ctypes.get_errno()
+			self.close()
+			raise OSError( err, os.strerror( err ), path )
+
+	def load_libc() :
+		if InotifyBackend.libc == None :
+			if not sys.platform.startswith( "linux" ) :
+				raise OSError( errno.ENOSYS, "inotify is Linux only" )
+			libc = ctypes.CDLL( ctypes.util.find_library( "c" ), use_errno=True )
+			libc.inotify_init1.argtypes = [ ctypes.c_int ]
+			libc.inotify_add_watch.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+			InotifyBackend.libc = libc
+		return InotifyBackend.libc
+
+	# Reads all the events there are. True if one was about our file.
+	def changed( self ) :
+		hit = False
+		while True :
+			try :
+				buf = os.read( self.fd, 4096 )
+			except BlockingIOError :
+				break
+			pos = 0
+			while pos < len( buf ) :
+				wd, mask, cookie, length = InotifyBackend.EVENT.unpack_from( buf, pos )
+				pos += InotifyBackend.EVENT.size
+				name = buf[ pos:pos+length ].rstrip( b"\0" )
+				pos += length
+				if name == self.name :
+					hit = True
+		return hit
+
+	def wait( self, timeout ) :
+		readable, w, x = select.select( [ self.fd ], [], [], timeout )
+		return len( readable ) > 0
+
+	def close( self ) :
+		if self.fd >= 0 :
+			os.close( self.fd )
+			self.fd = -1
+
+
+
+# The best backend we have here.
+def make_backend( fname ) :
+	try :
+		return InotifyBackend( fname )
+	except OSError :
+		return PollingBackend( fname )
+
+
+
+###
+### Print what happens to a file.
+###
+def main() :
+	fname = "last.KWReplay"
+	if len( sys.argv ) >= 2 :
+		fname = sys.argv[1]
+	backend = make_backend( fname )
+	print( "Watching", fname, "with", type( backend ).__name__ )
+	while True :
+		if backend.wait( 2 ) and backend.changed() :
+			print( time.strftime( "%X" ), "changed" )
+
+if __name__ == "__main__" :
+	main()
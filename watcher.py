@@ -1,8 +1,10 @@
 #!/usr/bin/python3
 # -*- coding: utf8 -*-
-import os, time, shutil, datetime
-from kwreplay import KWReplay, Player
+import os, time, shutil, datetime, stat, tempfile
+from kwreplay import KWReplay, Player, has_footer
 from args import Args
+from watchbackend import make_backend
+from utils import clone_file
 
 
 
@@ -18,44 +20,73 @@ class FileSignature :
 
 
 class Watcher :
-	def __init__( self, fname, verbose=False ) :
+	# A replay without footer that hasn't changed for this long (sec) is taken
+	# as done. The game crashed or got killed, the replay will never be finished.
+	QUIET_TIME = 15
+
+	# index: ReplayIndex, saved replays are put in there (and its search index).
+	# backend: tells us when to look at the replay. See watchbackend.py.
+	def __init__( self, fname, verbose=False, index=None, backend=None ) :
 		self.verbose = verbose
+		self.index = index
 		self.last_replay = fname
 		self.sig = self.get_file_signature( fname )
 		prefix, self.ext = os.path.splitext( fname )
+
+		self.backend = backend
+		if self.backend == None :
+			self.backend = make_backend( fname )
+		# The backend said it changed but we couldn't take it yet (still being written).
+		# Keep looking until we can, there may be no more events.
+		self.dirty = False
+
+		# For the quiescence window of is_writing.
+		self.quiet_sig = None # ( size, mtime ) last seen
+		self.quiet_since = 0 # since when (time.monotonic())
 	
+	def close( self ) :
+		self.backend.close()
 
 
+
+	# One stat for all of them. None if it doesn't exist (or isn't a file).
 	def get_file_signature( self, fname ) :
-		if not os.path.isfile( fname ) :
+		try :
+			st = os.stat( fname )
+		except OSError :
+			return None
+		if not stat.S_ISREG( st.st_mode ) :
 			return None
 		sig = FileSignature()
-		sig.ctime = os.path.getctime( fname )
-		sig.mtime = os.path.getmtime( fname )
-		sig.size = os.path.getsize( fname )
+		sig.ctime = st.st_ctime
+		sig.mtime = st.st_mtime
+		sig.size = st.st_size
 		return sig
 
 	# returns true when polled and replay has been modified.
 	# false otherwise.
 	def poll( self ) :
-		# If not exists, then still fine.
-		if not os.path.isfile( self.last_replay ) :
+		if self.backend.changed() :
+			self.dirty = True
+		if not self.dirty :
 			return False
 
 		new_sig = self.get_file_signature( self.last_replay )
 
-		# replay is in writing process
-		if self.is_writing( self.last_replay ) :
+		if not new_sig :
+			# If not exists, then still fine.
+			self.dirty = False
 			return False
 
-		if not new_sig :
-			# non-existent or something.
-			self.sig = None
+		# replay is in writing process
+		if self.is_writing( self.last_replay, new_sig ) :
 			return False
 
 		# empty replay
 		if new_sig.size == 0 :
 			return False
+
+		self.dirty = False
 	
 		if self.sig == None : # implicitly new_sig != None
 			self.sig = new_sig
@@ -71,24 +102,62 @@ class Watcher :
 
 
 	###
-	### copy the last replay to a tmp replay
-	### then use the replay's time stamp to give the tmp replay a proper name.
+	### read the header of the last replay and use the replay's time stamp
+	### to give a copy of it a proper name.
 	### Setting add_username to True will append user name to the replay name.
 	###
+	### The header is read from the last replay itself, then the copy is made with
+	### utils.clone_file (reflink if the file system can, no data copied at all)
+	### into a tmp file with a unique name, so overlapping saves don't collide.
+	###
 	### Decided to be independent form the Args class, that's why we have so many params here.
 	###
 	def do_renaming( self, fname, add_username=True,
 			add_faction=False, add_vs_info=False,
 			custom_date_format=None  ) :
+		tmpf, r = self.latch( fname )
+		return self.save_latched( tmpf, r, add_username=add_username,
+				add_faction=add_faction, add_vs_info=add_vs_info,
+				custom_date_format=custom_date_format )
+
+	# First half of do_renaming: copy the last replay to a tmp file in the folder
+	# of fname, before the game starts writing the next one.
+	# Returns ( tmp file, KWReplay header of it ).
+	# Cheap, so the watcher service does it right away and leaves the rest to its workers.
+	def latch( self, fname ) :
 		# where the replay dir is.
 		path = os.path.dirname( fname )
 
+		before = os.stat( self.last_replay )
+		r = KWReplay( fname=self.last_replay )
+
 		# Latch the replay file to a tmp file.
 		# using folder where the replay is better
-		tmpf = os.path.join( path, "tmp" + self.ext )
-		shutil.copyfile( self.last_replay, tmpf )
+		fd, tmpf = tempfile.mkstemp( prefix="tmp", suffix=self.ext, dir=path )
+		try :
+			clone_file( self.last_replay, fd )
+		except :
+			os.close( fd )
+			os.remove( tmpf )
+			raise
+		os.close( fd )
+		shutil.copymode( self.last_replay, tmpf ) # mkstemp makes it 0600.
+
+		# The game touched it while we were at it? Then the header we read
+		# may not be of what we copied. Read the copy, like we used to.
+		after = os.stat( self.last_replay )
+		if ( before.st_size, before.st_mtime_ns ) != ( after.st_size, after.st_mtime_ns ) :
+			r = KWReplay( fname=tmpf )
+		return tmpf, r
+
+	# Second half: give the tmp file its name and put it in the index.
+	# index: the ReplayIndex to use, self.index if None.
+	#     (sqlite connections can't be shared between threads)
+	def save_latched( self, tmpf, r, add_username=True,
+			add_faction=False, add_vs_info=False,
+			custom_date_format=None, index=None ) :
+		path = os.path.dirname( tmpf )
 
-		r = KWReplay( fname=tmpf )
 		# analyze the replay and deduce its name
 		newf = Watcher.calc_name( r, add_username=add_username,
 				add_faction=add_faction, add_vs_info=add_vs_info,
@@ -96,8 +165,17 @@ class Watcher :
 		newf = os.path.join( path, newf )
 
 		os.replace( tmpf, newf ) # rename, silently overwrite if needed.
+
+		# we've parsed it already, don't let the viewer do it again.
+		if index == None :
+			index = self.index
+		if index :
+			index.store_header( newf, os.stat( newf ), r )
+			index.commit()
 		return newf
 
+
+
 	def sanitize_name( newf ) :
 		for char in [ "<", ">", ":", "\"", "/", "\\", "|", "?", "*" ] :
 			newf = newf.replace( char, "_" )
@@ -284,10 +362,25 @@ class Watcher :
 		return r.players[ r.replay_saver ]
 
 	###
-	### Determine if the latest replay is occupied by the game.
+	### Determine if the latest replay is still being written by the game.
+	### Done when the footer is there. Without footer, done when the size and
+	### mtime haven't changed for QUIET_TIME.
+	### sig: signature of fname we just took.
 	###
-	def is_writing( self, fname ) :
-		return not os.access( fname, os.W_OK )
+	def is_writing( self, fname, sig ) :
+		try :
+			if has_footer( fname ) :
+				return False
+		except OSError :
+			return True # gone or locked, look again later.
+
+		now = time.monotonic()
+		quiet_sig = ( sig.size, sig.mtime )
+		if quiet_sig != self.quiet_sig :
+			self.quiet_sig = quiet_sig
+			self.quiet_since = now
+			return True
+		return now - self.quiet_since < Watcher.QUIET_TIME
 
 
 
@@ -296,10 +389,10 @@ def main() :
 	watcher = Watcher( "tw/last.CNC3Replay", verbose=True )
 	# monitor file size change.
 	print( watcher.sig )
-	print( "Started monitoring" )
+	print( "Started monitoring with", type( watcher.backend ).__name__ )
 
 	while True :
-		time.sleep (2)
+		watcher.backend.wait( 2 )
 		if watcher.poll() :
 			newf = watcher.do_renaming( watcher.last_replay, add_username=True )
 			print( watcher.sig )
@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+# coding: utf8
+
+###
+### Headless replay auto saver, for several games and folders at once.
+### No wx, no tray icon. For running KW, CNC3 and RA3 side by side,
+### or for archiving replays on a server.
+###
+### The main thread only watches. When a Watcher says its replay is done,
+### the replay is latched (cloned to a tmp file, see Watcher.latch) right away,
+### before the game can start writing the next one. Naming, indexing and
+### APM analysis are jobs for a few worker threads, through a bounded queue,
+### so a slow analysis never holds up watching.
+### When the queue is full, the job is named and indexed right here,
+### without the analysis. The replay is never lost.
+###
+### Configuration is an ini file like config.ini, same options and akas, plus:
+###
+###   [watch]
+###   kw = C:\...\Replays\last.KWReplay
+###   cnc3 = C:\...\Replays\last.CNC3Replay
+###   ra3 = C:\...\Replays\last.RA3Replay
+###
+###   [service]
+###   workers = 2
+###   queue = 16
+###   analyze = true
+###
+### The last_replay of [options] is watched too, if there is one.
+###
+###   python3 watchservice.py [config] [last replay ...]
+###
+
+import os
+import sys
+import time
+import queue
+import threading
+import traceback
+from args import Args
+from watcher import Watcher
+from replayindex import ReplayIndex
+
+
+
+def log( *msg ) :
+	print( time.strftime( "%X" ), *msg, flush=True )
+
+
+
+# A latched replay, waiting for its name.
+class SaveJob :
+	def __init__( self, label, watcher, tmpf, kwr ) :
+		self.label = label # the game or folder, for the log.
+		self.watcher = watcher
+		self.tmpf = tmpf
+		self.kwr = kwr
+
+
+
+class WatchService :
+	WORKERS = 2
+	QUEUE = 16
+
+	# args: Args, for the naming options and the akas.
+	# watches: ( label, last replay ) pairs.
+	# index_fname: the ReplayIndex db. Each thread opens its own connection.
+	# analyze: calculate APMs of the saved replays, for the replay viewer.
+	def __init__( self, args, watches, index_fname="cache.db",
+			workers=WORKERS, queue_size=QUEUE, analyze=False ) :
+		self.args = args
+		self.index_fname = index_fname
+		self.index = ReplayIndex( index_fname ) # the main thread's
+		self.nworkers = workers
+		self.analyze = analyze
+		self.jobs = queue.Queue( maxsize=queue_size )
+		self.threads = []
+
+		self.watchers = [] # ( label, Watcher )
+		for label, fname in watches :
+			w = Watcher( fname, index=self.index )
+			self.watchers.append( ( label, w ) )
+			log( "Watching", label, fname, "with", type( w.backend ).__name__ )
+
+		# Check as often as the most eager backend wants it.
+		self.interval = min( [ w.backend.INTERVAL for label, w in self.watchers ] + [ 2000 ] ) / 1000
+
+	def start( self ) :
+		for i in range( self.nworkers ) :
+			t = threading.Thread( target=self.work, name="saver-%d" % i )
+			t.start()
+			self.threads.append( t )
+
+	# Finishes the queued jobs, then stops the workers.
+	def stop( self ) :
+		for t in self.threads :
+			self.jobs.put( None )
+		for t in self.threads :
+			t.join()
+		self.threads = []
+		for label, w in self.watchers :
+			w.close()
+		self.index.close()
+
+	# Watch until Ctrl+C.
+	def run( self ) :
+		self.start()
+		try :
+			while True :
+				time.sleep( self.interval )
+				self.poll()
+		except KeyboardInterrupt :
+			log( "Stopping, %d job(s) to go" % self.jobs.qsize() )
+		finally :
+			self.stop()
+
+
+
+	###
+	### Main thread
+	###
+	def poll( self ) :
+		for label, w in self.watchers :
+			if not w.poll() :
+				continue
+			try :
+				tmpf, kwr = w.latch( w.last_replay )
+			except Exception as e :
+				log( label, "failed to latch", w.last_replay, e )
+				continue
+			self.submit( SaveJob( label, w, tmpf, kwr ) )
+
+	def submit( self, job ) :
+		try :
+			self.jobs.put_nowait( job )
+		except queue.Full :
+			log( job.label, "queue is full, saving without analysis" )
+			self.save( job, self.index )
+
+
+
+	###
+	### Workers
+	###
+	def work( self ) :
+		index = ReplayIndex( self.index_fname )
+		while True :
+			job = self.jobs.get()
+			if job == None :
+				break
+			try :
+				newf = self.save( job, index )
+				if self.analyze :
+					self.calc_apms( newf, job.kwr, index )
+			except Exception :
+				log( job.label, "job failed,", job.tmpf, "is left as it is" )
+				traceback.print_exc()
+		index.close()
+
+	def save( self, job, index ) :
+		args = self.args
+		newf = job.watcher.save_latched( job.tmpf, job.kwr,
+				add_username=args.add_username,
+				add_faction=args.add_faction,
+				add_vs_info=args.add_vs_info,
+				custom_date_format=args.custom_date_format,
+				index=index )
+		log( job.label, "Copied to", newf )
+		return newf
+
+	# Same as the replay viewer does it, when it shows the players.
+	def calc_apms( self, fname, kwr, index ) :
+		sha1 = index.file_hash( fname )
+		if index.lookup_apm( sha1 ) :
+			return
+		import analyzer
+		avg_apms = analyzer.quick_avg_apm( fname )
+		index.save_apm( sha1, [ int( val ) for val in avg_apms ] )
+
+
+
+# ( label, last replay ) pairs of the config and the command line, no duplicates.
+def find_watches( args, fnames ) :
+	watches = []
+	if args.cfg.has_section( "watch" ) :
+		watches.extend( args.cfg[ "watch" ].items() )
+	if args.last_replay :
+		watches.append( ( args.game, args.last_replay ) )
+	for fname in fnames :
+		watches.append( ( fname, fname ) )
+
+	result = []
+	seen = set()
+	for label, fname in watches :
+		key = os.path.normcase( os.path.abspath( fname ) )
+		if key in seen :
+			continue
+		seen.add( key )
+		result.append( ( label, fname ) )
+	return result
+
+
+
+def main() :
+	configf = "config.ini"
+	if len( sys.argv ) >= 2 :
+		configf = sys.argv[1]
+
+	args = Args( configf, ask=False )
+	watches = find_watches( args, sys.argv[2:] )
+	if not watches :
+		print( "Nothing to watch. Put last replays in the [watch] section of", configf )
+		sys.exit( 1 )
+
+	workers = int( args.get_var( "workers", WatchService.WORKERS, section="service" ) )
+	queue_size = int( args.get_var( "queue", WatchService.QUEUE, section="service" ) )
+	analyze = args.get_var( "analyze", "false", section="service" ).lower() in [ "1", "yes", "true", "on" ]
+
+	service = WatchService( args, watches,
+			workers=workers, queue_size=queue_size, analyze=analyze )
+	service.run()
+
+if __name__ == "__main__" :
+	main()